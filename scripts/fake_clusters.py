@@ -0,0 +1,157 @@
+"""Exercise ClusterRegistry placement and cleanup against fake API servers.
+
+Starts one stub Kubernetes API server per cluster on localhost. Each stub
+serves a GPU node, the database pods of its `storage` namespace and a few
+managed run namespaces, one of them past its rununtil. The script builds a
+KubernetesService per stub (host configurations, as with `k8s.clusters`
+entries that set `host`) and then:
+
+  * places a handful of runs and prints the cluster each one lands on,
+  * runs ClusterRegistry.cleanup_resources and prints the namespaces each
+    stub was asked to delete.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.fake_clusters
+"""
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+from app.src.services.cluster_registry import ClusterRegistry, build_configuration
+from app.src.services.kubernetes_service import KubernetesService
+from app.src.services.kubernetes_services.gpu_capacity_service import GPU_RESOURCE, GpuCapacityService
+from app.src.services.kubernetes_services.helm_service import HelmService
+from app.src.services.kubernetes_services.namespace_service import NamespaceService
+from app.src.services.kubernetes_services.persistent_volume_service import PersistentVolumeService
+from app.src.services.kubernetes_services.pod_service import PodService
+from app.src.services.kubernetes_services.secret_service import SecretService
+from app.src.services.kubernetes_services.service_account_service import ServiceAccountService
+from app.src.util.deadlines import DeadlineHeap
+
+CLUSTERS = [
+    {"name": "alpha", "gpus": 0, "databases": ["mysql-1"], "maxRuns": 4},
+    {"name": "beta", "gpus": 2, "databases": ["mysql-1", "mysql-2"], "maxRuns": 4},
+    {"name": "gamma", "gpus": 4, "databases": ["mysql-3"], "maxRuns": 8},
+]
+
+def namespace_item(name: str, run_until: datetime.datetime) -> dict:
+    return {
+        "metadata": {
+            "name": name,
+            "labels": {"app.kubernetes.io/managed-by": "secd"},
+            "annotations": {"userid": "fake-user", "rununtil": run_until.isoformat()},
+        },
+        "status": {"phase": "Active"},
+    }
+
+def item_list(kind: str, items: list) -> dict:
+    return {"kind": kind, "apiVersion": "v1", "metadata": {}, "items": items}
+
+class FakeApiServer(ThreadingHTTPServer):
+    """Just enough of the core/v1 API for placement and namespace cleanup."""
+    def __init__(self, name: str, gpus: int, databases: list):
+        super().__init__(("127.0.0.1", 0), FakeApiHandler)
+        self.name = name
+        self.gpus = gpus
+        self.databases = databases
+        now = datetime.datetime.now()
+        self.namespaces = {
+            f"secd-{name}-expired": namespace_item(f"secd-{name}-expired", now - datetime.timedelta(hours=1)),
+            f"secd-{name}-running": namespace_item(f"secd-{name}-running", now + datetime.timedelta(hours=1)),
+        }
+        self.deleted = []
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")[2:]
+        if parts == ["nodes"]:
+            allocatable = {GPU_RESOURCE: str(self.server.gpus)} if self.server.gpus else {}
+            node = {"metadata": {"name": f"{self.server.name}-node"}, "spec": {}, "status": {"allocatable": allocatable}}
+            return self._reply(item_list("NodeList", [node]))
+        if parts == ["namespaces"]:
+            return self._reply(item_list("NamespaceList", list(self.server.namespaces.values())))
+        if len(parts) == 2 and parts[0] == "namespaces":
+            namespace = self.server.namespaces.get(parts[1])
+            return self._reply(namespace) if namespace else self._reply({"kind": "Status", "code": 404}, 404)
+        if parts == ["namespaces", "storage", "pods"]:
+            selector = query.get("labelSelector", [""])[0]
+            pods = [
+                {"metadata": {"name": f"{database}-0", "labels": {"name": database}}, "spec": {"containers": []}}
+                for database in self.server.databases if selector == f"name={database}"
+            ]
+            return self._reply(item_list("PodList", pods))
+        # Pods, PVCs and service accounts: none
+        return self._reply(item_list("List", []))
+
+    def do_DELETE(self):
+        parts = urlparse(self.path).path.strip("/").split("/")[2:]
+        if len(parts) == 2 and parts[0] == "namespaces":
+            self.server.namespaces.pop(parts[1], None)
+            self.server.deleted.append(parts[1])
+        self._reply({"kind": "Status", "status": "Success"})
+
+    def _reply(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def kubernetes_service(config, deadlines: DeadlineHeap) -> KubernetesService:
+    return KubernetesService(
+        namespace_service=NamespaceService(config=config),
+        pod_service=PodService(config=config),
+        pv_service=PersistentVolumeService(config=config),
+        secret_service=SecretService(config=config),
+        helm_service=HelmService(config=config),
+        service_account_service=ServiceAccountService(config=config),
+        gpu_service=GpuCapacityService(config=config),
+        cache_service=None,
+        deadlines=deadlines
+    )
+
+def main():
+    deadlines = DeadlineHeap()
+    servers = {}
+    clusters = {}
+    for cluster in CLUSTERS:
+        server = FakeApiServer(cluster["name"], cluster["gpus"], cluster["databases"])
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[cluster["name"]] = server
+        config = build_configuration({"name": cluster["name"], "host": f"http://127.0.0.1:{server.server_port}"})
+        clusters[cluster["name"]] = kubernetes_service(config, deadlines)
+    registry = ClusterRegistry(clusters, deadlines, cache_service=None, max_runs={c["name"]: c["maxRuns"] for c in CLUSTERS})
+
+    runs = [
+        ("cpu-mysql-1", "mysql-1", False),
+        ("cpu-mysql-1-b", "mysql-1", False),
+        ("gpu-mysql-1", "mysql-1", True),
+        ("cpu-mysql-3", "mysql-3", False),
+        ("gpu-any", None, True),
+        ("cpu-any", None, False),
+        ("cpu-unknown-db", "mysql-9", False),
+    ]
+    print("placements:")
+    for run_id, database_name, gpu in runs:
+        run = SimpleNamespace(run_id=run_id, database_name=database_name, metadata={"gpu": gpu}, cluster=None)
+        print(f"  {run_id:16} database={str(database_name):8} gpu={str(gpu):5} -> {registry.place(run)}")
+    print(f"status: {registry.status()}")
+
+    registry.cleanup_resources()
+    print("cleanup:")
+    for name, server in servers.items():
+        print(f"  {name:6} deleted {server.deleted}, kept {sorted(server.namespaces)}")
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Exercise GpuCapacityService against a fake CoreV1Api with synthetic nodes.
+
+The fake API serves --nodes GPU nodes with --gpus GPUs each and counts the
+GPU pods it has been told about. The script queues more GPU runs than fit
+and checks that:
+
+  * runs are granted in FIFO order while capacity lasts and the rest wait,
+  * a reservation is handed to the next run when a pod is bound (its
+    request then shows up in the pod list) and later finishes,
+  * a queued run that is released is withdrawn and never reserves GPUs,
+  * release() and bind() are not held up by a slow list call.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.gpu_queue_check --nodes 2 --gpus 2
+"""
+import argparse
+import threading
+import time
+from types import SimpleNamespace
+
+from app.src.services.kubernetes_services.gpu_capacity_service import GPU_RESOURCE, GpuCapacityService
+
+class FakeCoreV1Api():
+    def __init__(self, nodes: int, gpus: int, list_delay: float = 0.0):
+        self.nodes = [
+            SimpleNamespace(metadata=SimpleNamespace(name=f"node-{i}"), spec=SimpleNamespace(unschedulable=False), status=SimpleNamespace(allocatable={GPU_RESOURCE: str(gpus)}))
+            for i in range(nodes)
+        ]
+        self.pods = {}
+        self.list_delay = list_delay
+        self._lock = threading.Lock()
+
+    def bind_pod(self, run_id: str, node_name: str) -> None:
+        resources = SimpleNamespace(requests={GPU_RESOURCE: "1"}, limits={GPU_RESOURCE: "1"})
+        with self._lock:
+            self.pods[run_id] = SimpleNamespace(spec=SimpleNamespace(node_name=node_name, containers=[SimpleNamespace(resources=resources)]))
+
+    def finish_pod(self, run_id: str) -> None:
+        with self._lock:
+            self.pods.pop(run_id, None)
+
+    def list_node(self, limit=None, _continue=None, **kwargs):
+        return self._page(self.nodes)
+
+    def list_pod_for_all_namespaces(self, limit=None, _continue=None, **kwargs):
+        time.sleep(self.list_delay)
+        with self._lock:
+            return self._page(list(self.pods.values()))
+
+    def _page(self, items):
+        return SimpleNamespace(items=items, metadata=SimpleNamespace(_continue=None))
+
+def acquire_in_background(service: GpuCapacityService, run_id: str, granted: list, failed: list) -> threading.Thread:
+    def run():
+        try:
+            service.acquire(run_id)
+            granted.append(run_id)
+        except Exception as e:
+            failed.append((run_id, str(e)))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def check(label: str, ok: bool) -> None:
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    if not ok:
+        raise SystemExit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=2)
+    parser.add_argument("--gpus", type=int, default=2)
+    args = parser.parse_args()
+    capacity = args.nodes * args.gpus
+
+    api = FakeCoreV1Api(args.nodes, args.gpus)
+    service = GpuCapacityService(api=api, poll_interval=0.05)
+    granted, failed = [], []
+    runs = [f"run-{i}" for i in range(capacity + 2)]
+    for run_id in runs:
+        acquire_in_background(service, run_id, granted, failed)
+        # Queue order is arrival order
+        wait_for(lambda: run_id in service._queue or run_id in granted, timeout=1)
+
+    print(f"{args.nodes} nodes x {args.gpus} GPUs, {len(runs)} GPU runs queued")
+    check(f"first {capacity} runs granted in order", wait_for(lambda: len(granted) == capacity) and granted == runs[:capacity])
+    time.sleep(0.2)
+    check("remaining runs wait", len(granted) == capacity and not failed)
+
+    # The last queued run gives up before any capacity frees
+    service.release(runs[-1])
+    check("released queued run is withdrawn", wait_for(lambda: any(run_id == runs[-1] for run_id, _ in failed)))
+
+    # Bound pods replace reservations one for one, so nothing new fits yet
+    for i, run_id in enumerate(granted[:capacity]):
+        api.bind_pod(run_id, f"node-{i // args.gpus}")
+        service.bind(run_id)
+    time.sleep(0.2)
+    check("binding pods does not free capacity", len(granted) == capacity)
+
+    api.finish_pod(runs[0])
+    check("finished pod lets the next run in", wait_for(lambda: runs[capacity] in granted))
+    check("withdrawn run never reserved GPUs", runs[-1] not in service._reserved)
+
+    api.list_delay = 1.0
+    acquire_in_background(service, "slow-list", granted, failed)
+    time.sleep(0.1)
+    start = time.monotonic()
+    service.release(runs[capacity])
+    check(f"release during a slow list returns in {time.monotonic() - start:.3f}s", time.monotonic() - start < 0.5)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measure webhook validation throughput for the intake path.
+
+Builds a synthetic GitLab push payload with --commits commits and times
+three ways of handling it:
+
+  * compiling a new Cerberus Validator and json.loads per request
+    (what the hook did before),
+  * a cached Validator with push_filter.loads (orjson when installed),
+  * push_filter.reject_reason on the raw bytes of a secd- branch push,
+    which answers without parsing the body at all.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.hook_validation_benchmark --requests 20000
+"""
+import argparse
+import json
+import time
+
+from cerberus import Validator
+
+from app.src.util.push_filter import PUSH_SCHEMA, loads, orjson, reject_reason
+
+def payload(ref: str, commits: int) -> bytes:
+    return json.dumps({
+        "object_kind": "push",
+        "event_name": "push",
+        "before": "0" * 40,
+        "after": "1" * 40,
+        "ref": ref,
+        "user_id": 4,
+        "user_name": "John Smith",
+        "project_id": 15,
+        "project": {"id": 15, "name": "secd-sample", "http_url": "https://gitlab.example.com/group/secd-sample.git"},
+        "commits": [
+            {"id": f"{i:040x}", "message": "Update analysis\n", "timestamp": "2024-01-01T00:00:00Z",
+             "author": {"name": "John Smith", "email": "john@example.com"},
+             "added": ["analysis.py"], "modified": ["Dockerfile"], "removed": []}
+            for i in range(commits)
+        ],
+        "total_commits_count": commits,
+    }).encode()
+
+def uncached(raw: bytes):
+    validator = Validator(PUSH_SCHEMA)
+    validator.allow_unknown = True
+    return validator.validate(json.loads(raw))
+
+def cached_validator():
+    validator = Validator(PUSH_SCHEMA)
+    validator.allow_unknown = True
+    return lambda raw: validator.validate(loads(raw))
+
+def rate(fn, raw: bytes, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn(raw)
+    return requests / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--commits", type=int, default=3)
+    args = parser.parse_args()
+
+    main_push = payload("refs/heads/main", args.commits)
+    automated_push = payload("refs/heads/secd-2024-01-01_00.00.00-run", args.commits)
+
+    baseline = rate(uncached, main_push, args.requests)
+    print(f"payload: {len(main_push)} bytes, {args.commits} commits, orjson {'on' if orjson else 'off'}")
+    print(f"  new Validator + json.loads: {baseline:10.0f} validations/s")
+    for name, fn, raw in [
+        ("cached Validator + loads:  ", cached_validator(), main_push),
+        ("reject_reason (secd- ref): ", reject_reason, automated_push),
+    ]:
+        per_second = rate(fn, raw, args.requests)
+        print(f"  {name}{per_second:10.0f} validations/s ({per_second / baseline:.1f}x)")
+
+if __name__ == "__main__":
+    main()
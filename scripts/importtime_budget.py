@@ -0,0 +1,68 @@
+"""Import-time budget check for the secd intake path.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter,
+reports the slowest imports by cumulative time, and fails when the total
+exceeds the budget (DEFAULT_BUDGET_MS for the server module unless
+--budget-ms is given; 0 turns the check off) or when a forbidden package
+was loaded.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.importtime_budget
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULE = "app.src.util.server"
+# Intake without the docker and hvac stacks; raise it only with a reason
+DEFAULT_BUDGET_MS = 400
+DEFAULT_FORBIDDEN = ["docker", "hvac"]
+
+def measure(module: str, cwd: str):
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}, sys; print(' '.join(sorted(sys.modules)))"]
+    proc = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{proc.stderr}")
+
+    timings = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting depth is encoded as two extra spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    loaded = set(proc.stdout.split())
+    return timings, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="fail if total import time exceeds this (0: no budget)")
+    parser.add_argument("--forbid", nargs="*", default=DEFAULT_FORBIDDEN, help="packages that must not be imported")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--cwd", default=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    args = parser.parse_args()
+
+    timings, loaded = measure(args.module, args.cwd)
+    top_level = [t for t in timings if t[3] == 0]
+    total_ms = sum(t[2] for t in top_level) / 1000
+
+    print(f"{args.module}: {total_ms:.1f} ms total, {len(timings)} modules")
+    for name, self_us, cumulative_us, _ in sorted(top_level, key=lambda t: -t[2])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    forbidden = [pkg for pkg in args.forbid if pkg in loaded]
+    if forbidden:
+        print(f"FAIL: forbidden packages imported: {', '.join(forbidden)}")
+        failed = True
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"FAIL: {total_ms:.1f} ms exceeds budget of {args.budget_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Compare the Kubernetes client's model objects with lean records for list responses.
+
+Builds a synthetic NamespaceList and PodList of --items entries, then for
+each kind deserialises it through `ApiClient.deserialize` (what a plain
+`list_namespace()` call does) and through the `_preload_content=False`
+path used by the cleanup loop. Reports CPU time and peak traced memory
+while the result is held.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.k8s_list_benchmark --items 5000
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from kubernetes import client
+
+from app.src.services.kubernetes_services.records import NamespaceRecord, PodRecord
+
+def namespace_item(i: int) -> dict:
+    return {
+        "metadata": {
+            "name": f"secd-{i:032x}",
+            "uid": f"{i:08x}-0000-0000-0000-000000000000",
+            "resourceVersion": str(100000 + i),
+            "creationTimestamp": "2024-01-01T00:00:00Z",
+            "labels": {"name": "mysql-1", "app.kubernetes.io/managed-by": "secd", "secd/run-id": f"{i:032x}"},
+            "annotations": {"userid": "0c5d-user", "rununtil": "2024-01-02T00:00:00"},
+            "managedFields": [{"manager": "python", "operation": "Update", "apiVersion": "v1",
+                               "time": "2024-01-01T00:00:00Z", "fieldsType": "FieldsV1",
+                               "fieldsV1": {"f:metadata": {"f:labels": {".": {}, "f:name": {}}}}}],
+        },
+        "spec": {"finalizers": ["kubernetes"]},
+        "status": {"phase": "Active"},
+    }
+
+def pod_item(i: int) -> dict:
+    container = {
+        "name": f"secd-{i:032x}",
+        "image": f"registry/project/{i:032x}",
+        "env": [{"name": "DB_HOST", "value": "service-mysql-1.storage.svc.cluster.local"}],
+        "volumeMounts": [{"name": "output", "mountPath": "/output"}],
+        "resources": {},
+    }
+    return {
+        "metadata": {"name": f"secd-{i:032x}", "namespace": f"secd-{i:032x}",
+                     "labels": {"name": "mysql-1", "run_id": f"{i:032x}"},
+                     "annotations": {"vault.hashicorp.com/agent-inject": "true"}},
+        "spec": {"containers": [container], "serviceAccountName": "sa-mysql-1", "nodeName": "node-1",
+                 "volumes": [{"name": "output", "persistentVolumeClaim": {"claimName": f"secd-pvc-{i:032x}-output"}}]},
+        "status": {
+            "phase": "Running",
+            "conditions": [{"type": "Ready", "status": "True", "lastTransitionTime": "2024-01-01T00:00:00Z"}],
+            "containerStatuses": [
+                {"name": f"secd-{i:032x}", "ready": True, "restartCount": 0, "image": "image",
+                 "imageID": "sha256:0", "state": {"running": {"startedAt": "2024-01-01T00:00:00Z"}}},
+                {"name": "vault-agent", "ready": True, "restartCount": 0, "image": "vault",
+                 "imageID": "sha256:1", "state": {"running": {"startedAt": "2024-01-01T00:00:00Z"}}},
+            ],
+        },
+    }
+
+class RawResponse():
+    def __init__(self, data: bytes):
+        self.data = data
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.process_time()
+    result = fn()
+    seconds = time.process_time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return seconds, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    args = parser.parse_args()
+
+    api_client = client.ApiClient()
+    cases = [
+        ("namespaces", "V1NamespaceList", namespace_item, NamespaceRecord),
+        ("pods", "V1PodList", pod_item, PodRecord),
+    ]
+    for kind, model, make_item, record in cases:
+        data = json.dumps({"apiVersion": "v1", "kind": "List", "metadata": {},
+                           "items": [make_item(i) for i in range(args.items)]}).encode()
+        model_s, model_peak = measure(lambda: api_client.deserialize(RawResponse(data), model).items)
+        lean_s, lean_peak = measure(lambda: [record(item) for item in json.loads(data)["items"]])
+        print(f"{kind}: {args.items} items, {len(data) / 1e6:.1f} MB")
+        print(f"  model objects: {model_s * 1000:8.1f} ms CPU, {model_peak / 1e6:7.1f} MB peak")
+        print(f"  lean records:  {lean_s * 1000:8.1f} ms CPU, {lean_peak / 1e6:7.1f} MB peak "
+              f"({model_s / lean_s if lean_s else 0:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
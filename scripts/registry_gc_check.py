@@ -0,0 +1,166 @@
+"""Exercise ImageGcService against a local registry stand-in and fake images.
+
+Starts a stub Docker Registry HTTP API v2 on localhost that keeps a tag per
+run image in memory and answers the manifest HEAD and DELETE calls that
+RegistryClient makes (like registry:2 with
+REGISTRY_STORAGE_DELETE_ENABLED=true, or without it when --no-delete is
+given). The build host is a fake DockerService holding one image per run.
+The script runs one collection pass and checks that:
+
+  * the images and tags of finished runs are removed,
+  * images of active runs are kept, however old,
+  * images older than maxAgeHours and beyond keepPerProject go, but none
+    younger than graceSeconds,
+  * a tag missing from the registry or a refused delete does not stop the
+    pass.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.registry_gc_check
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from app.src.services.image_gc_service import PROJECT_LABEL, RUN_ID_LABEL, ImageGcService, RegistryClient
+
+REGISTRY_PROJECT = "secd"
+HOUR = 3600
+
+# run id: (project, age in hours, in the registry)
+IMAGES = {
+    "finished": ("alpha", 2, True),
+    "active-old": ("alpha", 48, True),
+    "stale": ("beta", 30, True),
+    "beta-new-1": ("beta", 3, True),
+    "beta-new-2": ("beta", 4, True),
+    "beta-new-3": ("beta", 5, True),
+    "young": ("gamma", 0.1, True),
+    "untagged": ("gamma", 40, False),
+}
+ACTIVE = {"active-old"}
+FINISHED = {"finished"}
+
+class FakeRegistry(ThreadingHTTPServer):
+    """The manifest endpoints of the registry API, with one tag per repository."""
+    def __init__(self, delete_enabled: bool):
+        super().__init__(("127.0.0.1", 0), FakeRegistryHandler)
+        self.delete_enabled = delete_enabled
+        self.tags = {}
+        self.deleted = []
+
+    def push(self, repository: str) -> None:
+        self.tags[repository] = "sha256:" + hashlib.sha256(repository.encode()).hexdigest()
+
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        repository, reference = self._manifest()
+        digest = self.server.tags.get(repository)
+        if digest is None or reference not in ("latest", digest):
+            return self._reply(404)
+        self._reply(200, {"Docker-Content-Digest": digest})
+
+    def do_DELETE(self):
+        repository, reference = self._manifest()
+        if not self.server.delete_enabled:
+            return self._reply(405, body={"errors": [{"code": "UNSUPPORTED"}]})
+        if self.server.tags.get(repository) != reference:
+            return self._reply(404)
+        del self.server.tags[repository]
+        self.server.deleted.append(repository)
+        self._reply(202)
+
+    def _manifest(self):
+        repository, _, reference = self.path[len("/v2/"):].partition("/manifests/")
+        return repository, reference
+
+    def _reply(self, status: int, headers: dict = None, body: dict = None):
+        payload = json.dumps(body).encode() if body else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if payload and self.command != "HEAD":
+            self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+class FakeDockerService():
+    """The image calls ImageGcService makes, over an in-memory image list."""
+    def __init__(self, now: float):
+        self.images = {}
+        for run_id, (project, age_hours, _) in IMAGES.items():
+            self.images[run_id] = SimpleNamespace(
+                id=f"sha256:{run_id}",
+                labels={RUN_ID_LABEL: run_id, PROJECT_LABEL: project},
+                attrs={"Size": 100 * 1024 * 1024, "Created": now - age_hours * HOUR},
+                tags=[f"registry.local/{REGISTRY_PROJECT}/{run_id}:latest"],
+            )
+
+    def list_run_images(self, label: str):
+        return [image for image in self.images.values() if label in image.labels]
+
+    def created_at(self, image) -> float:
+        return image.attrs["Created"]
+
+    def remove_image(self, image_id: str, force: bool = False) -> None:
+        run_id = next(run_id for run_id, image in self.images.items() if image.id == image_id)
+        del self.images[run_id]
+
+    def prune_dangling(self) -> int:
+        return 0
+
+def check(label: str, ok: bool) -> None:
+    print(f"  {'ok  ' if ok else 'FAIL'} {label}")
+    if not ok:
+        raise SystemExit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--no-delete", action="store_true", help="registry refuses deletes, like REGISTRY_STORAGE_DELETE_ENABLED=false")
+    args = parser.parse_args()
+
+    registry = FakeRegistry(delete_enabled=not args.no_delete)
+    threading.Thread(target=registry.serve_forever, daemon=True).start()
+    for run_id, (_, _, tagged) in IMAGES.items():
+        if tagged:
+            registry.push(f"{REGISTRY_PROJECT}/{run_id}")
+
+    docker = FakeDockerService(time.time())
+    service = ImageGcService(
+        docker_service=docker,
+        registry=RegistryClient(api_url=f"http://127.0.0.1:{registry.server_port}"),
+        registry_project=REGISTRY_PROJECT,
+        active_runs=lambda: set(ACTIVE),
+        max_age_hours=24,
+        keep_per_project=2,
+        grace_seconds=HOUR,
+    )
+    for run_id in FINISHED:
+        service.finish(run_id)
+    stats = service.collect()
+    print(f"collected: {stats}")
+    print(f"  images left: {sorted(docker.images)}")
+    print(f"  registry tags left: {sorted(registry.tags)}")
+
+    removed = set(IMAGES) - set(docker.images)
+    expected = {"finished", "stale", "beta-new-3", "untagged"}
+    check("finished, too old and surplus images removed", removed == expected)
+    check("active run's image kept", "active-old" in docker.images)
+    check("image inside the grace period kept", "young" in docker.images)
+    if args.no_delete:
+        check("refused deletes leave every tag in place", not registry.deleted)
+    else:
+        tagged = {run_id for run_id in expected if IMAGES[run_id][2]}
+        check("registry tags of removed images deleted", set(registry.deleted) == {f"{REGISTRY_PROJECT}/{run_id}" for run_id in tagged})
+        check("registry tag count matches", stats["registry_tags"] == len(tagged))
+    registry.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Run several coordinating replicas on this machine and kill one of them.
+
+Starts --replicas processes that share a FileLeaseStore in a temporary
+directory, each running a Coordinator with short leases. The script then:
+
+  * waits until they agree on the members and checks there is exactly one
+    leader and that every sample run id has exactly one owner,
+  * kills the leader with SIGKILL, so it releases nothing, and checks a
+    survivor takes over within the lease duration and that only the dead
+    replica's run ids changed owner,
+  * starts a new replica and reports how many run ids moved to it.
+
+Run as a module from the directory that contains the `app` package:
+
+    python -m app.scripts.replicas --replicas 4
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import signal
+import tempfile
+import time
+
+from app.src.dto.run import new_run_id
+from app.src.util.coordination import Coordinator, FileLeaseStore
+
+LEASE_DURATION = 3
+RENEW_INTERVAL = 1
+
+def replica(identity: str, path: str, run_ids: list, reports: multiprocessing.Queue):
+    coordinator = Coordinator(
+        store=FileLeaseStore(path),
+        identity=identity,
+        address=f"http://127.0.0.1/{identity}",
+        lease_duration=LEASE_DURATION,
+        renew_interval=RENEW_INTERVAL
+    )
+    coordinator.start()
+    while True:
+        owned = [run_id for run_id in run_ids if coordinator.owns(run_id)]
+        reports.put({"identity": identity, "pid": os.getpid(), "leader": coordinator.is_leader, "members": coordinator.members(), "owned": owned})
+        time.sleep(0.2)
+
+class Cluster():
+    def __init__(self, path: str, run_ids: list):
+        self.path = path
+        self.run_ids = run_ids
+        self.reports = multiprocessing.Queue()
+        self.processes = {}
+        self.latest = {}
+
+    def spawn(self, identity: str) -> None:
+        process = multiprocessing.Process(target=replica, args=(identity, self.path, self.run_ids, self.reports), daemon=True)
+        process.start()
+        self.processes[identity] = process
+
+    def kill(self, identity: str) -> None:
+        os.kill(self.processes.pop(identity).pid, signal.SIGKILL)
+        self.latest.pop(identity, None)
+
+    def settle(self, timeout: float) -> float:
+        """Seconds until the live replicas agree on the members and on one leader."""
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            try:
+                report = self.reports.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if report["identity"] in self.processes:
+                self.latest[report["identity"]] = report
+            if self.agreed():
+                return time.monotonic() - start
+        raise Exception(f"Replicas did not agree within {timeout}s: {self.latest}")
+
+    def agreed(self) -> bool:
+        live = sorted(self.processes)
+        if sorted(self.latest) != live:
+            return False
+        if any(report["members"] != live for report in self.latest.values()):
+            return False
+        return sum(report["leader"] for report in self.latest.values()) == 1
+
+    def leader(self) -> str:
+        return next(identity for identity, report in self.latest.items() if report["leader"])
+
+    def owners(self) -> dict:
+        owners = {}
+        for identity, report in self.latest.items():
+            for run_id in report["owned"]:
+                if run_id in owners:
+                    raise Exception(f"Run {run_id} owned by {owners[run_id]} and {identity}")
+                owners[run_id] = identity
+        missing = set(self.run_ids) - set(owners)
+        if missing:
+            raise Exception(f"{len(missing)} run ids have no owner")
+        return owners
+
+    def shares(self) -> str:
+        owners = self.owners()
+        return ", ".join(f"{identity}={list(owners.values()).count(identity)}" for identity in sorted(self.latest))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    run_ids = [new_run_id() for _ in range(args.runs)]
+    with tempfile.TemporaryDirectory() as path:
+        cluster = Cluster(path, run_ids)
+        for i in range(args.replicas):
+            cluster.spawn(f"replica-{i}")
+        seconds = cluster.settle(timeout=LEASE_DURATION * 4)
+        before = cluster.owners()
+        leader = cluster.leader()
+        print(f"{args.replicas} replicas agreed after {seconds:.1f}s, leader {leader}")
+        print(f"  run ids per replica: {cluster.shares()}")
+
+        cluster.kill(leader)
+        seconds = cluster.settle(timeout=LEASE_DURATION * 4)
+        after = cluster.owners()
+        moved = [run_id for run_id in run_ids if before[run_id] != after[run_id]]
+        print(f"killed {leader}; {cluster.leader()} took over after {seconds:.1f}s")
+        print(f"  run ids per replica: {cluster.shares()}")
+        print(f"  moved {len(moved)} run ids, all from {leader}: {all(before[run_id] == leader for run_id in moved)}")
+
+        cluster.spawn("replica-new")
+        seconds = cluster.settle(timeout=LEASE_DURATION * 4)
+        joined = cluster.owners()
+        moved = [run_id for run_id in run_ids if after[run_id] != joined[run_id]]
+        print(f"replica-new joined after {seconds:.1f}s, leader still {cluster.leader()}")
+        print(f"  run ids per replica: {cluster.shares()}")
+        print(f"  moved {len(moved)} run ids, all to replica-new: {all(joined[run_id] == 'replica-new' for run_id in moved)}")
+
+        for identity in list(cluster.processes):
+            cluster.kill(identity)
+
+if __name__ == "__main__":
+    main()
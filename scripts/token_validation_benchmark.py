@@ -0,0 +1,95 @@
+"""Compare local JWT verification with token introspection.
+
+Signs an access token with a freshly generated RSA key and validates it
+--requests times three ways:
+
+  * JwksVerifier.verify against the cached key set (the default path),
+  * an introspection POST per token to a stub endpoint on localhost, which
+    is the best case for the introspection round trip,
+  * introspection answered from the TokenCache after the first call.
+
+Real Keycloak introspection adds its own processing and the network on
+top of the loopback numbers. Run from the directory that contains the
+`app` package:
+
+    python -m app.scripts.token_validation_benchmark --requests 5000
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from jwcrypto import jwk, jwt
+
+from app.src.services.token_verifier import JwksVerifier, TokenCache, token_key
+
+ISSUER = "http://localhost/realms/secd"
+
+class IntrospectionStub(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"active": True, "exp": int(time.time()) + 300}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def signed_token(key: jwk.JWK) -> str:
+    claims = {"iss": ISSUER, "sub": "user", "exp": int(time.time()) + 300, "iat": int(time.time()), "azp": "gitlab"}
+    token = jwt.JWT(header={"alg": "RS256", "kid": key.key_id, "typ": "JWT"}, claims=claims)
+    token.make_signed_token(key)
+    return token.serialize()
+
+def rate(fn, requests_count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        fn()
+    return requests_count / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    key = jwk.JWK.generate(kty="RSA", size=2048, kid="bench")
+    keyset = {"keys": [json.loads(key.export_public())]}
+    token = signed_token(key)
+    verifier = JwksVerifier(fetch_jwks=lambda: keyset, issuer=ISSUER)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), IntrospectionStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/token/introspect"
+    session = requests.Session()
+
+    def introspect():
+        return session.post(url, data={"token": token, "client_id": "bench"}).json()["active"]
+
+    cache = TokenCache()
+
+    def introspect_cached():
+        digest = token_key(token)
+        if cache.get(digest):
+            return True
+        answer = session.post(url, data={"token": token, "client_id": "bench"}).json()
+        cache.put(digest, answer["active"], answer["exp"])
+        return answer["active"]
+
+    baseline = rate(introspect, args.requests)
+    print(f"token: {len(token)} bytes, RS256")
+    print(f"  introspection (loopback):  {baseline:10.0f} validations/s")
+    for name, fn in [
+        ("local JWKS verification:   ", lambda: verifier.verify(token)),
+        ("cached introspection:      ", introspect_cached),
+    ]:
+        per_second = rate(fn, args.requests)
+        print(f"  {name}{per_second:10.0f} validations/s ({per_second / baseline:.1f}x)")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,13 @@ from dataclasses import dataclass, field, asdict
 from typing import Any, Dict, Optional
 from app.src.util.setup import get_settings
 
+def new_run_id() -> str:
+    return str(uuid.uuid4()).replace('-', '')
+
 @dataclass
 class Run:
     # auto-generated core fields
-    run_id:    str                                  = field(default_factory=lambda: str(uuid.uuid4()).replace('-', ''))
+    run_id:    str                                  = field(default_factory=new_run_id)
     date:      str                                  = field(init=False)
     namespace: str                                  = field(init=False)
     repo_path: str                                  = field(init=False)
@@ -28,6 +31,10 @@ class Run:
     pvc_name:        Optional[str]                  = None
     vault_role_name: Optional[str]                  = None
     service_name:    Optional[str]                  = None
+    service_account_name: Optional[str]             = None
+    project_id:      Any                            = None
+    commit_sha:      Optional[str]                  = None
+    cluster:         Optional[str]                  = None
 
     def __post_init__(self):
         self.date = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.src.dto.run import Run
+from app.src.services.hook_service import HookService
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.resilience import deadline_budget
+from app.src.util.setup import get_settings
+
+DEFAULT_WORKERS = 16
+DEFAULT_STAGE_TIMEOUTS = {
+    "validate": 60,
+    "authorize": 60,
+    "metadata": 60,
+    "clone": 600,
+    "build": 1800,
+    "admit": None,
+    "provision": 600,
+}
+# Stages that wait for capacity rather than work; they get their own thread
+WAITING_STAGES = ("admit",)
+
+class AsyncHookService():
+    """Runs the HookService pipeline as coroutines on one event loop.
+
+    The backend clients are blocking, so every stage is handed to a bounded
+    executor and awaited with its own timeout. Admission can wait for hours,
+    so it waits on a thread of its own and never holds an executor worker
+    that an admitted run needs for provisioning. A cancelled or timed out
+    run stops before its next stage starts.
+    """
+    def __init__(
+        self,
+        hook_service: HookService,
+        max_workers: int = DEFAULT_WORKERS,
+        stage_timeouts: Optional[Dict[str, float]] = None,
+    ):
+        self.hook_service = hook_service
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="secd-stage")
+        self.stage_timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {})}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.cancel_superseded = get_settings().get('debounce', {}).get('cancelSuperseded', False)
+        self._in_flight: Dict[Any, str] = {}
+        self._provisioning = set()
+
+    def submit(self, body: Dict[str, Any], run_id: Optional[str] = None) -> str:
+        run = Run(run_id=run_id) if run_id else Run()
+        project_id = body.get('project_id') if isinstance(body, dict) else None
+        previous = self._in_flight.get(project_id)
+        if previous and self.cancel_superseded and previous not in self._provisioning:
+            if self.cancel(previous):
+                metrics.inc("runs_superseded")
+                log(f"Run {previous} superseded by run {run.run_id}, cancelling")
+        if project_id is not None:
+            self._in_flight[project_id] = run.run_id
+
+        task = asyncio.get_running_loop().create_task(self.create(run, body))
+        self.tasks[run.run_id] = task
+        task.add_done_callback(lambda _: self._done(project_id, run.run_id))
+        return run.run_id
+
+    def _done(self, project_id: Any, run_id: str):
+        self.tasks.pop(run_id, None)
+        self._provisioning.discard(run_id)
+        if self._in_flight.get(project_id) == run_id:
+            del self._in_flight[project_id]
+
+    def cancel(self, run_id: str) -> bool:
+        task = self.tasks.get(run_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    async def create(self, run: Run, body: Dict[str, Any]):
+        hook = self.hook_service
+        provisioned = False
+        try:
+            # Backend calls share one budget per phase; admission queueing is not counted
+            run_budget = get_settings().get('resilience', {}).get('runBudget')
+            with deadline_budget(run_budget):
+                if not await self._stage("validate", hook._validate, body):
+                    return
+                await self._stage("authorize", hook._authorize, run, body)
+                await self._stage("metadata", hook._load_metadata, run, body)
+                await self._stage("clone", hook._clone, run, body)
+                await self._stage("build", hook._build_image, run)
+                hook._fill_run(run)
+            await self._stage("admit", hook._admit, run)
+            self._provisioning.add(run.run_id)
+            with deadline_budget(run_budget):
+                await self._stage("provision", hook._provision, run)
+            provisioned = True
+
+        except asyncio.CancelledError:
+            log(f"Run {run.run_id} cancelled", "WARNING")
+            hook.scheduler.release(run.run_id)
+            hook.clusters.release(run.run_id)
+            raise
+        except Exception as e:
+            log(f"Error in async create process for run {run.run_id}: {str(e)}", "ERROR")
+        finally:
+            if not provisioned:
+                hook._release_workspace(run.run_id)
+                # Vault calls block, keep them off the event loop
+                self.executor.submit(hook._release_grants, run.run_id)
+
+    async def _stage(self, name: str, fn: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        # Carry the run's deadline budget into the worker thread
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args)
+        if name in WAITING_STAGES:
+            future = self._on_own_thread(loop, call)
+        else:
+            future = loop.run_in_executor(self.executor, call)
+        try:
+            return await asyncio.wait_for(future, timeout=self.stage_timeouts.get(name))
+        except asyncio.TimeoutError:
+            raise Exception(f"Stage '{name}' timed out after {self.stage_timeouts.get(name)}s")
+
+    def _on_own_thread(self, loop: asyncio.AbstractEventLoop, call: Callable) -> asyncio.Future:
+        # A cancelled run is withdrawn from the scheduler and GPU queues, which ends the wait
+        future = loop.create_future()
+
+        def settle(result: Any = None, error: Optional[BaseException] = None):
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            try:
+                result = call()
+            except BaseException as e:
+                loop.call_soon_threadsafe(settle, None, e)
+            else:
+                loop.call_soon_threadsafe(settle, result)
+
+        threading.Thread(target=run, name="secd-admit", daemon=True).start()
+        return future
+
+    def shutdown(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
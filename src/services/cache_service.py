@@ -0,0 +1,231 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS caches (
+    user_id     TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    user_id TEXT NOT NULL,
+    name    TEXT NOT NULL,
+    relpath TEXT NOT NULL,
+    mtime   REAL NOT NULL,
+    bytes   INTEGER NOT NULL,
+    PRIMARY KEY (user_id, name, relpath)
+);
+"""
+
+class CacheService():
+    """Tracks and bounds the per-user cache directories under cachePath.
+
+    Sizes live in a small SQLite index, one row per directory holding the
+    bytes of the files directly in it. A scan only stats the files of
+    directories whose mtime changed since the last scan, so an unchanged
+    tree costs one listing per directory. Files rewritten in place without
+    a directory change are picked up when their directory next changes.
+
+    With several replicas, in_use returns the caches of every run on every
+    cluster; the evictor refreshes it each pass and keeps those caches too.
+    A pass is skipped when in_use raises.
+    """
+    def __init__(
+        self,
+        cache_root: str,
+        index_path: Optional[str] = None,
+        user_quota_bytes: Optional[int] = None,
+        global_quota_bytes: Optional[int] = None,
+        evict_interval: float = 300,
+        in_use: Optional[Callable[[], Set[Tuple[str, str]]]] = None,
+    ):
+        self.cache_root = cache_root
+        self.user_quota_bytes = user_quota_bytes
+        self.global_quota_bytes = global_quota_bytes
+        self.evict_interval = evict_interval
+        self.in_use = in_use
+        self._lock = threading.Lock()
+        self._active: Dict[str, Tuple[str, str]] = {}
+        self._in_use: Set[Tuple[str, str]] = set()
+        self._db = sqlite3.connect(index_path or os.path.join(cache_root, ".secd-cache-index.db"), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._thread = None
+
+    def open(self, user_id: str, cache_dir: str, run_id: str, expected_bytes: int = 0) -> str:
+        """Reserve a cache directory for a run, evicting idle caches if needed."""
+        path = os.path.join(self.cache_root, user_id, cache_dir)
+        with self._lock:
+            current = self._size(user_id, cache_dir)
+            needed = max(0, expected_bytes - current)
+            if not self._fits(user_id, needed) and self._can_ever_fit(needed):
+                self._evict(user_id, needed)
+            if not self._fits(user_id, needed):
+                metrics.inc("cache_refused")
+                raise Exception(f"Cache {cache_dir} for user {user_id} does not fit in the cache quota")
+
+            if not os.path.exists(path):
+                os.makedirs(path)
+                log(f"Cache directory created at: {path}")
+            self._db.execute(
+                "INSERT INTO caches (user_id, name, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, name) DO UPDATE SET last_access = excluded.last_access",
+                (user_id, cache_dir, time.time()))
+            self._db.commit()
+            self._active[run_id] = (user_id, cache_dir)
+        return path
+
+    def restore(self, run_id: str, user_id: str, cache_dir: str) -> None:
+        """Mark a cache as in use by a run that was started before a restart."""
+        with self._lock:
+            self._active[run_id] = (user_id, cache_dir)
+
+    def forget(self, run_id: str) -> None:
+        """Stop tracking a run another replica took over; its cache stays in use."""
+        with self._lock:
+            entry = self._active.pop(run_id, None)
+            if entry is not None:
+                self._in_use.add(entry)
+
+    def close(self, run_id: str) -> None:
+        with self._lock:
+            entry = self._active.pop(run_id, None)
+            if entry is None:
+                return
+            self._db.execute("UPDATE caches SET last_access = ? WHERE user_id = ? AND name = ?", (time.time(), *entry))
+            self._db.commit()
+            self._scan_cache(*entry)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cache-evictor", daemon=True)
+            self._thread.start()
+
+    def scan(self) -> None:
+        with self._lock:
+            self._discover()
+            for user_id, name in self._db.execute("SELECT user_id, name FROM caches").fetchall():
+                self._scan_cache(user_id, name)
+            metrics.set_gauge("cache_bytes", self._total())
+
+    def evict(self) -> int:
+        # Listed outside the lock, it may call the Kubernetes API
+        in_use = self.in_use() if self.in_use else set()
+        with self._lock:
+            self._in_use = in_use
+            return self._evict()
+
+    # Helper methods
+    def _run(self) -> None:
+        while True:
+            try:
+                self.scan()
+                freed = self.evict()
+                if freed:
+                    log(f"Cache eviction freed {freed} bytes")
+            except Exception as e:
+                log(f"Error in cache eviction loop: {e}", "ERROR")
+            time.sleep(self.evict_interval)
+
+    def _discover(self) -> None:
+        # Pick up cache directories created outside this process
+        if not os.path.isdir(self.cache_root):
+            return
+        for user_entry in os.scandir(self.cache_root):
+            if not user_entry.is_dir() or user_entry.name.startswith("."):
+                continue
+            for cache_entry in os.scandir(user_entry.path):
+                if cache_entry.is_dir():
+                    self._db.execute(
+                        "INSERT OR IGNORE INTO caches (user_id, name, last_access) VALUES (?, ?, ?)",
+                        (user_entry.name, cache_entry.name, cache_entry.stat().st_atime))
+        self._db.commit()
+
+    def _scan_cache(self, user_id: str, name: str) -> None:
+        root = os.path.join(self.cache_root, user_id, name)
+        known = {
+            relpath: mtime for relpath, mtime in self._db.execute(
+                "SELECT relpath, mtime FROM dirs WHERE user_id = ? AND name = ?", (user_id, name))
+        }
+        seen = set()
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            relpath = os.path.relpath(directory, root)
+            try:
+                mtime = os.stat(directory).st_mtime
+            except FileNotFoundError:
+                continue
+            seen.add(relpath)
+            changed = known.get(relpath) != mtime
+            total = 0
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif changed and entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+            if changed:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO dirs (user_id, name, relpath, mtime, bytes) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, name, relpath, mtime, total))
+        for relpath in set(known) - seen:
+            self._db.execute("DELETE FROM dirs WHERE user_id = ? AND name = ? AND relpath = ?", (user_id, name, relpath))
+        self._db.commit()
+
+    def _size(self, user_id: str, name: Optional[str] = None) -> int:
+        if name is None:
+            row = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM dirs WHERE user_id = ?", (user_id,)).fetchone()
+        else:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM dirs WHERE user_id = ? AND name = ?", (user_id, name)).fetchone()
+        return row[0]
+
+    def _total(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM dirs").fetchone()[0]
+
+    def _fits(self, user_id: str, needed: int) -> bool:
+        if self.user_quota_bytes is not None and self._size(user_id) + needed > self.user_quota_bytes:
+            return False
+        if self.global_quota_bytes is not None and self._total() + needed > self.global_quota_bytes:
+            return False
+        return True
+
+    def _can_ever_fit(self, needed: int) -> bool:
+        return all(quota is None or needed <= quota for quota in (self.user_quota_bytes, self.global_quota_bytes))
+
+    def _evict(self, user_id: Optional[str] = None, needed: int = 0) -> int:
+        """Remove least recently used idle caches until every quota holds.
+
+        needed is room to make for a new reservation by user_id.
+        """
+        freed = 0
+        in_use = set(self._active.values()) | self._in_use
+        candidates: List[Tuple[str, str]] = [
+            (owner, name) for owner, name in self._db.execute(
+                "SELECT user_id, name FROM caches ORDER BY last_access ASC")
+            if (owner, name) not in in_use
+        ]
+        for owner, name in candidates:
+            over_global = self.global_quota_bytes is not None and \
+                self._total() + needed > self.global_quota_bytes
+            over_user = self.user_quota_bytes is not None and \
+                self._size(owner) + (needed if owner == user_id else 0) > self.user_quota_bytes
+            if not over_global and not over_user:
+                continue
+            size = self._size(owner, name)
+            shutil.rmtree(os.path.join(self.cache_root, owner, name), ignore_errors=True)
+            self._db.execute("DELETE FROM dirs WHERE user_id = ? AND name = ?", (owner, name))
+            self._db.execute("DELETE FROM caches WHERE user_id = ? AND name = ?", (owner, name))
+            self._db.commit()
+            freed += size
+            metrics.inc("cache_evicted_bytes", size)
+            log(f"Evicted cache {owner}/{name} ({size} bytes)")
+        return freed
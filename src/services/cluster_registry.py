@@ -0,0 +1,245 @@
+import datetime
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
+from app.src.dto.run import Run
+from app.src.util.deadlines import DeadlineHeap
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.setup import get_settings
+
+if TYPE_CHECKING:
+    from kubernetes import client
+    from app.src.services.cache_service import CacheService
+    from app.src.services.kubernetes_service import KubernetesService
+    from app.src.services.kubernetes_services.records import NamespaceRecord
+
+DEFAULT_CLUSTER = "default"
+MICROK8S_CA = "/var/snap/microk8s/current/certs/ca.crt"
+DATABASE_NAMESPACE = "storage"
+# Databases rarely move between clusters
+DATABASE_CACHE_TTL = 300
+# An unreachable cluster's due runs are retried after this many seconds
+EXPIRE_RETRY = 60
+
+def cluster_settings() -> List[Dict[str, Any]]:
+    """k8s.clusters, or the single k8s.configPath cluster when no list is set."""
+    k8s_settings = get_settings()['k8s']
+    if k8s_settings.get('clusters'):
+        # Entries without their own kubeconfig or host use k8s.configPath
+        return [
+            cluster if cluster.get('configPath') or cluster.get('host') else {**cluster, 'configPath': k8s_settings['configPath']}
+            for cluster in k8s_settings['clusters']
+        ]
+    return [{
+        'name': DEFAULT_CLUSTER,
+        'configPath': k8s_settings['configPath'],
+        'caCert': k8s_settings.get('caCert', MICROK8S_CA),
+    }]
+
+def build_configuration(cluster: Dict[str, Any]) -> "client.Configuration":
+    """Client configuration from a kubeconfig, or from a bare host (e.g. a fake API server)."""
+    from kubernetes import client, config
+
+    configuration = client.Configuration()
+    if cluster.get('configPath'):
+        config.load_kube_config(config_file=cluster['configPath'], context=cluster.get('context'), client_configuration=configuration)
+    else:
+        configuration.host = cluster['host']
+        if cluster.get('token'):
+            configuration.api_key = {"authorization": f"Bearer {cluster['token']}"}
+    if cluster.get('caCert'):
+        configuration.ssl_ca_cert = cluster['caCert']
+    if cluster.get('verifySsl') is False:
+        configuration.verify_ssl = False
+    return configuration
+
+class ClusterRegistry():
+    """The Kubernetes clusters runs can be placed on, each with its own KubernetesService.
+
+    place() picks a cluster for a run: clusters hosting the run's database
+    first, then the most free GPUs on one node for GPU runs, then the most
+    free capacity (the share of maxRuns still open; 1 / (1 + runs) for
+    clusters without maxRuns). Ties go to the cluster listed first. maxRuns
+    is a hard limit: a full cluster is never picked, and a run none of whose
+    clusters has room is refused. All clusters share one DeadlineHeap and
+    cache service.
+    """
+    def __init__(
+        self,
+        clusters: Dict[str, "KubernetesService"],
+        deadlines: DeadlineHeap,
+        cache_service: "CacheService",
+        max_runs: Optional[Dict[str, Optional[int]]] = None,
+    ):
+        if not clusters:
+            raise Exception("No Kubernetes cluster configured")
+        self.clusters = clusters
+        self.default = next(iter(clusters))
+        self.deadlines = deadlines
+        self.cache_service = cache_service
+        self.max_runs = max_runs or {}
+        self._placements: Dict[str, str] = {}
+        self._databases: Dict[Tuple[str, str], Tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: Optional[str] = None) -> "KubernetesService":
+        return self.clusters[name or self.default]
+
+    def cluster_of(self, run_id: str) -> str:
+        with self._lock:
+            return self._placements.get(run_id, self.default)
+
+    def for_run(self, run_id: str) -> "KubernetesService":
+        return self.clusters[self.cluster_of(run_id)]
+
+    def assign(self, run_id: str, name: str) -> None:
+        with self._lock:
+            self._placements[run_id] = name
+            self._publish()
+
+    def place(self, run: Run) -> str:
+        candidates = list(self.clusters)
+        if len(candidates) > 1 and run.database_name:
+            # The run's pod reaches its database through the cluster's service DNS
+            candidates = [name for name in candidates if self.hosts_database(name, run.database_name)] or candidates
+        gpu = bool((run.metadata or {}).get('gpu'))
+        # Read outside the lock, GPU capacity comes from the API
+        free_gpus = {name: self._free_gpus(name) for name in candidates} if gpu and len(candidates) > 1 else {}
+        with self._lock:
+            active = Counter(self._placements.values())
+            candidates = [name for name in candidates if not self._full(name, active[name])]
+            if not candidates:
+                metrics.inc("runs_refused_max_runs")
+                raise Exception(f"No cluster has room for run {run.run_id}: every candidate is at maxRuns")
+            candidates.sort(key=lambda name: (free_gpus.get(name, 0), self._free_capacity(name, active[name])), reverse=True)
+            run.cluster = candidates[0]
+            # Counted and assigned under one lock, so concurrent runs cannot overfill a cluster
+            self._placements[run.run_id] = run.cluster
+            self._publish()
+        metrics.inc(f"runs_placed.{run.cluster}")
+        log(f"Run {run.run_id} placed on cluster {run.cluster}")
+        return run.cluster
+
+    def release(self, run_id: str) -> None:
+        with self._lock:
+            name = self._placements.pop(run_id, self.default)
+            self._publish()
+        self.clusters[name].gpu_service.release(run_id)
+
+    def hosts_database(self, name: str, database_name: str) -> bool:
+        key = (name, database_name)
+        with self._lock:
+            cached = self._databases.get(key)
+        if cached and time.monotonic() - cached[1] < DATABASE_CACHE_TTL:
+            return cached[0]
+        pod = self.clusters[name].pod_service.get_pod_by_label(label_selector=f"name={database_name}", namespace=DATABASE_NAMESPACE)
+        with self._lock:
+            self._databases[key] = (pod is not None, time.monotonic())
+        return pod is not None
+
+    def cleanup_resources(self) -> List[str]:
+        run_ids = []
+        for name, cluster in self.clusters.items():
+            try:
+                run_ids += cluster.cleanup_resources()
+            except Exception as e:
+                log(f"Failed to clean up cluster {name}: {e}", "ERROR")
+        return run_ids
+
+    def expire_runs(self) -> List[str]:
+        due: Dict[str, List[Tuple[str, str]]] = {}
+        for run_id, namespace in self.deadlines.pop_due():
+            due.setdefault(self.cluster_of(run_id), []).append((run_id, namespace))
+        run_ids = []
+        for name, runs in due.items():
+            try:
+                run_ids += self.clusters[name].expire_runs(runs)
+            except Exception as e:
+                log(f"Failed to expire runs on cluster {name}: {e}", "ERROR")
+                # Back on the heap so a later pass retries them
+                retry_at = datetime.datetime.now() + datetime.timedelta(seconds=EXPIRE_RETRY)
+                for run_id, namespace in runs:
+                    self.deadlines.set(run_id, namespace, retry_at)
+        return run_ids
+
+    def secd_namespaces(self) -> Tuple[List[Tuple[str, "NamespaceRecord"]], List[str]]:
+        """The run namespaces of every cluster, and the names of the clusters that could not be listed."""
+        namespaces = []
+        unlisted = []
+        for name, cluster in self.clusters.items():
+            try:
+                namespaces += [(name, namespace) for namespace in cluster.get_run_namespaces()]
+            except Exception as e:
+                log(f"Failed to list runs on cluster {name}: {e}", "ERROR")
+                unlisted.append(name)
+        return namespaces, unlisted
+
+    def run_ids(self) -> Set[str]:
+        """The run ids that still have a namespace on some cluster. Raises if a cluster cannot be listed."""
+        from app.src.services.kubernetes_services.namespace_service import run_id_of
+        return {run_id_of(namespace) for namespace in self._run_namespaces()}
+
+    def caches_in_use(self) -> Set[Tuple[str, str]]:
+        """(user id, cache dir) of every run namespace on every cluster, whichever replica owns it."""
+        caches = set()
+        for namespace in self._run_namespaces():
+            annotations = namespace.metadata.annotations or {}
+            if 'cachedir' in annotations:
+                caches.add((annotations.get('userid'), annotations['cachedir']))
+        return caches
+
+    def gone_runs(self, run_ids: Set[str]) -> List[str]:
+        """The run_ids whose namespace no longer exists, e.g. after another replica cleaned it up.
+
+        Runs on a cluster that cannot be listed are never reported gone.
+        """
+        by_cluster: Dict[str, Set[str]] = {}
+        for run_id in run_ids:
+            by_cluster.setdefault(self.cluster_of(run_id), set()).add(run_id)
+        gone = []
+        for name, runs in by_cluster.items():
+            try:
+                present = self.clusters[name].get_run_ids()
+            except Exception as e:
+                log(f"Failed to list runs on cluster {name}: {e}", "ERROR")
+                continue
+            gone += runs - present
+        return gone
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            active = Counter(self._placements.values())
+        return {name: {"runs": active[name], "max_runs": self.max_runs.get(name)} for name in self.clusters}
+
+    # Helper methods
+    def _run_namespaces(self) -> List["NamespaceRecord"]:
+        namespaces = []
+        for name, cluster in self.clusters.items():
+            try:
+                namespaces += cluster.get_run_namespaces()
+            except Exception as e:
+                raise Exception(f"Failed to list runs on cluster {name}: {e}")
+        return namespaces
+
+    def _free_capacity(self, name: str, runs: int) -> float:
+        limit = self.max_runs.get(name)
+        return (limit - runs) / limit if limit else 1 / (1 + runs)
+
+    def _full(self, name: str, runs: int) -> bool:
+        limit = self.max_runs.get(name)
+        return limit is not None and runs >= limit
+
+    def _free_gpus(self, name: str) -> int:
+        try:
+            return self.clusters[name].gpu_service.free_gpus()[1]
+        except Exception as e:
+            log(f"Failed to read GPU capacity of cluster {name}: {e}", "ERROR")
+            return 0
+
+    def _publish(self) -> None:
+        active = Counter(self._placements.values())
+        for name in self.clusters:
+            metrics.set_gauge(f"cluster_runs.{name}", active[name])
@@ -1,12 +1,17 @@
+import datetime
 import os
-import docker
-import docker.tls
-import docker.errors
-from app.src.util.setup import get_settings
+from typing import Dict, Optional
+from app.src.util.setup import get_settings, add_reload_listener
 from app.src.util.logger import log
+from app.src.util.resilience import resilient, timeout
 
 class DockerService:
     def __init__(self):
+        # Imported on first use to keep the docker stack out of intake startup
+        import docker
+        import docker.tls
+        import docker.errors
+
         self.reg_settings = get_settings()['registry']
         self.path_registry_ca = get_settings()['registry']['ca_path']
         try:
@@ -18,10 +23,11 @@ class DockerService:
                 )
                 self.client = docker.DockerClient(
                     base_url="unix://var/run/docker.sock",
-                    tls=tls_config
+                    tls=tls_config,
+                    timeout=timeout('docker')
                 )
             else:
-                self.client = docker.from_env()
+                self.client = docker.from_env(timeout=timeout('docker'))
                 log("Docker client initialized without custom TLS configuration", "INFO")
                 if not self.path_registry_ca:
                     log("Warning: 'ca_path' not found in registry settings", "WARNING")
@@ -30,18 +36,23 @@ class DockerService:
         except docker.errors.DockerException as e:
             log(f"Error initializing Docker client: {str(e)}", "ERROR")
             raise Exception(f"Error initializing Docker client: {e}")
+        add_reload_listener(self._on_settings_reload)
+
+    def _on_settings_reload(self, old, new):
+        # Registry credentials are read at login time
+        self.reg_settings = new['registry']
 
-    def build_image(self, repo_path, image_name):
+    def build_image(self, repo_path, image_name, labels: Optional[Dict[str, str]] = None):
         try:
-            self.client.images.build(path=repo_path, tag=image_name)
+            self.client.images.build(path=repo_path, tag=image_name, labels=labels)
         except Exception as e:
             log(f"Unexpected error building image {image_name}: {str(e)}", "ERROR")
             raise Exception(f"Unexpected error building image {image_name}: {e}")
 
-    def build_and_push_image(self, repo_path, run_id):
+    def build_and_push_image(self, repo_path, run_id, labels: Optional[Dict[str, str]] = None):
         try:
             image_name = self.generate_image_name(run_id)
-            self.build_image(repo_path, image_name)
+            self.build_image(repo_path, image_name, labels)
             self.push_image(image_name)
             return image_name
         except Exception as e:
@@ -56,6 +67,7 @@ class DockerService:
             log(f"Missing registry setting: {str(e)}", "ERROR")
             raise Exception(f"Missing registry setting: {e}")
 
+    @resilient('docker', idempotent=True)
     def login_to_registry(self):
         try:
             url = self.reg_settings.get("url")
@@ -67,6 +79,7 @@ class DockerService:
             log(f"Unexpected error logging into registry {url}: {str(e)}", "ERROR")
             raise Exception(f"Unexpected error logging into registry {url}: {e}")
 
+    @resilient('docker', idempotent=True)
     def push_image(self, image_name):
         try:
             self.client.images.push(image_name)
@@ -74,17 +87,31 @@ class DockerService:
             log(f"Unexpected error pushing image {image_name}: {str(e)}", "ERROR")
             raise Exception(f"Unexpected error pushing image {image_name}: {e}")
 
-    def remove_image(self, image_name):
+    def remove_image(self, image_name, force: bool = False):
         try:
-            self.client.images.remove(image_name)
+            self.client.images.remove(image_name, force=force)
         except Exception as e:
             log(f"Unexpected error removing image {image_name}: {str(e)}", "ERROR")
             raise Exception(f"Unexpected error removing image {image_name}: {e}")
 
     def remove_dangling(self):
+        self.prune_dangling()
+
+    def prune_dangling(self) -> int:
+        # One API call instead of listing and removing images one by one
         try:
-            for image in self.client.images.list():
-                if not image.tags:
-                    self.client.images.remove(image.id)
+            result = self.client.images.prune(filters={"dangling": True})
+            return result.get("SpaceReclaimed") or 0
         except Exception as e:
-            log(f"Unexpected error while removing dangling images: {str(e)}", "ERROR")
\ No newline at end of file
+            log(f"Unexpected error while removing dangling images: {str(e)}", "ERROR")
+            return 0
+
+    def list_run_images(self, label: str):
+        return self.client.images.list(filters={"label": label})
+
+    def created_at(self, image) -> float:
+        # Docker reports nanoseconds, which fromisoformat does not accept
+        created = image.attrs.get("Created", "")
+        seconds, _, fraction = created.rstrip("Z").partition(".")
+        timestamp = datetime.datetime.fromisoformat(seconds).replace(tzinfo=datetime.timezone.utc).timestamp()
+        return timestamp + float(f"0.{fraction}") if fraction else timestamp
\ No newline at end of file
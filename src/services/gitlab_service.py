@@ -1,28 +1,85 @@
 import os
+import threading
 import gitlab
 import yaml
 import datetime
-import shutil
 import subprocess
+import time
 
-from typing import Dict
+from typing import Dict, Optional, Tuple
 from git import Repo
 from cerberus import Validator
 from app.src.util.logger import log
-from app.src.util.setup import get_settings
+from app.src.util.setup import get_settings, add_reload_listener
+from app.src.util.resilience import resilient, timeout
+from app.src.util.push_filter import AUTOMATED_REF_PREFIX, MAIN_REF, PUSH_SCHEMA
+from app.src.services.result_publisher import ResultPublisher, FilesystemArtifactStore
+
+METADATA_FILE = 'secd.yml'
+DEFAULT_METADATA = {
+    'runfor': 3,
+    'gpu': False
+}
+METADATA_SCHEMA = {
+    'runfor': {'type': 'number'},
+    'gpu': {'type': 'boolean'},
+}
+
+_validators: Dict[str, Tuple[Validator, threading.Lock]] = {}
+_validators_lock = threading.Lock()
+
+def validate_document(name: str, schema: Dict, document: Dict) -> Optional[Dict]:
+    """Validate against one shared compiled Validator per schema. Returns the errors, or None if valid."""
+    with _validators_lock:
+        if name not in _validators:
+            validator = Validator(schema)
+            validator.allow_unknown = True
+            _validators[name] = (validator, threading.Lock())
+        validator, lock = _validators[name]
+    # Validator keeps per-document state, so one document at a time
+    with lock:
+        return None if validator.validate(document) else dict(validator.errors)
 
 class GitlabService:
     def __init__(self):
         self.glSettings = get_settings()['gitlab']
-        self.client = gitlab.Gitlab(
-            url = self.glSettings['url'],
-            private_token = self.glSettings['token']
+        self.client = self._create_client(self.glSettings)
+        self.result_publisher = self._create_publisher(get_settings().get('publish', {}))
+        add_reload_listener(self._on_settings_reload)
+
+    def _create_publisher(self, publish_settings) -> ResultPublisher:
+        method = publish_settings.get('method', 'git')
+        threshold_mb = publish_settings.get('thresholdMB')
+        store = None
+        if method == 'store':
+            store = FilesystemArtifactStore(publish_settings['storePath'])
+        return ResultPublisher(
+            method=method,
+            threshold_bytes=int(threshold_mb * 1024 * 1024) if threshold_mb is not None else None,
+            store=store
+        )
+
+    def _create_client(self, gl_settings) -> gitlab.Gitlab:
+        gl_client = gitlab.Gitlab(
+            url = gl_settings['url'],
+            private_token = gl_settings['token'],
+            timeout = timeout('gitlab')
         )
         try:
-            self.client.auth()
+            gl_client.auth()
         except gitlab.exceptions.GitlabAuthenticationError as e:
             log(f"Authentication failed: {e}", "ERROR")
+        return gl_client
+
+    def _on_settings_reload(self, old, new):
+        if old['gitlab'] != new['gitlab']:
+            self.client = self._create_client(new['gitlab'])
+            self.glSettings = new['gitlab']
+            log("GitLab client reloaded with new settings")
+        if old.get('publish', {}) != new.get('publish', {}):
+            self.result_publisher = self._create_publisher(new.get('publish', {}))
 
+    @resilient('gitlab', idempotent=True)
     def has_file_in_repo(self, project_id: str, file_path: str, ref: str) -> bool:
         client = self.client
         try:
@@ -33,47 +90,43 @@ class GitlabService:
             return False
         return True
 
+    @resilient('gitlab', idempotent=True)
+    def get_repo_metadata(self, project_id: str, ref: str) -> Dict[str, str]:
+        # Read through the files API so a run can be checked before it is cloned
+        project = self.client.projects.get(project_id, lazy=True)
+        try:
+            metadata = project.files.raw(file_path=METADATA_FILE, ref=ref)
+        except gitlab.exceptions.GitlabGetError as e:
+            if e.response_code != 404:
+                raise
+            log(f'No metadata file found in project {project_id} at {ref}. Fallback to default')
+            return dict(DEFAULT_METADATA)
 
-    def get_metadata(self, file_path: str) -> Dict[str, str]:
-        default = {
-            'runfor': 3,
-            'gpu': False
-        }
-
-        if not os.path.isfile(file_path):
-            log(f'No metadata file found at {file_path}. Fallback to default')
-            return default
+        return self.parse_metadata(metadata.decode('utf-8', errors='replace'), f'{project_id}@{ref}:{METADATA_FILE}')
 
-        with open(file_path, 'r') as f:
-            metadata = f.read()
-            try:
-                yaml_metadata = yaml.safe_load(metadata)
-            except:
-                log(f'Invalid metadata file {file_path}', "ERROR")
-                return {}
+    def parse_metadata(self, metadata: str, source: str) -> Dict[str, str]:
+        try:
+            yaml_metadata = yaml.safe_load(metadata)
+        except:
+            log(f'Invalid metadata file {source}', "ERROR")
+            return {}
 
         if not yaml_metadata:
-            log(f'Invalid metadata file {file_path}. Fallback to default')
-            return default
+            log(f'Invalid metadata file {source}. Fallback to default')
+            return dict(DEFAULT_METADATA)
 
-        validation = {
-            'runfor': {'type': 'number'},
-            'gpu': {'type': 'boolean'},
-        }
+        if validate_document('metadata', METADATA_SCHEMA, yaml_metadata) is not None:
+            log(f'Invalid metadata file {source}. Fallback to default')
+            return dict(DEFAULT_METADATA)
 
-        v = Validator(validation)
-        v.allow_unknown = True
-        if not v.validate(yaml_metadata):
-            log(f'Invalid metadata file {file_path}. Fallback to default')
-            return default
-
-        for key in default:
+        for key in DEFAULT_METADATA:
             if key not in yaml_metadata:
-                yaml_metadata[key] = default[key]
+                yaml_metadata[key] = DEFAULT_METADATA[key]
 
         return yaml_metadata
 
 
+    @resilient('gitlab', idempotent=True)
     def get_signature(self, project_id: str, commit_id: str) -> Dict[str, any]:
             project = None
             commit = None
@@ -99,6 +152,7 @@ class GitlabService:
                 raise
 
 
+    @resilient('gitlab', idempotent=True)
     def get_idp_user_id(self, gitlab_user_id: int) -> str:
         client = self.client
 
@@ -119,11 +173,15 @@ class GitlabService:
         return user.identities[0]['extern_uid']
 
 
-    def clone(self, gitlab_url: str, repo_path: str):
+    @resilient('gitlab')
+    def clone(self, gitlab_url: str, repo_path: str, commit_sha: Optional[str] = None):
         gl_settings = self.glSettings
 
         gitlab_repo_url = gitlab_url.replace("https://", f"https://{gl_settings['username']}:{gl_settings['password']}@")
-        Repo.clone_from(gitlab_repo_url, repo_path)
+        repo = Repo.clone_from(gitlab_repo_url, repo_path)
+        if commit_sha:
+            # Build the commit whose metadata was validated, even if main moved on since
+            repo.git.checkout(commit_sha)
 
     def push_results(self, run_id: str):
         repo_path = f"{get_settings()['path']['repoPath']}/{run_id}"
@@ -141,6 +199,15 @@ class GitlabService:
         except Exception:
             pass
 
+        large_stats = {}
+        try:
+            # Large outputs go through LFS or the artifact store, not git blobs
+            large_stats = self.result_publisher.prepare(repo_path)
+        except Exception as e:
+            log(f"Failed to publish large outputs of run {run_id}: {e}", "ERROR")
+
+        git_start = time.perf_counter()
+
         try:
             subprocess.run(["git", "add", "."], check=True, cwd=repo_path,
                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -153,13 +220,23 @@ class GitlabService:
         except Exception:
             pass
 
+        git_seconds = time.perf_counter() - git_start
+
+        if "lfs" in large_stats:
+            # Uploaded here, the pre-push hook finds nothing left to send
+            try:
+                self.result_publisher.push_lfs(repo_path, "origin", branch_name, large_stats["lfs"])
+            except Exception as e:
+                log(f"Failed to push LFS objects of run {run_id}: {e}", "ERROR")
+
+        push_start = time.perf_counter()
         try:
             subprocess.run(["git", "push", "origin", branch_name], check=True,
                         cwd=repo_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         except Exception:
             pass
 
-        shutil.rmtree(repo_path, ignore_errors=True)
+        self.result_publisher.record_git(repo_path, git_seconds + time.perf_counter() - push_start)
 
     def validate_event_token(self, req):
         event = req.get_header('X-Gitlab-Event')
@@ -172,38 +249,16 @@ class GitlabService:
         return True
 
     def validate_body_schema(self, body):
-        schema = {
-            'event_name': {'type': 'string'},
-            'ref': {'type': 'string'},
-            'user_id': {'type': 'integer'},
-            'project_id': {'type': 'integer'},
-            'project': {
-                'type': 'dict',
-                'schema': {
-                    'http_url': {'type': 'string'},
-                }
-            },
-            'commits': {
-                'type': 'list',
-                'schema': {
-                    'type': 'dict',
-                    'schema': {
-                        'id': {'type': 'string'},
-                    }
-                }
-            }
-        }
-        v = Validator(schema)
-        v.allow_unknown = True
-        if not v.validate(body):
-            log(f"Invalid body: {v.errors}", "ERROR")
-            raise gitlab.GitlabError(error_message=f'Invalid body: {v.errors}')
+        errors = validate_document('push', PUSH_SCHEMA, body)
+        if errors is not None:
+            log(f"Invalid body: {errors}", "ERROR")
+            raise gitlab.GitlabError(error_message=f'Invalid body: {errors}')
 
     def validate_body(self, body) -> bool:
         try:
 
             # Validate user push and not automated push
-            if body['ref'].startswith('refs/heads/secd-'):
+            if body['ref'].startswith(AUTOMATED_REF_PREFIX):
                 log(f"Automated branch push {body['ref']}", "INFO")
                 return False
             
@@ -215,7 +270,7 @@ class GitlabService:
                 raise gitlab.GitlabError(error_message=f'Invalid event_name: {body["event_name"]}')
             
             # Validate commit from main branch
-            if body['ref'] != 'refs/heads/main':
+            if body['ref'] != MAIN_REF:
                 log(f"Commit is not from main branch: {body['ref']}", "ERROR")
                 raise gitlab.GitlabError(error_message=f'Commit is not from main branch: {body["ref"]}')
             
@@ -229,8 +284,9 @@ class GitlabService:
                 if signature['verification_status'] != 'verified':
                     raise gitlab.GitlabError(f'Signature not verified for commit {push_commit["id"]}')
 
-            # Validate docker file present
-            if not self.has_file_in_repo(body['project_id'], 'Dockerfile', body['ref']):
+            # Validate docker file present at the commit the run will build
+            commit_sha = body.get('checkout_sha') or body.get('after') or body['ref']
+            if not self.has_file_in_repo(body['project_id'], 'Dockerfile', commit_sha):
                 log(f"No Dockerfile found in project {body['project_id']}", "ERROR")
                 raise gitlab.GitlabError(error_message=f'No Dockerfile found in project {body["project_id"]}')
             
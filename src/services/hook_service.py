@@ -1,137 +1,288 @@
+import contextvars
 import datetime
 import os
+import threading
+import time
 import uuid
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Any, Optional
 from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.resilience import deadline_budget
+from app.src.util.scheduler import RunScheduler
 from app.src.util.setup import get_settings
-from app.src.services.kubernetes_service import KubernetesService
-from app.src.services.vault_service import VaultService
-from app.src.services.gitlab_service import GitlabService
-from app.src.services.keycloak_service import KeycloakService
-from app.src.services.docker_service import DockerService
-from app.src.dto.run import Run
+from app.src.dto.run import Run, new_run_id
+from app.src.services.image_gc_service import RUN_ID_LABEL, PROJECT_LABEL
+from app.src.services.vault_lease_service import GRANTS_ANNOTATION, database_role_name, policy_name, auth_role_name
+
+if TYPE_CHECKING:
+    from app.src.services.cluster_registry import ClusterRegistry
+    from app.src.services.kubernetes_service import KubernetesService
+    from app.src.services.vault_service import VaultService
+    from app.src.services.gitlab_service import GitlabService
+    from app.src.services.keycloak_service import KeycloakService
+    from app.src.services.docker_service import DockerService
+    from app.src.services.workspace_service import WorkspaceService
+    from app.src.services.vault_lease_service import VaultLeaseService
 
 SECD_GROUP = "secd"
 STORAGE_TYPE = "storage"
 DATABASE_SERVICE = "database-service"
 STORAGE_SIZE = "100Gi"
 OUTPUT_STORAGE_SIZE = "50Gi"
+GPU_SCHEDULE_TIMEOUT = 300
+# Room for rununtil extensions past runfor before a credential can no longer be renewed
+LEASE_MAX_TTL_GRACE_HOURS = 24
+SUPPORTED_DATABASE_TYPES = ("file", "mysql")
 
 class HookService():
     def __init__(
         self,
-        gitlab_service: GitlabService,
-        keycloak_service: KeycloakService,
-        docker_service: DockerService,
-        kubernetes_service: KubernetesService,
-        vault_service: VaultService,
+        gitlab_service: "GitlabService",
+        keycloak_service: "KeycloakService",
+        docker_service: "DockerService",
+        clusters: "ClusterRegistry",
+        vault_service: "VaultService",
+        scheduler: RunScheduler,
+        workspaces: Optional["WorkspaceService"] = None,
+        vault_leases: Optional["VaultLeaseService"] = None,
     ):
         self.gitlab_service = gitlab_service
         self.keycloak_service = keycloak_service
         self.docker_service = docker_service
-        self.kubernetes_service = kubernetes_service
+        self.clusters = clusters
         self.vault_service = vault_service
-
-    def create(self, body: Dict[str, Any]):
+        self.scheduler = scheduler
+        self.workspaces = workspaces
+        self.vault_leases = vault_leases
+        self.cancel_superseded = get_settings().get('debounce', {}).get('cancelSuperseded', False)
+        self._in_flight: Dict[Any, str] = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+
+    def create(self, body: Dict[str, Any], run_id: Optional[str] = None):
+        run_id = run_id or new_run_id()
+        project_id = body.get('project_id') if isinstance(body, dict) else None
+        self._track(project_id, run_id)
+        provisioned = False
         try:
-            run = self._init(body)
+            # Backend calls share one budget per phase; admission queueing is not counted
+            run_budget = get_settings().get('resilience', {}).get('runBudget')
+            with deadline_budget(run_budget):
+                run = self._init(body, run_id)
             if run == None: # Automated push
                 return
 
-            if run.database_type == "file": 
-                self._database_is_file(run)
-
-            elif run.database_type == "mysql": 
-                self._database_is_mysql(run)
-
-            else:
-                log(f"database_type not implemented: {run.database_type}", "WARNING")
+            self._checkpoint(run)
+            self._admit(run)
+            with deadline_budget(run_budget):
+                self._provision(run)
+            provisioned = True
 
         except Exception as e:
             log(f"Error in create process: {str(e)}", "ERROR")
+        finally:
+            self._untrack(project_id, run_id)
+            if not provisioned:
+                self._release_workspace(run_id)
+                self._release_grants(run_id)
+
+    # Superseded build cancellation
+    def _track(self, project_id: Any, run_id: str):
+        with self._lock:
+            previous = self._in_flight.get(project_id)
+            self._in_flight[project_id] = run_id
+            if previous and self.cancel_superseded and project_id is not None:
+                self._cancelled.add(previous)
+                metrics.inc("runs_superseded")
+                log(f"Run {previous} superseded by run {run_id}, cancelling")
+
+    def _untrack(self, project_id: Any, run_id: str):
+        with self._lock:
+            if self._in_flight.get(project_id) == run_id:
+                del self._in_flight[project_id]
+            self._cancelled.discard(run_id)
+
+    def _release_workspace(self, run_id: str):
+        # Failed runs never reach push_results, so their clone goes here
+        if self.workspaces:
+            self.workspaces.release(run_id)
+
+    def _release_grants(self, run_id: str):
+        if self.vault_leases:
+            self.vault_leases.release(run_id)
+
+    def _checkpoint(self, run: Run):
+        if run.run_id in self._cancelled:
+            raise Exception(f"Run {run.run_id} cancelled: superseded by a newer push")
+
+    def _admit(self, run:Run):
+        self.scheduler.admit(run)
+        try:
+            self.clusters.place(run)
+            # Refused here, a cache that does not fit costs no provision and teardown
+            self._kubernetes(run).reserve_cache(run.metadata, run.keycloak_user_id, run.run_id)
+            if self._requests_gpu(run):
+                # Hold GPU runs until a node of their cluster has a free GPU
+                self._kubernetes(run).gpu_service.acquire(run.run_id)
+        except Exception:
+            self.scheduler.release(run.run_id)
+            self.clusters.release(run.run_id)
+            self.clusters.cache_service.close(run.run_id)
+            raise
+
+    def _provision(self, run:Run):
+        try:
+            self._provision_database(run)
+        except Exception:
+            # A pod that never got scheduled would otherwise wait in its namespace forever
+            if run.namespace:
+                self._kubernetes(run).discard_run(run.run_id, run.namespace, run.pv_name_output)
+            self.scheduler.release(run.run_id)
+            self.clusters.release(run.run_id)
+            self.clusters.cache_service.close(run.run_id)
+            raise
+
+    def _requests_gpu(self, run:Run) -> bool:
+        # Only the Vault pod asks for a GPU; NFS pods of file databases never do
+        return bool(run.metadata.get('gpu')) and run.database_type == "mysql"
+
+    def _kubernetes(self, run:Run) -> "KubernetesService":
+        return self.clusters.get(run.cluster)
+
+    def _provision_database(self, run:Run):
+        if run.database_type == "file": 
+            self._database_is_file(run)
+
+        elif run.database_type == "mysql": 
+            self._database_is_mysql(run)
+
+        else:
+            log(f"database_type not implemented: {run.database_type}", "WARNING")
 
     def _database_is_mysql(self, run:Run):
-        self._create_namespace(run)
-        self._create_pv(run)
-        self._setup_pvc(run)
-        self._vault_setup(run)
+        start = time.perf_counter()
+        pooled = self._create_namespace(run, pooled=True)
+
+        # PV, PVC and Vault setup only need the namespace, so run them side by side
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            # Each task gets its own copy of the context so the run budget follows it
+            futures = [
+                executor.submit(contextvars.copy_context().run, step, run)
+                for step in (self._create_pv, self._setup_pvc, self._vault_setup)
+            ]
+            for future in futures:
+                future.result()
+
         self._create_pod_by_vault(run)
+        seconds = time.perf_counter() - start
+        metrics.observe(f"pod_start_seconds.{'warm' if pooled else 'cold'}", seconds)
+        log(f"Run {run.run_id} pod created in {seconds:.2f}s ({'warm' if pooled else 'cold'} namespace)")
 
     def _database_is_file(self, run:Run):
         self._create_namespace(run)
         self._create_pv(run)
-        self.kubernetes_service.pod_service.create_nfs_pod(
+        self._kubernetes(run).pod_service.create_nfs_pod(
             database_name=run.database_name,
             run_id=run.run_id,
             image_name=run.image_name,
             environment_variables=run.env_vars
         )
 
-    def _init(self, body: Dict[str, Any]) -> Run:
+    def _init(self, body: Dict[str, Any], run_id: Optional[str] = None) -> Run:
         try: 
             # 1) Validate & init run
-            if not self.gitlab_service.validate_body(body):
+            if not self._validate(body):
                 return None
             
-            run = Run()
-
-            gitlab_user_id = body['user_id']
-            run.keycloak_user_id = self.gitlab_service.get_idp_user_id(int(gitlab_user_id))
-            if not self.keycloak_service.check_user_in_group(run.keycloak_user_id, SECD_GROUP):
-                raise Exception(f"User {run.keycloak_user_id} not in '{SECD_GROUP}'")
-
-            self.gitlab_service.clone(body["project"]["http_url"], run.repo_path)
-            os.makedirs(run.output_path, exist_ok=True)
+            run = Run(run_id=run_id) if run_id else Run()
+            self._authorize(run, body)
+            self._checkpoint(run)
 
-            # 2) Metadata & permissions
-            run.metadata       = self.gitlab_service.get_metadata(f"{run.repo_path}/secd.yml")
-            run.database_name  = run.metadata['database_name']
-            if not self.keycloak_service.check_user_has_role(
-                run.keycloak_user_id, DATABASE_SERVICE, run.database_name):
-                raise Exception("User does not have the required DB role")
+            # 2) Metadata & permissions, read through the API so rejected runs never clone
+            self._load_metadata(run, body)
+            self._checkpoint(run)
+            self._clone(run, body)
 
             # 3) Build the container image
-            self.docker_service.login_to_registry()
-            run.image_name = self.docker_service.build_and_push_image(run.repo_path, run.run_id)
+            self._build_image(run)
 
             # 4) Fill remaining DTO fields
-            run.database_type    = run.metadata["database_type"]
-            run.run_for          = run.metadata["runfor"]
-            run.namespace_labels = {"name": run.database_name}
-            run.service_name     = f"service-{run.database_name}.storage.svc.cluster.local"
-            run.env_vars = {
-                "DB_HOST":     run.service_name,
-                "NFS_PATH":    "/data",
-                "OUTPUT_PATH": "/output",
-                "SECD":        "PRODUCTION",
-                "DB_USER":     "",
-                "DB_PASS":     "",
-            }
-
+            self._fill_run(run)
             return run
         
         except Exception as e:
             log(f"Failed to initialise run: {str(e)}", "ERROR")
 
-
+    # Pipeline stages, also driven one by one by AsyncHookService
+    def _validate(self, body: Dict[str, Any]) -> bool:
+        return self.gitlab_service.validate_body(body)
+
+    def _authorize(self, run:Run, body: Dict[str, Any]):
+        gitlab_user_id = body['user_id']
+        run.keycloak_user_id = self.gitlab_service.get_idp_user_id(int(gitlab_user_id))
+        if not self.keycloak_service.check_user_in_group(run.keycloak_user_id, SECD_GROUP):
+            raise Exception(f"User {run.keycloak_user_id} not in '{SECD_GROUP}'")
+
+    def _clone(self, run:Run, body: Dict[str, Any]):
+        run.project_id = body.get("project_id")
+        if self.workspaces:
+            self.workspaces.track(run.run_id)
+        self.gitlab_service.clone(body["project"]["http_url"], run.repo_path, run.commit_sha)
+        os.makedirs(run.output_path, exist_ok=True)
+
+    def _load_metadata(self, run:Run, body: Dict[str, Any]):
+        # Pin the pushed commit: the clone checks out the same SHA
+        run.commit_sha     = body.get("checkout_sha") or body.get("after")
+        run.metadata       = self.gitlab_service.get_repo_metadata(body["project_id"], run.commit_sha or body["ref"])
+        if 'database_name' not in run.metadata:
+            raise Exception("secd.yml does not name a database_name")
+        if run.metadata.get('database_type') not in SUPPORTED_DATABASE_TYPES:
+            raise Exception(f"database_type not supported: {run.metadata.get('database_type')}")
+        run.database_name  = run.metadata['database_name']
+        if not self.keycloak_service.check_user_has_role(
+            run.keycloak_user_id, DATABASE_SERVICE, run.database_name):
+            raise Exception("User does not have the required DB role")
+
+    def _build_image(self, run:Run):
+        self.docker_service.login_to_registry()
+        labels = {RUN_ID_LABEL: run.run_id, PROJECT_LABEL: str(run.project_id or "")}
+        run.image_name = self.docker_service.build_and_push_image(run.repo_path, run.run_id, labels)
+
+    def _fill_run(self, run:Run):
+        run.database_type    = run.metadata["database_type"]
+        run.run_for          = run.metadata["runfor"]
+        run.namespace_labels = {"name": run.database_name}
+        run.service_name     = f"service-{run.database_name}.storage.svc.cluster.local"
+        run.env_vars = {
+            "DB_HOST":     run.service_name,
+            "NFS_PATH":    "/data",
+            "OUTPUT_PATH": "/output",
+            "SECD":        "PRODUCTION",
+            "DB_USER":     "",
+            "DB_PASS":     "",
+        }
 
     def _create_pv(self, run:Run):
-        self.kubernetes_service.pv_service.create_persistent_volume(
+        self._kubernetes(run).pv_service.create_persistent_volume(
             name = run.pv_name_output, 
-            path = f"{run.pvc_repo_path}/repos/{run.run_id}/outputs/{run.date}-{run.run_id}"
+            path = f"{run.pvc_repo_path}/repos/{run.run_id}/outputs/{run.date}-{run.run_id}",
+            run_id = run.run_id
         )
 
-    def _create_namespace(self, run:Run):
-        self.kubernetes_service.create_namespace(
+    def _create_namespace(self, run:Run, pooled: bool = False) -> bool:
+        run.namespace, run.service_account_name = self._kubernetes(run).create_namespace(
             user_id = run.keycloak_user_id, 
             run_id = run.run_id, 
             run_for = run.run_for,
             labels = run.namespace_labels,
+            pooled = pooled,
         )
+        return run.service_account_name is not None
 
     def _setup_pvc(self, run:Run) -> str:
         # Fetch the database pod using the correct label selector
-        db_pod = self.kubernetes_service.pod_service.get_pod_by_label(
+        db_pod = self._kubernetes(run).pod_service.get_pod_by_label(
             label_selector=f"name={run.database_name}",  # e.g., "name=mysql-1"
             namespace=STORAGE_TYPE
         )
@@ -150,18 +301,19 @@ class HookService():
             raise Exception("No PVC associated with the database pobd")
 
         # Fetch the PV bound to this PVC
-        pvc = self.kubernetes_service.pv_service.get_pvc(run.pvc_name, namespace=STORAGE_TYPE)
+        pvc = self._kubernetes(run).pv_service.get_pvc(run.pvc_name, namespace=STORAGE_TYPE)
         if not pvc or not pvc.spec.volume_name:
             log(f"No PV bound to PVC {run.pvc_name} in namespace {STORAGE_TYPE}", "ERROR")
             raise Exception(f"PV not found for PVC {run.pvc_name}")
 
         # Proceed with existing PVC setup for output
-        self.kubernetes_service.pv_service.create_persistent_volume_claim(
+        self._kubernetes(run).pv_service.create_persistent_volume_claim(
             run.pvc_name_output, 
             run.namespace, 
             run.pv_name_output, 
             storage_size=OUTPUT_STORAGE_SIZE, 
-            access_modes=["ReadWriteOnce"]
+            access_modes=["ReadWriteOnce"],
+            run_id=run.run_id
         )
 
         if run.database_type == "file": 
@@ -173,60 +325,84 @@ class HookService():
 
     def _create_pod_by_vault(self, run:Run):
 
-        cache_dir, mount_path = self.kubernetes_service.handle_cache_dir(run.metadata, run.keycloak_user_id, run.run_id)
-        db_pod = self.kubernetes_service.pod_service.get_pod_by_label(
+        cache_dir, mount_path = self._kubernetes(run).handle_cache_dir(run.metadata, run.keycloak_user_id, run.run_id, run.namespace)
+        db_pod = self._kubernetes(run).pod_service.get_pod_by_label(
             label_selector=f"name={run.metadata['database_name']}",
             namespace=STORAGE_TYPE 
         )
 
         db_label = db_pod.metadata.labels.get('name')
-        self.kubernetes_service.pod_service.create_pod_by_vault(
+        self._kubernetes(run).pod_service.create_pod_by_vault(
                 run_id = run.run_id,
                 image = run.image_name,
                 envs = run.env_vars,
-                gpu = run.metadata['gpu'],
+                gpu = self._requests_gpu(run),
                 mount_path = mount_path,
                 database = db_label,
                 namespace = run.namespace,
                 pvc_name = run.pvc_name,
-                vault_role = run.vault_role_name  # Match Vault role from _vault_setup
+                vault_role = run.vault_role_name,  # Match Vault role from _vault_setup
+                service_account_name = run.service_account_name
             )
+        if self._requests_gpu(run):
+            self._start_run_clock(run)
+
+    def _start_run_clock(self, run:Run):
+        # rununtil counts from the moment the pod is bound to a node
+        gpu_service = self._kubernetes(run).gpu_service
+        scheduled_at = gpu_service.wait_for_scheduled(run.namespace, f"secd-{run.run_id}", timeout=GPU_SCHEDULE_TIMEOUT)
+        gpu_service.bind(run.run_id)
+        run_until = scheduled_at + datetime.timedelta(hours=run.run_for)
+        self._kubernetes(run).set_run_until(run.namespace, run_until, run.run_id)
+        log(f"Run {run.run_id} scheduled at {scheduled_at.isoformat()}, running until {run_until.isoformat()}")
 
     def _vault_setup(self, run:Run) -> str:
         # Define database details
         #self.database_name = "mysql-1"
         #self.database_type = "mysql"
 
-        # Define resource names
-        run.vault_role_name = f"role-{run.database_name}"  # e.g., role-mysql-1 (for database creds)
-        policy_name = f"policy-{run.database_name}"  # e.g., policy-mysql-1
-        service_account_name = f"sa-{run.database_name}"  # e.g., sa-mysql-1 (in pod's self.namespace)
-        k8s_auth_role_name = f"role-{run.database_name}-{run.namespace}"  # e.g., role-mysql-1-secd-<self.run_id>
+        # Define resource names, one set per run so teardown can revoke them
+        if self.vault_leases:
+            self.vault_leases.track(run.run_id, run.database_name, run.namespace)
+        self._kubernetes(run).namespace_service.update_annotations(run.namespace, {GRANTS_ANNOTATION: "true"})
+        run.vault_role_name = database_role_name(run.database_name, run.run_id)  # e.g., role-mysql-1-<self.run_id> (for database creds)
+        run_policy_name = policy_name(run.database_name, run.run_id)  # e.g., policy-mysql-1-<self.run_id>
+        # Warm namespaces come with their service account already created
+        pooled_account = run.service_account_name is not None
+        service_account_name = run.service_account_name or f"sa-{run.database_name}"  # e.g., sa-mysql-1 (in pod's self.namespace)
+        run.service_account_name = service_account_name
+        k8s_auth_role_name = auth_role_name(run.database_name, run.namespace)  # e.g., role-mysql-1-secd-<self.run_id>
 
         # Step 1: Configure Vault database connection
         connection_url_template = f"{{{{username}}}}:{{{{password}}}}@tcp(service-{run.database_name}.storage.svc.cluster.local:3306)/"
-        allowed_roles = [run.vault_role_name]
+        # Several runs share the connection, each with its own role
+        allowed_roles = [database_role_name(run.database_name, "*")]
         username = "vault"
         password = "vaultpassword"
-        self.vault_service.configure_database_connection(
-            database_name=run.database_name,
-            db_type=run.database_type,
-            connection_url_template=connection_url_template,
-            allowed_roles=allowed_roles,
-            admin_username=username,
-            admin_password=password
-        )
 
         # Step 2: Create database role for temporary users
         creation_statements = [
             "CREATE USER '{{name}}'@'%' IDENTIFIED BY '{{password}}';",
             "GRANT SELECT ON *.* TO '{{name}}'@'%';"
         ]
-        self.vault_service.create_database_role(
-            role_name=run.vault_role_name,
-            database_name=run.database_name,
-            creation_statements=creation_statements,
-        )
+        lease_grace_hours = get_settings().get('vaultLeases', {}).get('maxTtlGraceHours', LEASE_MAX_TTL_GRACE_HOURS)
+
+        def database_role():
+            # The role is checked against the connection's allowed_roles, so these two stay in order
+            self.vault_service.configure_database_connection(
+                database_name=run.database_name,
+                db_type=run.database_type,
+                connection_url_template=connection_url_template,
+                allowed_roles=allowed_roles,
+                admin_username=username,
+                admin_password=password
+            )
+            self.vault_service.create_database_role(
+                role_name=run.vault_role_name,
+                database_name=run.database_name,
+                creation_statements=creation_statements,
+                max_ttl=f"{int((run.run_for + lease_grace_hours) * 3600)}s",
+            )
 
         # Step 3: Create policy for accessing temporary credentials
         policy_rules = f"""
@@ -234,19 +410,34 @@ class HookService():
                 capabilities = ["read"]
             }}
         """
-        self.vault_service.create_policy(
-            policy_name=policy_name,
-            policy_rules=policy_rules
-        )
+
+        def policy():
+            self.vault_service.create_policy(
+                policy_name=run_policy_name,
+                policy_rules=policy_rules
+            )
 
         # Step 4: Create service account in the pod's self.namespace
-        self.kubernetes_service.create_service_account(service_account_name, run.namespace)
+        def service_account():
+            if not pooled_account:
+                self._kubernetes(run).create_service_account(service_account_name, run.namespace)
 
         # Step 5: Create Kubernetes auth role for the pod's self.namespace
-        self.vault_service.create_kubernetes_auth_role(
-            role_name=k8s_auth_role_name,
-            service_account_name=service_account_name,
-            service_account_namespace=run.namespace,  # Pod's self.namespace (e.g., secd-<self.run_id>)
-            policy=policy_name
-        )
+        def auth_role():
+            # Vault only stores the names, so the policy and account need not exist yet
+            self.vault_service.create_kubernetes_auth_role(
+                role_name=k8s_auth_role_name,
+                service_account_name=service_account_name,
+                service_account_namespace=run.namespace,  # Pod's self.namespace (e.g., secd-<self.run_id>)
+                policy=run_policy_name
+            )
+
+        # The steps are independent writes, so issue them side by side
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, step)
+                for step in (database_role, policy, service_account, auth_role)
+            ]
+            for future in futures:
+                future.result()
         return run.vault_role_name
\ No newline at end of file
@@ -0,0 +1,205 @@
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+if TYPE_CHECKING:
+    from app.src.services.docker_service import DockerService
+
+RUN_ID_LABEL = "secd.run-id"
+PROJECT_LABEL = "secd.project"
+MANIFEST_TYPES = ", ".join([
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+])
+
+class RegistryClient():
+    """Deletes run images from a Docker Registry HTTP API v2.
+
+    api_url defaults to https://<registry url>; point it at a plain
+    http://localhost:5000 registry:2 container (with
+    REGISTRY_STORAGE_DELETE_ENABLED=true) to try the GC locally.
+    """
+    def __init__(self, api_url: str, username: Optional[str] = None, password: Optional[str] = None,
+                 ca_path: Optional[str] = None, timeout: float = 30):
+        import requests
+
+        self.api_url = api_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        if username:
+            self.session.auth = (username, password)
+        if ca_path:
+            self.session.verify = ca_path
+
+    def delete(self, repository: str, tag: str = "latest") -> bool:
+        """Delete repository:tag by its manifest digest. Returns False if it was already gone."""
+        url = f"{self.api_url}/v2/{repository}/manifests/{tag}"
+        response = self.session.head(url, headers={"Accept": MANIFEST_TYPES}, timeout=self.timeout)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        digest = response.headers.get("Docker-Content-Digest")
+        if not digest:
+            raise Exception(f"Registry returned no digest for {repository}:{tag}")
+
+        response = self.session.delete(f"{self.api_url}/v2/{repository}/manifests/{digest}", timeout=self.timeout)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+class ImageGcService():
+    """Removes run images from the build host and the registry.
+
+    An image is collected once its run has finished, once it is older than
+    max_age_hours, when its project has more than keep_per_project images,
+    or, oldest first, while the disk holding disk_path is fuller than
+    disk_watermark (a fraction). Images of active runs and images younger
+    than grace_seconds are never collected by the policies, nor, with
+    several replicas, images of runs another replica owns.
+    """
+    def __init__(
+        self,
+        docker_service: "DockerService",
+        registry: Optional[RegistryClient],
+        registry_project: str,
+        active_runs: Callable[[], Set[str]],
+        max_age_hours: Optional[float] = None,
+        keep_per_project: Optional[int] = None,
+        disk_watermark: Optional[float] = None,
+        disk_path: str = "/var/lib/docker",
+        grace_seconds: float = 3600,
+        interval: float = 600,
+        owns: Optional[Callable[[str], bool]] = None,
+    ):
+        self.docker_service = docker_service
+        self.registry = registry
+        self.registry_project = registry_project
+        self.active_runs = active_runs
+        self.max_age_hours = max_age_hours
+        self.keep_per_project = keep_per_project
+        self.disk_watermark = disk_watermark
+        self.disk_path = disk_path
+        self.grace_seconds = grace_seconds
+        self.interval = interval
+        self.owns = owns
+        self._finished: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="image-gc", daemon=True)
+            self._thread.start()
+
+    def finish(self, run_id: str) -> None:
+        """Queue a finished run's image for removal on the next pass."""
+        with self._lock:
+            self._finished.add(run_id)
+        self._wake.set()
+
+    def collect(self) -> Dict[str, int]:
+        stats = {"images": 0, "bytes": 0, "registry_tags": 0}
+        # Before taking the finished runs, so a failed listing does not drop them
+        active = self.active_runs()
+        with self._lock:
+            finished, self._finished = self._finished, set()
+
+        images = self._run_images()
+        now = time.time()
+        doomed: Dict[str, Dict] = {}
+
+        for image in images:
+            if image["run_id"] in finished:
+                doomed[image["run_id"]] = image
+        candidates = [
+            image for image in images
+            if image["run_id"] not in active and image["run_id"] not in doomed
+            and now - image["created"] >= self.grace_seconds
+            and (self.owns is None or self.owns(image["run_id"]))
+        ]
+        candidate_ids = {image["run_id"] for image in candidates}
+        if self.max_age_hours is not None:
+            for image in candidates:
+                if now - image["created"] > self.max_age_hours * 3600:
+                    doomed[image["run_id"]] = image
+        if self.keep_per_project is not None:
+            by_project: Dict[str, List[Dict]] = {}
+            for image in images:
+                if image["run_id"] not in finished:
+                    by_project.setdefault(image["project"], []).append(image)
+            for project_images in by_project.values():
+                project_images.sort(key=lambda image: image["created"], reverse=True)
+                for image in project_images[self.keep_per_project:]:
+                    if image["run_id"] in candidate_ids:
+                        doomed[image["run_id"]] = image
+
+        for image in doomed.values():
+            self._remove(image, stats)
+
+        if self.disk_watermark is not None:
+            for image in sorted(candidates, key=lambda image: image["created"]):
+                if self._disk_usage() <= self.disk_watermark:
+                    break
+                if image["run_id"] not in doomed:
+                    self._remove(image, stats)
+
+        stats["bytes"] += self.docker_service.prune_dangling()
+        metrics.inc("image_gc_images", stats["images"])
+        metrics.inc("image_gc_bytes", stats["bytes"])
+        metrics.inc("image_gc_registry_tags", stats["registry_tags"])
+        if stats["images"] or stats["bytes"]:
+            log(f"Image GC removed {stats['images']} image(s), {stats['registry_tags']} registry tag(s), "
+                f"reclaimed {stats['bytes'] / 1e6:.1f} MB")
+        return stats
+
+    # Helper methods
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.collect()
+            except Exception as e:
+                log(f"Error in image GC loop: {e}", "ERROR")
+
+    def _run_images(self) -> List[Dict]:
+        images = []
+        for image in self.docker_service.list_run_images(RUN_ID_LABEL):
+            labels = image.labels or {}
+            images.append({
+                "run_id": labels[RUN_ID_LABEL],
+                "project": labels.get(PROJECT_LABEL, ""),
+                "created": self.docker_service.created_at(image),
+                "size": image.attrs.get("Size", 0),
+                "tags": image.tags,
+                "id": image.id,
+            })
+        return images
+
+    def _remove(self, image: Dict, stats: Dict[str, int]) -> None:
+        run_id = image["run_id"]
+        try:
+            self.docker_service.remove_image(image["id"], force=True)
+            stats["images"] += 1
+            stats["bytes"] += image["size"]
+        except Exception as e:
+            log(f"Failed to remove image of run {run_id}: {e}", "ERROR")
+            return
+        if self.registry is not None:
+            try:
+                if self.registry.delete(f"{self.registry_project}/{run_id}"):
+                    stats["registry_tags"] += 1
+            except Exception as e:
+                log(f"Failed to delete registry image of run {run_id}: {e}", "ERROR")
+
+    def _disk_usage(self) -> float:
+        usage = shutil.disk_usage(self.disk_path)
+        return usage.used / usage.total
@@ -1,26 +1,56 @@
 from keycloak import KeycloakAuthenticationError, KeycloakGetError, KeycloakAdmin, KeycloakOpenIDConnection, KeycloakPostError, KeycloakOpenID
+import time
 from typing import Dict, List
-from app.src.util.setup import get_settings
+from app.src.util.setup import get_settings, add_reload_listener
 from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.resilience import resilient, timeout
+from app.src.services.token_verifier import InvalidTokenError, JwksVerifier, KeysUnavailableError, TokenCache, token_key
+
+# Failed tokens are answered from memory for this long
+NEGATIVE_TTL = 60
+
+def _is_client_error(e: KeycloakGetError) -> bool:
+    # Only a 4xx answer is about the user; anything else is left to @resilient
+    return isinstance(e.response_code, int) and 400 <= e.response_code < 500
 
 class KeycloakService:
     def __init__(self):
         self.kc_settings = get_settings()['keycloak']
+        self._introspected = TokenCache()
+        self._rejected = TokenCache()
+        self._connect(self.kc_settings)
+        add_reload_listener(self._on_settings_reload)
+
+    def _connect(self, kc_settings):
         keycloak_connection = KeycloakOpenIDConnection(
-            server_url=self.kc_settings['url'],
-            username=self.kc_settings['username'],
-            password=self.kc_settings['password'],
-            realm_name=self.kc_settings['realm'],
-            client_id=self.kc_settings['admin-cli']['client_id'],
+            server_url=kc_settings['url'],
+            username=kc_settings['username'],
+            password=kc_settings['password'],
+            realm_name=kc_settings['realm'],
+            client_id=kc_settings['admin-cli']['client_id'],
+            timeout=timeout('keycloak'),
         )
         self.keycloak_admin = KeycloakAdmin(connection=keycloak_connection)
 
         self.keycloak_openid = KeycloakOpenID(
-            server_url=self.kc_settings['url'],
-            realm_name=self.kc_settings['realm'],
-            client_id=self.kc_settings['database-service']['client_id'],
-            client_secret_key=self.kc_settings['database-service']['client_secret'],
+            server_url=kc_settings['url'],
+            realm_name=kc_settings['realm'],
+            client_id=kc_settings['database-service']['client_id'],
+            client_secret_key=kc_settings['database-service']['client_secret'],
+            timeout=timeout('keycloak'),
         )
+        self.token_validation = kc_settings.get('tokenValidation', 'local')
+        self.verifier = JwksVerifier(
+            fetch_jwks=self.get_certs,
+            issuer=f"{kc_settings['url'].rstrip('/')}/realms/{kc_settings['realm']}"
+        )
+
+    def _on_settings_reload(self, old, new):
+        if old['keycloak'] != new['keycloak']:
+            self._connect(new['keycloak'])
+            self.kc_settings = new['keycloak']
+            log("Keycloak clients reloaded with new settings")
 
     def create_temp_user(self, username: str, password: str) -> str:
         client = self.keycloak_admin
@@ -96,12 +126,19 @@ class KeycloakService:
                 if not token:
                     raise KeycloakAuthenticationError("Authorization token required")
 
-                userinfo = self.keycloak_openid.introspect(token)
+                key = token_key(token)
+                if self._rejected.get(key):
+                    metrics.inc("token_validations.rejected_cached")
+                    return False
 
-                if userinfo.get('active'):
-                    return True
+                if self.token_validation == 'introspect':
+                    active = self._introspect(token, key)
                 else:
-                    return False
+                    active = self._verify_locally(token, key)
+
+                if not active:
+                    self._rejected.put(key, True, time.time() + NEGATIVE_TTL)
+                return active
 
             except KeycloakAuthenticationError as e:
                 log(f"Token validation error: {str(e)}", "ERROR")
@@ -110,6 +147,43 @@ class KeycloakService:
                 log(f"Unexpected error during token validation: {str(e)}", "ERROR")
                 raise KeycloakAuthenticationError("Error during token validation")
 
+    def _verify_locally(self, token: str, key: str) -> bool:
+        try:
+            self.verifier.verify(token)
+        except KeysUnavailableError as e:
+            # No key to check against is not a verdict on the token; ask Keycloak instead
+            log(f"Local verification unavailable, introspecting: {e}", "WARNING")
+            metrics.inc("token_validations.keys_unavailable")
+            return self._introspect(token, key)
+        except InvalidTokenError as e:
+            log(f"Token rejected: {e}")
+            metrics.inc("token_validations.rejected")
+            return False
+        metrics.inc("token_validations.local")
+        return True
+
+    def _introspect(self, token: str, key: str) -> bool:
+        # Online checks see revocations; an active answer holds until the token expires
+        if self._introspected.get(key):
+            metrics.inc("token_validations.introspect_cached")
+            return True
+        userinfo = self.introspect(token)
+        metrics.inc("token_validations.introspect")
+        if not userinfo.get('active'):
+            metrics.inc("token_validations.rejected")
+            return False
+        if userinfo.get('exp'):
+            self._introspected.put(key, True, float(userinfo['exp']))
+        return True
+
+    @resilient('keycloak', idempotent=True)
+    def introspect(self, token: str) -> Dict[str, any]:
+        return self.keycloak_openid.introspect(token)
+
+    @resilient('keycloak', idempotent=True)
+    def get_certs(self) -> Dict[str, any]:
+        return self.keycloak_openid.certs()
+
     def get_access_token_username_password(self, username, password) -> dict[str, str]:
         try:
             token = self.keycloak_openid.token(username=username, password=password, grant_type="client_credentials")
@@ -119,24 +193,31 @@ class KeycloakService:
             log(f"Error obtaining access token: {str(e)}", "ERROR")
             return {}
 
+    @resilient('keycloak', idempotent=True)
     def get_user_realm_roles(self,user_id: str) -> Dict[str, any]:
         client = self.keycloak_admin
         try:
             roles = client.get_realm_roles_of_user(user_id)
         except KeycloakGetError as e:
+            if not _is_client_error(e):
+                raise
             log(f'Error fetching realm roles for user {user_id}. Details: {e}', "ERROR")
             return None
         return roles
 
+    @resilient('keycloak', idempotent=True)
     def get_user_groups(self,user_id: str) -> List[Dict[str, any]]:
         client = self.keycloak_admin
         try:
             groups = client.get_user_groups(user_id=user_id)
         except KeycloakGetError as e:
+            if not _is_client_error(e):
+                raise
             log(f'Error fetching groups for user {user_id}. Details: {e}', "ERROR")
             return []
         return groups
 
+    @resilient('keycloak', idempotent=True)
     def get_user_client_roles(self,user_id: str, client_id: str) -> List[Dict[str, any]]:
         client = self.keycloak_admin
         try:
@@ -149,6 +230,8 @@ class KeycloakService:
 
             roles = client.get_client_roles_of_user(user_id=user_id, client_id=client_internal_id)
         except KeycloakGetError as e:
+            if not _is_client_error(e):
+                raise
             log(f'Error fetching client roles for user {user_id} in client {client_id}. Details: {e}', "ERROR")
             return []
         return roles
@@ -1,16 +1,23 @@
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Set, Tuple
 from kubernetes import client
-from app.src.util.setup import get_settings
 from app.src.util.logger import log
-from app.src.services.kubernetes_services.namespace_service import NamespaceService
+from app.src.services.kubernetes_services.namespace_service import NamespaceService, run_id_of
 from app.src.services.kubernetes_services.pod_service import PodService
 from app.src.services.kubernetes_services.persistent_volume_service import PersistentVolumeService
 from app.src.services.kubernetes_services.secret_service import SecretService
 from app.src.services.kubernetes_services.helm_service import HelmService
 from app.src.services.kubernetes_services.service_account_service import ServiceAccountService
+from app.src.services.kubernetes_services.gpu_capacity_service import GpuCapacityService
+from app.src.services.kubernetes_services.warm_pool_service import WarmPoolService, POOL_LABEL, POOL_SERVICE_ACCOUNT
+from app.src.services.kubernetes_services.labels import MANAGED_SELECTOR, managed_labels
+from app.src.services.kubernetes_services.records import NamespaceRecord, namespace_records
+from app.src.services.cache_service import CacheService
+from app.src.util.deadlines import DeadlineHeap
 
-import os
 import datetime
+import math
+
+RUN_SELECTOR = f"{MANAGED_SELECTOR},{POOL_LABEL}!=warm"
 
 class KubernetesService:
     def __init__(
@@ -20,7 +27,11 @@ class KubernetesService:
         pv_service: PersistentVolumeService,
         secret_service: SecretService,
         helm_service: HelmService,
-        service_account_service: ServiceAccountService
+        service_account_service: ServiceAccountService,
+        gpu_service: GpuCapacityService,
+        cache_service: CacheService,
+        warm_pool: Optional[WarmPoolService] = None,
+        deadlines: Optional[DeadlineHeap] = None
     ):
         self.namespace_service = namespace_service
         self.pod_service = pod_service
@@ -28,38 +39,108 @@ class KubernetesService:
         self.secret_service = secret_service
         self.helm_service = helm_service
         self.service_account_service = service_account_service
-        self.config_path = get_settings()['k8s']['configPath']
+        self.gpu_service = gpu_service
+        self.cache_service = cache_service
+        self.warm_pool = warm_pool
+        self.deadlines = deadlines if deadlines is not None else DeadlineHeap()
+
+    def reserve_cache(self, run_meta: Dict, keycloak_user_id: str, run_id: str) -> None:
+        """Reserve the run's cache at admission, before anything is provisioned. Raises if it cannot fit."""
+        if not run_meta.get("cache_dir"):
+            return
+        size_gb = run_meta.get('cache_size_gb') or 0
+        try:
+            size_gb = float(size_gb)
+        except (TypeError, ValueError):
+            raise Exception(f"Invalid cache_size_gb {size_gb!r} for run {run_id}")
+        if not math.isfinite(size_gb) or size_gb < 0:
+            raise Exception(f"Invalid cache_size_gb {size_gb!r} for run {run_id}")
+        self.cache_service.open(keycloak_user_id, run_meta['cache_dir'], run_id, int(size_gb * 1024 ** 3))
 
-    def handle_cache_dir(self, run_meta: Dict, keycloak_user_id: str, run_id: str) -> tuple[Optional[str], Optional[str]]:
+    def handle_cache_dir(self, run_meta: Dict, keycloak_user_id: str, run_id: str, namespace: Optional[str] = None) -> tuple[Optional[str], Optional[str]]:
+        # The cache itself was reserved by reserve_cache
         cache_dir = None
         mount_path = None
         if "cache_dir" in run_meta and run_meta["cache_dir"]:
             mount_path = run_meta.get('mount_path', '/cache')
             cache_dir = run_meta['cache_dir']
-            cache_path = f"{get_settings()['path']['cachePath']}/{keycloak_user_id}/{cache_dir}"
-            if not os.path.exists(cache_path):
-                os.makedirs(cache_path)
-                log(f"Cache directory created at: {cache_path}")
+            # Lets a restarted secd know the cache is still in use
+            self.namespace_service.update_annotations(namespace or f"secd-{run_id}", {"cachedir": cache_dir})
         return cache_dir, mount_path
 
-    def create_namespace(self, user_id: str, run_id: str, run_for: int, labels: str) -> None:
+    def create_namespace(self, user_id: str, run_id: str, run_for: int, labels: str, pooled: bool = False) -> tuple[str, Optional[str]]:
+        """Create the run's namespace, or claim a warm one when pooled.
+
+        Returns the namespace name and, for a warm namespace, the service
+        account that already exists in it.
+        """
         run_until = datetime.datetime.now() + datetime.timedelta(hours=run_for)
-        namespace_name = f"secd-{run_id}"
         annotations = {"userid": user_id, "rununtil": run_until.isoformat()}
+        labels = managed_labels(run_id, labels)
+        if pooled and self.warm_pool is not None:
+            namespace_name = self.warm_pool.claim(run_id, labels, annotations)
+            if namespace_name:
+                self.deadlines.set(run_id, namespace_name, run_until)
+                return namespace_name, POOL_SERVICE_ACCOUNT
+        namespace_name = f"secd-{run_id}"
         self.namespace_service.create_namespace(namespace_name, labels, annotations)
+        self.deadlines.set(run_id, namespace_name, run_until)
+        return namespace_name, None
+
+    def set_run_until(self, namespace_name: str, run_until: datetime.datetime, run_id: Optional[str] = None) -> None:
+        self.namespace_service.update_annotations(namespace_name, {"rununtil": run_until.isoformat()})
+        self.deadlines.set(run_id or namespace_name.replace("secd-", ""), namespace_name, run_until)
+
+    def get_secd_namespaces(self) -> List[NamespaceRecord]:
+        # Warm pool namespaces are not runs yet
+        return self.namespace_service.get_namespaces(RUN_SELECTOR)
+
+    def get_run_namespaces(self) -> List[NamespaceRecord]:
+        # Unlike get_secd_namespaces, a failed list raises instead of reading as "no runs"
+        return namespace_records(self.namespace_service.v1, RUN_SELECTOR)
+
+    def get_run_ids(self) -> Set[str]:
+        return {run_id_of(namespace) for namespace in self.get_run_namespaces()}
 
     def cleanup_resources(self) -> List[str]:
-        secd_namespaces = []
+        return self._cleanup(self.get_secd_namespaces())
+
+    def expire_runs(self, due: Optional[List[Tuple[str, str]]] = None) -> List[str]:
+        """Clean up only the runs whose deadline has passed, without listing every namespace.
+
+        due is a list of (run_id, namespace) already popped from the heap,
+        e.g. by ClusterRegistry; by default the due runs are popped here.
+        """
+        namespaces = []
+        for run_id, namespace_name in (due if due is not None else self.deadlines.pop_due()):
+            namespace = self.namespace_service.get_namespace(namespace_name)
+            if namespace is not None:
+                namespaces.append(namespace)
+        run_ids = self._cleanup(namespaces)
+
+        # Deadlines extended by another writer go back on the heap
+        for namespace in namespaces:
+            run_id = run_id_of(namespace)
+            rununtil = (namespace.metadata.annotations or {}).get('rununtil')
+            if run_id not in run_ids and rununtil:
+                self.deadlines.set(run_id, namespace.metadata.name, datetime.datetime.fromisoformat(rununtil))
+        return run_ids
 
-        namespaces = self.namespace_service.get_namespaces()
-        for namespace in namespaces.items:
-            if namespace.metadata.name.startswith("secd-"):
-                secd_namespaces.append(namespace)
+    def discard_run(self, run_id: str, namespace_name: Optional[str], pv_name: Optional[str] = None) -> None:
+        """Remove what a run that failed to provision left behind; its pod and PVC go with the namespace."""
+        self.deadlines.remove(run_id)
+        if namespace_name:
+            self.namespace_service.delete_namespace(namespace_name)
+        if pv_name:
+            self.pv_service.delete_persistent_volume(pv_name)
 
-        self.pv_service.cleanup_persistent_volumes(secd_namespaces)
-        self.service_account_service.cleanup_service_accounts(secd_namespaces)
+    def _cleanup(self, namespaces: List[client.V1Namespace]) -> List[str]:
+        self.pv_service.cleanup_persistent_volumes(namespaces)
+        self.service_account_service.cleanup_service_accounts(namespaces)
 
-        run_ids = self.namespace_service.cleanup_namespaces(secd_namespaces)
+        run_ids = self.namespace_service.cleanup_namespaces(namespaces)
+        for run_id in run_ids:
+            self.deadlines.remove(run_id)
         return run_ids
 
     def get_secret(self, namespace: str, secret_name: str, key: str) -> Optional[str]:
@@ -0,0 +1,128 @@
+import datetime
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from kubernetes import client
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.services.kubernetes_services.labels import list_all
+
+GPU_RESOURCE = "nvidia.com/gpu"
+
+class GpuCapacityService():
+    """Tracks allocatable and requested GPUs per node and queues GPU runs.
+
+    Runs wait in FIFO order until a node has a free GPU. A granted run holds
+    a reservation until its pod is bound to a node, after which the pod's
+    own request is counted instead.
+    """
+    def __init__(self, config: Optional[client.Configuration] = None, api=None, poll_interval: float = 15):
+        if api is None:
+            api_client = client.ApiClient(configuration=config)
+            api = client.CoreV1Api(api_client=api_client)
+        self.v1 = api
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._reserved: Dict[str, int] = {}
+        self._withdrawn = set()
+
+    def get_capacity(self) -> Dict[str, Tuple[int, int]]:
+        """Return {node_name: (allocatable, requested)} for schedulable GPU nodes."""
+        capacity = {}
+        for node in list_all(self.v1.list_node):
+            if node.spec and node.spec.unschedulable:
+                continue
+            allocatable = int((node.status.allocatable or {}).get(GPU_RESOURCE, 0))
+            if allocatable > 0:
+                capacity[node.metadata.name] = (allocatable, 0)
+
+        pods = list_all(
+            self.v1.list_pod_for_all_namespaces,
+            field_selector="status.phase!=Succeeded,status.phase!=Failed"
+        )
+        for pod in pods:
+            node_name = pod.spec.node_name
+            if node_name not in capacity:
+                continue
+            allocatable, requested = capacity[node_name]
+            capacity[node_name] = (allocatable, requested + self._pod_gpus(pod))
+        return capacity
+
+    def free_gpus(self) -> Tuple[int, int]:
+        """Return (total free GPUs, largest free count on a single node), net of reservations."""
+        capacity = self.get_capacity()
+        with self._cond:
+            return self._free(capacity)
+
+    def acquire(self, run_id: str, count: int = 1, timeout: Optional[float] = None) -> None:
+        """Block until count GPUs fit on one node, then reserve them for run_id."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._queue.append(run_id)
+            metrics.set_gauge("gpu_runs_queued", len(self._queue))
+        try:
+            while True:
+                with self._cond:
+                    head = self._queue[0] == run_id
+                # The cluster-wide lists run without the lock, so release() and bind() never wait on them
+                capacity = self.get_capacity() if head else None
+                with self._cond:
+                    if run_id in self._withdrawn:
+                        raise Exception(f"Run {run_id} withdrawn from the GPU queue")
+                    if capacity is not None and self._free(capacity)[1] >= count:
+                        self._reserved[run_id] = count
+                        log(f"Run {run_id} granted {count} GPU(s)")
+                        return
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise Exception(f"Timed out waiting for GPU capacity for run {run_id}")
+                    self._cond.wait(self.poll_interval)
+        finally:
+            with self._cond:
+                self._withdrawn.discard(run_id)
+                self._queue.remove(run_id)
+                metrics.set_gauge("gpu_runs_queued", len(self._queue))
+                self._cond.notify_all()
+
+    def bind(self, run_id: str) -> None:
+        """The run's pod is on a node; its request now shows up in get_capacity."""
+        self.release(run_id)
+
+    def release(self, run_id: str) -> None:
+        """Drop the run's reservation, or take it out of the queue if it is still waiting."""
+        with self._cond:
+            if self._reserved.pop(run_id, None) is None and run_id in self._queue:
+                self._withdrawn.add(run_id)
+            self._cond.notify_all()
+
+    def wait_for_scheduled(self, namespace: str, pod_name: str, timeout: Optional[float] = None) -> datetime.datetime:
+        """Return the local time at which the pod was bound to a node."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pod = self.v1.read_namespaced_pod(pod_name, namespace)
+            for condition in (pod.status.conditions or []) if pod.status else []:
+                if condition.type == "PodScheduled" and condition.status == "True":
+                    if condition.last_transition_time:
+                        return condition.last_transition_time.astimezone().replace(tzinfo=None)
+                    return datetime.datetime.now()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise Exception(f"Pod {pod_name} in namespace {namespace} was not scheduled in time")
+            time.sleep(min(self.poll_interval, 5))
+
+    # Helper methods
+    def _free(self, capacity: Dict[str, Tuple[int, int]]) -> Tuple[int, int]:
+        free_per_node = [max(0, a - r) for a, r in capacity.values()]
+        total = max(0, sum(free_per_node) - sum(self._reserved.values()))
+        return total, min(max(free_per_node, default=0), total)
+
+    def _pod_gpus(self, pod) -> int:
+        total = 0
+        for container in pod.spec.containers or []:
+            resources = container.resources
+            if not resources:
+                continue
+            requests = resources.requests or {}
+            limits = resources.limits or {}
+            total += int(requests.get(GPU_RESOURCE, limits.get(GPU_RESOURCE, 0)))
+        return total
@@ -8,11 +8,9 @@ class HelmService():
         self.v1 = client.CoreV1Api(api_client=api_client)
 
     def get_service_by_helm_release(self, release_name: str, namespace: str) -> Optional[str]:
-        services = self.v1.list_namespaced_service(namespace).items
+        services = self.v1.list_namespaced_service(namespace, label_selector=f"release={release_name}", limit=1).items
         for service in services:
-            labels = service.metadata.labels or {}
-            if labels.get('release') == release_name:
-                service_fqdn = f"{service.metadata.name}.{namespace}.svc.cluster.local"
-                log(f"Service '{service.metadata.name}' matches Helm release '{release_name}'.")
-                return service_fqdn
-        return None
\ No newline at end of file
+            service_fqdn = f"{service.metadata.name}.{namespace}.svc.cluster.local"
+            log(f"Service '{service.metadata.name}' matches Helm release '{release_name}'.")
+            return service_fqdn
+        return None
@@ -0,0 +1,25 @@
+from typing import Any, Callable, Dict, Iterator, Optional
+
+MANAGED_BY_LABEL = "app.kubernetes.io/managed-by"
+MANAGED_BY = "secd"
+RUN_ID_LABEL = "secd/run-id"
+MANAGED_SELECTOR = f"{MANAGED_BY_LABEL}={MANAGED_BY}"
+PAGE_SIZE = 500
+
+def managed_labels(run_id: Optional[str] = None, labels: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Labels every secd-created resource carries, merged over labels."""
+    result = dict(labels or {})
+    result[MANAGED_BY_LABEL] = MANAGED_BY
+    if run_id:
+        result[RUN_ID_LABEL] = run_id
+    return result
+
+def list_all(list_fn: Callable[..., Any], page_size: int = PAGE_SIZE, **kwargs) -> Iterator[Any]:
+    """Yield every item of a Kubernetes list call, one page of page_size at a time."""
+    _continue = None
+    while True:
+        page = list_fn(limit=page_size, _continue=_continue, **kwargs)
+        yield from page.items
+        _continue = page.metadata._continue if page.metadata else None
+        if not _continue:
+            return
@@ -1,8 +1,15 @@
 from kubernetes import client, config
 from app.src.util.logger import log
+from app.src.services.kubernetes_services.labels import MANAGED_SELECTOR, RUN_ID_LABEL
+from app.src.services.kubernetes_services.records import NamespaceRecord, namespace_records, pod_records
 from typing import List, Optional
 import datetime
 
+def run_id_of(namespace: client.V1Namespace) -> str:
+    # Warm pool namespaces carry the run id in a label, not in their name
+    labels = namespace.metadata.labels or {}
+    return labels.get(RUN_ID_LABEL) or namespace.metadata.name.replace("secd-", "")
+
 class NamespaceService():
     def __init__(self, config: client.Configuration):   
         api_client = client.ApiClient(configuration=config)
@@ -24,13 +31,20 @@ class NamespaceService():
             log(f"Failed to get namespace {name}: {e}", "ERROR")
             return None
         
-    def get_namespaces(self) -> List[client.V1Namespace]:
+    def get_namespaces(self, label_selector: str = MANAGED_SELECTOR) -> List[NamespaceRecord]:
         try:
-            return self.v1.list_namespace()
+            return namespace_records(self.v1, label_selector)
         except client.ApiException as e:
             log(f"Failed to get namespaces: {e}", "ERROR")
             return []
     
+    def update_annotations(self, name: str, annotations: dict) -> None:
+        try:
+            self.v1.patch_namespace(name=name, body={"metadata": {"annotations": annotations}})
+        except client.ApiException as e:
+            log(f"Failed to update annotations of namespace {name}: {e}", "ERROR")
+            raise
+
     def delete_namespace(self, name: str) -> None:
         try:
             self.v1.delete_namespace(name=name)
@@ -59,27 +73,27 @@ class NamespaceService():
         return expired or completed
     
     def _cleanup_namespace(self, namespace) -> str:
-        run_id = namespace.metadata.name.replace("secd-", "")
+        run_id = run_id_of(namespace)
         self.v1.delete_namespace(namespace.metadata.name)
         log(f"Namespace {namespace.metadata.name} deleted")
         return run_id
 
     def _is_pod_completed(self, namespace_name: str) -> bool:
-        pod_list = self.v1.list_namespaced_pod(namespace=namespace_name)
-        if len(pod_list.items) == 0:
+        pod_list = pod_records(self.v1, namespace_name, limit=1)
+        if len(pod_list) == 0:
             #log(f"No pods found in namespace: {namespace_name}", "INFO")
             return False
 
         # Assuming one pod per namespace; take the first pod
-        pod = pod_list.items[0]
-        log(f"Pod found in namespace: {namespace_name} with phase: {pod.status.phase}", "INFO")
+        pod = pod_list[0]
+        log(f"Pod found in namespace: {namespace_name} with phase: {pod.phase}", "INFO")
 
         # Check the status of the main container (not the sidecar)
-        for container_status in pod.status.container_statuses or []:
+        for container_status in pod.containers:
             # Identify the main container by name (excluding sidecar)
             if container_status.name.startswith("secd-") and not container_status.name == "vault-agent":
-                #log(f"Main container {container_status.name} state: {container_status.state}", "DEBUG")
-                if container_status.state.terminated:
+                #log(f"Main container {container_status.name} terminated: {container_status.terminated}", "DEBUG")
+                if container_status.terminated:
                     # Main container has terminated; check if it succeeded or failed
                     #log(f"Main container {container_status.name} terminated with exit code: {container_status.state.terminated.exit_code}", "INFO")
                     return True  # Return True if the main container has finished (regardless of success/failure)
@@ -3,6 +3,8 @@ import time
 from kubernetes import client, config
 from app.src.util.setup import get_settings
 from app.src.util.logger import log
+from app.src.services.kubernetes_services.labels import managed_labels
+from app.src.services.kubernetes_services.records import pod_records
 from typing import List, Optional
 
 class PersistentVolumeService():
@@ -15,10 +17,11 @@ class PersistentVolumeService():
         name: str,
         path: str,
         capacity: str = "50Gi",
-        access_modes: List[str] = ["ReadWriteOnce"]
+        access_modes: List[str] = ["ReadWriteOnce"],
+        run_id: Optional[str] = None
     ) -> client.V1PersistentVolume:
         pv = client.V1PersistentVolume(
-            metadata=client.V1ObjectMeta(name=name),
+            metadata=client.V1ObjectMeta(name=name, labels=managed_labels(run_id)),
             spec=client.V1PersistentVolumeSpec(
                 access_modes=access_modes,
                 capacity={"storage": capacity},
@@ -73,7 +76,8 @@ class PersistentVolumeService():
             self.v1.delete_persistent_volume(name)
             log(f"PV {name} deleted")
         except client.ApiException as e:
-            log(f"Failed to delete PV {name}: {e}", "ERROR")
+            if e.status != 404:
+                log(f"Failed to delete PV {name}: {e}", "ERROR")
 
     def create_persistent_volume_claim(
         self,
@@ -82,12 +86,13 @@ class PersistentVolumeService():
         volume_name: str,
         storage_size: str = "100Gi",
         access_modes: Optional[List[str]] = None,
-        storage_class_name: str = "nfs"
+        storage_class_name: str = "nfs",
+        run_id: Optional[str] = None
     ) -> client.V1PersistentVolumeClaim:
         if access_modes is None:
             access_modes = ["ReadOnlyMany"]
         pvc = client.V1PersistentVolumeClaim(
-            metadata=client.V1ObjectMeta(name=pvc_name, namespace=namespace),
+            metadata=client.V1ObjectMeta(name=pvc_name, namespace=namespace, labels=managed_labels(run_id)),
             spec=client.V1PersistentVolumeClaimSpec(
                 access_modes=access_modes,
                 resources=client.V1ResourceRequirements(requests={"storage": storage_size}),
@@ -202,9 +207,9 @@ class PersistentVolumeService():
         return expired or completed
     
     def _is_pod_completed(self, namespace_name: str) -> bool:
-        pod_list = self.v1.list_namespaced_pod(namespace=namespace_name)
-        if len(pod_list.items) > 0:
-            pod = pod_list.items[0]
-            log(f"Pod found in namespace: {namespace_name} with phase: {pod.status.phase}")
-            return pod.status.phase in ['Succeeded', 'Failed']
+        pod_list = pod_records(self.v1, namespace_name, limit=1)
+        if len(pod_list) > 0:
+            pod = pod_list[0]
+            log(f"Pod found in namespace: {namespace_name} with phase: {pod.phase}")
+            return pod.phase in ['Succeeded', 'Failed']
         return False
@@ -1,6 +1,7 @@
 from kubernetes import client
 from app.src.util.setup import get_settings
 from app.src.util.logger import log
+from app.src.services.kubernetes_services.labels import managed_labels, list_all
 from typing import List, Optional, Dict
 
 class PodService():
@@ -12,7 +13,8 @@ class PodService():
         try:
             pods = self.v1.list_namespaced_pod(
                 namespace=namespace,
-                label_selector=label_selector
+                label_selector=label_selector,
+                limit=1
             ).items
             if pods:
                 pod = pods[0]
@@ -38,7 +40,8 @@ class PodService():
         persistence_volumes = [
             client.V1PersistentVolume(
                 metadata=client.V1ObjectMeta(
-                    name=f"secd-pv-{run_id}-input"
+                    name=f"secd-pv-{run_id}-input",
+                    labels=managed_labels(run_id)
                 ),
                 spec=client.V1PersistentVolumeSpec(
                     access_modes = ["ReadOnlyMany"],
@@ -76,7 +79,8 @@ class PodService():
             client.V1PersistentVolumeClaim(
                 metadata=client.V1ObjectMeta(
                     name=f"secd-pvc-{run_id}-input",
-                    namespace=pod_name
+                    namespace=pod_name,
+                    labels=managed_labels(run_id)
                 ),
                 spec=client.V1PersistentVolumeClaimSpec(
                     access_modes=["ReadOnlyMany"],
@@ -90,7 +94,8 @@ class PodService():
             client.V1PersistentVolumeClaim(
                 metadata=client.V1ObjectMeta(
                     name=f"secd-pvc-{run_id}-output",
-                    namespace=pod_name
+                    namespace=pod_name,
+                    labels=managed_labels(run_id)
                 ),
                 spec=client.V1PersistentVolumeClaimSpec(
                     access_modes=["ReadWriteOnce"],
@@ -136,7 +141,7 @@ class PodService():
         pod = client.V1Pod(
             api_version="v1",
             kind="Pod",
-            metadata=client.V1ObjectMeta(name=pod_name),
+            metadata=client.V1ObjectMeta(name=pod_name, labels=managed_labels(run_id)),
             spec=client.V1PodSpec(
                 volumes=pod_volumes,
                 containers=containers,
@@ -162,14 +167,15 @@ class PodService():
         database: str,
         namespace: str,
         pvc_name: str,
-        vault_role: str
+        vault_role: str,
+        service_account_name: Optional[str] = None
     ) -> client.V1Pod:
         try:
             pod_name = f"secd-{run_id}"
             database_name = database 
-            service_account_name = f"sa-{database_name}"  # e.g., sa-mysql-1
+            service_account_name = service_account_name or f"sa-{database_name}"  # e.g., sa-mysql-1
             k8s_auth_role_name = f"role-{database_name}-{namespace}"  # e.g., role-mysql-1-secd-<run_id>
-            db_role_name = f"role-{database_name}"  # e.g., role-mysql-1
+            db_role_name = vault_role or f"role-{database_name}"  # e.g., role-mysql-1-<run_id>
 
             # Vault annotations for credential injection
             annotations = {
@@ -186,7 +192,7 @@ class PodService():
 
             k8s_envs = [client.V1EnvVar(name=key, value=value) for key, value in envs.items()]
             resources = client.V1ResourceRequirements()
-            labels = {"name": database_name, "run_id": run_id}
+            labels = managed_labels(run_id, {"name": database_name, "run_id": run_id})
             volumes = []
             volume_mounts = []
 
@@ -305,8 +311,8 @@ class PodService():
             log(f"Failed to get pod {name} in namespace {namespace}: {e}", "ERROR")
             return None
 
-    def list_pods(self, namespace: str) -> List[client.V1Pod]:
-        return self.v1.list_namespaced_pod(namespace).items
+    def list_pods(self, namespace: str, label_selector: Optional[str] = None) -> List[client.V1Pod]:
+        return list(list_all(self.v1.list_namespaced_pod, namespace=namespace, label_selector=label_selector))
 
     def delete_pod(self, namespace: str, name: str) -> None:
         try:
@@ -316,12 +322,10 @@ class PodService():
             log(f"Failed to delete pod {name} in namespace {namespace}: {e}", "ERROR")
 
     def get_pod_by_helm_release(self, release_name: str, namespace: str) -> Optional[client.V1Pod]:
-        pods = self.list_pods(namespace)
+        pods = self.v1.list_namespaced_pod(namespace, label_selector=f"release={release_name}", limit=1).items
         for pod in pods:
-            labels = pod.metadata.labels or {}
-            if labels.get('release') == release_name:
-                log(f"Pod '{pod.metadata.name}' matches Helm release '{release_name}'.")
-                return pod
+            log(f"Pod '{pod.metadata.name}' matches Helm release '{release_name}'.")
+            return pod
         return None
 
     def get_pod_ip(self, namespace: str, pod_name_prefix: str) -> Optional[str]:
@@ -0,0 +1,57 @@
+import json
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.src.services.kubernetes_services.labels import PAGE_SIZE
+
+class MetaRecord():
+    __slots__ = ("name", "namespace", "labels", "annotations")
+
+    def __init__(self, meta: Dict[str, Any]):
+        self.name = meta.get("name")
+        self.namespace = meta.get("namespace")
+        self.labels = meta.get("labels")
+        self.annotations = meta.get("annotations")
+
+class NamespaceRecord():
+    """The fields the cleanup loop reads from a namespace, shaped like V1Namespace.metadata."""
+    __slots__ = ("metadata", "phase")
+
+    def __init__(self, item: Dict[str, Any]):
+        self.metadata = MetaRecord(item.get("metadata") or {})
+        self.phase = (item.get("status") or {}).get("phase")
+
+class ContainerRecord():
+    __slots__ = ("name", "terminated")
+
+    def __init__(self, status: Dict[str, Any]):
+        self.name = status.get("name")
+        self.terminated = "terminated" in (status.get("state") or {})
+
+class PodRecord():
+    __slots__ = ("metadata", "phase", "containers")
+
+    def __init__(self, item: Dict[str, Any]):
+        status = item.get("status") or {}
+        self.metadata = MetaRecord(item.get("metadata") or {})
+        self.phase = status.get("phase")
+        self.containers = [ContainerRecord(c) for c in status.get("containerStatuses") or []]
+
+def list_raw(list_fn: Callable[..., Any], page_size: int = PAGE_SIZE, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Like labels.list_all, but yields plain JSON dicts instead of client model objects."""
+    _continue = None
+    while True:
+        response = list_fn(limit=page_size, _continue=_continue, _preload_content=False, **kwargs)
+        page = json.loads(response.data)
+        yield from page.get("items") or []
+        _continue = (page.get("metadata") or {}).get("continue")
+        if not _continue:
+            return
+
+def namespace_records(v1, label_selector: Optional[str] = None) -> List[NamespaceRecord]:
+    return [NamespaceRecord(item) for item in list_raw(v1.list_namespace, label_selector=label_selector)]
+
+def pod_records(v1, namespace: str, limit: Optional[int] = None) -> List[PodRecord]:
+    if limit is not None:
+        response = v1.list_namespaced_pod(namespace=namespace, limit=limit, _preload_content=False)
+        return [PodRecord(item) for item in json.loads(response.data).get("items") or []]
+    return [PodRecord(item) for item in list_raw(v1.list_namespaced_pod, namespace=namespace)]
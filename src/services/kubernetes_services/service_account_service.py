@@ -2,6 +2,8 @@ import datetime
 from typing import List
 from kubernetes import client
 from app.src.util.logger import log
+from app.src.services.kubernetes_services.labels import managed_labels
+from app.src.services.kubernetes_services.records import pod_records
 
 class ServiceAccountService():
     def __init__(self, config: client.Configuration):   
@@ -10,7 +12,7 @@ class ServiceAccountService():
 
     def create_service_account(self, name: str, namespace: str) -> None:
         sa = client.V1ServiceAccount(
-            metadata=client.V1ObjectMeta(name=name, namespace=namespace)
+            metadata=client.V1ObjectMeta(name=name, namespace=namespace, labels=managed_labels())
         )
         self.v1.create_namespaced_service_account(namespace=namespace, body=sa)
 
@@ -38,9 +40,9 @@ class ServiceAccountService():
 
     def _is_pod_completed(self, namespace_name: str) -> bool:
         """Check if the pod in the namespace is completed (Succeeded or Failed)."""
-        pod_list = self.v1.list_namespaced_pod(namespace=namespace_name)
-        if len(pod_list.items) > 0:
-            pod = pod_list.items[0]  # Assuming one pod per namespace, as in pv_service
-            #log(f"Pod found in namespace: {namespace_name} with phase: {pod.status.phase}", "DEBUG")
-            return pod.status.phase in ['Succeeded', 'Failed']
+        pod_list = pod_records(self.v1, namespace_name, limit=1)
+        if len(pod_list) > 0:
+            pod = pod_list[0]  # Assuming one pod per namespace, as in pv_service
+            #log(f"Pod found in namespace: {namespace_name} with phase: {pod.phase}", "DEBUG")
+            return pod.phase in ['Succeeded', 'Failed']
         return False  # No pods means we can proceed with cleanup
\ No newline at end of file
@@ -0,0 +1,95 @@
+import threading
+import uuid
+from typing import Dict, Optional
+from kubernetes import client
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.services.kubernetes_services.labels import MANAGED_SELECTOR, managed_labels
+
+POOL_LABEL = "secd/pool"
+POOL_SERVICE_ACCOUNT = "secd-runner"
+
+class WarmPoolService():
+    """Keeps ready secd-pool-* namespaces, each with a runner service account.
+
+    A run claims a warm namespace by relabelling it with the namespace's
+    resourceVersion as a precondition, so two claims can never win the
+    same namespace. The pool is refilled in the background after every
+    claim.
+    """
+    def __init__(self, config: client.Configuration, size: int):
+        api_client = client.ApiClient(configuration=config)
+        self.v1 = client.CoreV1Api(api_client=api_client)
+        self.size = size
+        self._refill = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+            self._thread.start()
+            self._refill.set()
+
+    def claim(self, run_id: str, labels: Dict[str, str], annotations: Dict[str, str]) -> Optional[str]:
+        """Claim a warm namespace for run_id. Returns its name, or None if the pool is empty."""
+        try:
+            warm = self.v1.list_namespace(label_selector=f"{MANAGED_SELECTOR},{POOL_LABEL}=warm").items
+        except client.ApiException as e:
+            log(f"Failed to list warm namespaces: {e}", "ERROR")
+            return None
+
+        for namespace in warm:
+            if namespace.status and namespace.status.phase == "Terminating":
+                continue
+            body = {
+                "metadata": {
+                    "resourceVersion": namespace.metadata.resource_version,
+                    "labels": {**managed_labels(run_id, labels), POOL_LABEL: "claimed"},
+                    "annotations": annotations,
+                }
+            }
+            try:
+                self.v1.patch_namespace(name=namespace.metadata.name, body=body)
+            except client.ApiException as e:
+                if e.status == 409:
+                    continue  # Claimed by someone else first
+                log(f"Failed to claim namespace {namespace.metadata.name}: {e}", "ERROR")
+                continue
+            metrics.inc("warm_pool_claims")
+            log(f"Run {run_id} claimed warm namespace {namespace.metadata.name}")
+            self._refill.set()
+            return namespace.metadata.name
+
+        metrics.inc("warm_pool_misses")
+        self._refill.set()
+        return None
+
+    # Helper methods
+    def _run(self) -> None:
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            try:
+                self._fill()
+            except Exception as e:
+                log(f"Error refilling warm pool: {e}", "ERROR")
+                self._refill.wait(30)
+                self._refill.set()
+
+    def _fill(self) -> None:
+        warm = self.v1.list_namespace(label_selector=f"{MANAGED_SELECTOR},{POOL_LABEL}=warm").items
+        metrics.set_gauge("warm_pool_size", len(warm))
+        for _ in range(self.size - len(warm)):
+            self._create_warm_namespace()
+
+    def _create_warm_namespace(self) -> None:
+        name = f"secd-pool-{uuid.uuid4().hex[:12]}"
+        namespace = client.V1Namespace(
+            metadata=client.V1ObjectMeta(name=name, labels=managed_labels(labels={POOL_LABEL: "warm"}))
+        )
+        self.v1.create_namespace(body=namespace)
+        sa = client.V1ServiceAccount(
+            metadata=client.V1ObjectMeta(name=POOL_SERVICE_ACCOUNT, namespace=name, labels=managed_labels())
+        )
+        self.v1.create_namespaced_service_account(namespace=name, body=sa)
+        log(f"{name} warm namespace created")
@@ -0,0 +1,172 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Dict
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+CHUNK_SIZE = 8 * 1024 * 1024
+FICLONE = 0x40049409
+
+class OutputStore():
+    """Content-addressed object store for run outputs on NFS.
+
+    Every file under a run's outputs is hashed and shared with identical
+    files from other runs through a hard link, or a reflink when enabled and
+    supported. Each object keeps one marker per referencing run under
+    refs/<digest>/, and is deleted when its last run is released.
+
+    The store keeps a run's outputs after its workspace is gone, so later
+    runs can share them. That costs NFS space: a run is only released
+    retention_seconds after its outputs were stored.
+    """
+    def __init__(self, root: str, reflink: bool = False, retention_seconds: float = 24 * 3600, prune_interval: float = 3600):
+        self.root = root
+        self.reflink = reflink
+        self.retention_seconds = retention_seconds
+        self.prune_interval = prune_interval
+        self._thread = None
+        for directory in ("objects", "refs", "runs"):
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="output-store-prune", daemon=True)
+            self._thread.start()
+
+    def ingest(self, run_id: str, output_path: str) -> Dict[str, int]:
+        stats = {"files": 0, "bytes": 0, "deduplicated_bytes": 0}
+        digests = set()
+        for root, _, names in os.walk(output_path):
+            for name in names:
+                path = os.path.join(root, name)
+                if os.path.islink(path) or not os.path.isfile(path):
+                    continue
+                size = os.path.getsize(path)
+                digest = self._hash(path)
+                object_path = self._object_path(digest)
+                if os.path.exists(object_path):
+                    if not os.path.samefile(path, object_path):
+                        self._replace_with(object_path, path)
+                        stats["deduplicated_bytes"] += size
+                else:
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    try:
+                        self._store(path, object_path)
+                    except FileExistsError:
+                        # Stored by a concurrent ingest in the meantime
+                        self._replace_with(object_path, path)
+                        stats["deduplicated_bytes"] += size
+                self._add_ref(digest, run_id)
+                digests.add(digest)
+                stats["files"] += 1
+                stats["bytes"] += size
+
+        with open(self._manifest_path(run_id), "a") as f:
+            f.writelines(f"{digest}\n" for digest in digests)
+
+        metrics.inc("output_store_bytes", stats["bytes"])
+        metrics.inc("output_store_deduplicated_bytes", stats["deduplicated_bytes"])
+        log(f"Stored outputs of run {run_id}: {stats['files']} file(s), {stats['bytes']} bytes, "
+            f"{stats['deduplicated_bytes']} bytes deduplicated")
+        return stats
+
+    def prune(self) -> int:
+        """Release the runs stored more than retention_seconds ago. Returns bytes freed."""
+        freed = 0
+        cutoff = time.time() - self.retention_seconds
+        for entry in os.scandir(os.path.join(self.root, "runs")):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    freed += self.release(entry.name)
+            except FileNotFoundError:
+                continue  # Released by another replica in the meantime
+        if freed:
+            log(f"Output store pruned {freed} bytes")
+        return freed
+
+    def release(self, run_id: str) -> int:
+        """Drop run_id's references and delete objects nobody references. Returns bytes freed."""
+        freed = 0
+        manifest_path = self._manifest_path(run_id)
+        if not os.path.exists(manifest_path):
+            return freed
+        with open(manifest_path) as f:
+            digests = set(line.strip() for line in f if line.strip())
+
+        for digest in digests:
+            ref_dir = os.path.join(self.root, "refs", digest)
+            marker = os.path.join(ref_dir, run_id)
+            if not os.path.exists(marker):
+                continue
+            os.unlink(marker)
+            if not os.listdir(ref_dir):
+                object_path = self._object_path(digest)
+                if os.path.exists(object_path):
+                    freed += os.path.getsize(object_path)
+                    os.unlink(object_path)
+                shutil.rmtree(ref_dir, ignore_errors=True)
+        os.unlink(manifest_path)
+        metrics.inc("output_store_freed_bytes", freed)
+        return freed
+
+    # Helper methods
+    def _run(self) -> None:
+        while True:
+            try:
+                self.prune()
+            except Exception as e:
+                log(f"Error pruning output store: {e}", "ERROR")
+            time.sleep(self.prune_interval)
+
+    def _hash(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _manifest_path(self, run_id: str) -> str:
+        return os.path.join(self.root, "runs", run_id)
+
+    def _add_ref(self, digest: str, run_id: str) -> None:
+        ref_dir = os.path.join(self.root, "refs", digest)
+        os.makedirs(ref_dir, exist_ok=True)
+        open(os.path.join(ref_dir, run_id), "a").close()
+
+    def _store(self, path: str, object_path: str) -> None:
+        if self.reflink and self._clone(path, object_path):
+            return
+        try:
+            os.link(path, object_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copyfile(path, object_path)
+
+    def _replace_with(self, object_path: str, path: str) -> None:
+        tmp_path = f"{path}.secd-dedup"
+        if not (self.reflink and self._clone(object_path, tmp_path)):
+            os.link(object_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _clone(self, src: str, dst: str) -> bool:
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError:
+            if os.path.exists(dst):
+                os.unlink(dst)
+            return False
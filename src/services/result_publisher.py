@@ -0,0 +1,168 @@
+import abc
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+CHUNK_SIZE = 8 * 1024 * 1024
+POINTER_SUFFIX = ".artifact.json"
+
+class ArtifactStore(abc.ABC):
+    """Where large result files go instead of git. Keyed by sha256 digest."""
+    @abc.abstractmethod
+    def put(self, path: str, chunk_size: int = CHUNK_SIZE) -> Tuple[str, int, bool]:
+        """Stream path into the store. Return (digest, size, uploaded)."""
+
+    @abc.abstractmethod
+    def url(self, digest: str) -> str:
+        pass
+
+class FilesystemArtifactStore(ArtifactStore):
+    """Content-addressed store on a local or NFS mounted directory."""
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def put(self, path: str, chunk_size: int = CHUNK_SIZE) -> Tuple[str, int, bool]:
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    dst.write(chunk)
+                    size += len(chunk)
+            object_path = self._object_path(digest.hexdigest())
+            if os.path.exists(object_path):
+                os.unlink(tmp_path)
+                return digest.hexdigest(), size, False
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(tmp_path, object_path)
+            return digest.hexdigest(), size, True
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def url(self, digest: str) -> str:
+        return f"file://{self._object_path(digest)}"
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+class ResultPublisher():
+    """Decides how each output file reaches GitLab.
+
+    Files at or above threshold_bytes are sent through Git LFS
+    (method "lfs") or streamed to an ArtifactStore and replaced in the
+    commit by a small pointer file (method "store"). Everything else is
+    committed as a plain git blob. LFS objects are uploaded by push_lfs()
+    ahead of `git push`, so their time is not counted as git's. A large
+    file that could not be tracked or uploaded is left out of the commit.
+    """
+    def __init__(self, method: str = "git", threshold_bytes: Optional[int] = None, store: Optional[ArtifactStore] = None):
+        if method == "store" and store is None:
+            raise Exception("Result publishing method 'store' requires an artifact store")
+        self.method = method
+        self.threshold_bytes = threshold_bytes
+        self.store = store
+
+    def prepare(self, repo_path: str) -> Dict[str, Dict[str, float]]:
+        """Handle the large files under repo_path/outputs before `git add`.
+
+        For "lfs" the returned stats are recorded by push_lfs(), once the
+        upload is done.
+        """
+        stats = {}
+        if self.method == "git" or self.threshold_bytes is None:
+            return stats
+
+        large = self._large_files(os.path.join(repo_path, "outputs"))
+        if not large:
+            return stats
+
+        start = time.perf_counter()
+        if self.method == "lfs":
+            size = self._track_with_lfs(repo_path, large)
+            stats["lfs"] = {"files": len(large), "bytes": size, "seconds": time.perf_counter() - start}
+        else:
+            size = self._upload_to_store(repo_path, large)
+            stats["store"] = self._record("store", len(large), size, time.perf_counter() - start)
+        return stats
+
+    def push_lfs(self, repo_path: str, remote: str, branch: str, stats: Dict[str, float]) -> Dict[str, float]:
+        """Upload the LFS objects of branch and record tracking plus upload time."""
+        start = time.perf_counter()
+        subprocess.run(["git", "lfs", "push", remote, branch], check=True, cwd=repo_path,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return self._record("lfs", stats["files"], stats["bytes"], stats["seconds"] + time.perf_counter() - start)
+
+    def record_git(self, repo_path: str, seconds: float) -> Dict[str, float]:
+        size, files = 0, 0
+        for path in self._files(os.path.join(repo_path, "outputs")):
+            file_size = os.path.getsize(path)
+            if self.threshold_bytes is None or self.method == "git" or file_size < self.threshold_bytes:
+                size += file_size
+                files += 1
+        return self._record("git", files, size, seconds)
+
+    # Helper methods
+    def _files(self, directory: str):
+        for root, _, names in os.walk(directory):
+            for name in names:
+                if not name.endswith(POINTER_SUFFIX):
+                    yield os.path.join(root, name)
+
+    def _large_files(self, directory: str) -> List[str]:
+        return [p for p in self._files(directory) if os.path.getsize(p) >= self.threshold_bytes]
+
+    def _track_with_lfs(self, repo_path: str, paths: List[str]) -> int:
+        try:
+            subprocess.run(["git", "lfs", "install", "--local"], check=True, cwd=repo_path,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            relpaths = [os.path.relpath(p, repo_path) for p in paths]
+            subprocess.run(["git", "lfs", "track", "--filename", *relpaths], check=True, cwd=repo_path,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except Exception:
+            # Untracked, they would be committed as plain blobs
+            self._exclude(repo_path, paths)
+            raise
+        return sum(os.path.getsize(p) for p in paths)
+
+    def _upload_to_store(self, repo_path: str, paths: List[str]) -> int:
+        uploaded = 0
+        try:
+            for path in paths:
+                digest, size, new = self.store.put(path)
+                if new:
+                    uploaded += size
+                pointer = {"name": os.path.basename(path), "sha256": digest, "size": size, "url": self.store.url(digest)}
+                with open(f"{path}{POINTER_SUFFIX}", "w") as f:
+                    json.dump(pointer, f, indent=2)
+        finally:
+            # Also when an upload failed part way: a large file never goes in as a blob
+            self._exclude(repo_path, paths)
+        return uploaded
+
+    def _exclude(self, repo_path: str, paths: List[str]) -> None:
+        # Keep the originals out of the commit without touching the outputs
+        with open(os.path.join(repo_path, ".git", "info", "exclude"), "a") as f:
+            f.write("".join(f"/{os.path.relpath(path, repo_path)}\n" for path in paths))
+
+    def _record(self, method: str, files: int, size: int, seconds: float) -> Dict[str, float]:
+        metrics.inc(f"publish_bytes.{method}", size)
+        metrics.inc(f"publish_files.{method}", files)
+        metrics.observe(f"publish_seconds.{method}", seconds)
+        rate = size / seconds / 1e6 if seconds > 0 else 0.0
+        log(f"Published {files} file(s), {size} bytes via {method} in {seconds:.2f}s ({rate:.1f} MB/s)")
+        return {"files": files, "bytes": size, "seconds": seconds}
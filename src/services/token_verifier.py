@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+# Asymmetric only: a realm never signs access tokens with a shared secret
+ALGORITHMS = ["RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512"]
+DEFAULT_MAX_ENTRIES = 10000
+# Unknown key ids trigger a JWKS fetch at most this often
+JWKS_MIN_REFRESH = 30
+
+class InvalidTokenError(Exception):
+    pass
+
+class KeysUnavailableError(Exception):
+    """The signing key could not be looked up; says nothing about the token."""
+    pass
+
+def token_key(token: str) -> str:
+    # Caches hold digests, never bearer tokens
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenCache():
+    """Token digests mapped to a value until a per-entry expiry.
+
+    Holds at most max_entries keys; the least recently stored go first.
+    """
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def put(self, key: str, value: Any, expires_at: float) -> None:
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class JwksVerifier():
+    """Verifies JWT access tokens locally against a realm's JWKS.
+
+    The key set is fetched once and again only when a token names a key id
+    it does not contain (key rotation), no more than once per min_refresh.
+    """
+    def __init__(self, fetch_jwks: Callable[[], Dict[str, Any]], issuer: str, min_refresh: float = JWKS_MIN_REFRESH):
+        # jwcrypto comes with python-keycloak
+        from jwcrypto import jwk
+
+        self._jwk = jwk
+        self.fetch_jwks = fetch_jwks
+        self.issuer = issuer
+        self.min_refresh = min_refresh
+        self._keys = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def verify(self, token: str) -> Dict[str, Any]:
+        """Return the token's claims or raise InvalidTokenError.
+
+        Raises KeysUnavailableError when the key set cannot be fetched, or
+        names no such key and was refreshed less than min_refresh ago.
+        """
+        from jwcrypto import jwt
+
+        key = self._key(self._header(token).get('kid'))
+        try:
+            verified = jwt.JWT(jwt=token, key=key, algs=ALGORITHMS, check_claims={"exp": None, "iss": self.issuer})
+        except Exception as e:
+            raise InvalidTokenError(f"Token verification failed: {e}")
+        return json.loads(verified.claims)
+
+    def _header(self, token: str) -> Dict[str, Any]:
+        try:
+            header = token.split('.')[0]
+            return json.loads(base64.urlsafe_b64decode(header + '=' * (-len(header) % 4)))
+        except Exception:
+            raise InvalidTokenError("Malformed token")
+
+    def _key(self, kid: Optional[str]):
+        with self._lock:
+            key = self._keys.get_key(kid) if self._keys is not None and kid else None
+            if key is None:
+                if time.monotonic() - self._fetched_at < self.min_refresh:
+                    raise KeysUnavailableError(f"Signing key {kid} not in the key set fetched less than {self.min_refresh}s ago")
+                self._refresh()
+                key = self._keys.get_key(kid) if kid else None
+        if key is None:
+            raise InvalidTokenError(f"Unknown signing key {kid}")
+        return key
+
+    def _refresh(self) -> None:
+        try:
+            keys = self._jwk.JWKSet.from_json(json.dumps(self.fetch_jwks()))
+        except Exception as e:
+            raise KeysUnavailableError(f"Fetching JWKS for {self.issuer} failed: {e}")
+        # Only a successful fetch holds off the next one
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        metrics.inc("jwks_refreshes")
+        log(f"Fetched JWKS for {self.issuer}")
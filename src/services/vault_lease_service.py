@@ -0,0 +1,124 @@
+import datetime
+import threading
+from typing import TYPE_CHECKING, Dict, Optional
+
+from app.src.util.deadlines import DeadlineHeap
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+if TYPE_CHECKING:
+    from app.src.services.vault_service import VaultService
+
+DATABASE_MOUNT = "database"
+# Set on the namespace of a run that has Vault grants, so a restart knows to revoke them
+GRANTS_ANNOTATION = "secd/vault-grants"
+
+def database_role_name(database_name: str, run_id: str) -> str:
+    return f"role-{database_name}-{run_id}"
+
+def policy_name(database_name: str, run_id: str) -> str:
+    return f"policy-{database_name}-{run_id}"
+
+def auth_role_name(database_name: str, namespace: str) -> str:
+    return f"role-{database_name}-{namespace}"
+
+class RunGrants():
+    """The Vault objects created for one run."""
+    __slots__ = ("database_name", "database_role", "policy", "auth_role")
+
+    def __init__(self, database_name: str, run_id: str, namespace: str):
+        self.database_name = database_name
+        self.database_role = database_role_name(database_name, run_id)
+        self.policy = policy_name(database_name, run_id)
+        self.auth_role = auth_role_name(database_name, namespace)
+
+    @property
+    def lease_prefix(self) -> str:
+        return f"{DATABASE_MOUNT}/creds/{self.database_role}"
+
+class VaultLeaseService():
+    """Keeps each run's database credentials alive until its deadline and revokes them after.
+
+    Every run gets its own database role, so its leases share the prefix
+    database/creds/<role>. A background thread renews them every
+    renew_interval up to the run's rununtil, which lets runs outlive the
+    role's default TTL. release() revokes the prefix in one call and deletes
+    the database role, policy and Kubernetes auth role of the run.
+    """
+    def __init__(self, vault_service: "VaultService", deadlines: DeadlineHeap, renew_interval: float = 300):
+        self.vault_service = vault_service
+        self.deadlines = deadlines
+        self.renew_interval = renew_interval
+        self._runs: Dict[str, RunGrants] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._renew_loop, name="vault-lease-renew", daemon=True)
+            self._thread.start()
+
+    def track(self, run_id: str, database_name: str, namespace: str) -> RunGrants:
+        grants = RunGrants(database_name, run_id, namespace)
+        with self._lock:
+            self._runs[run_id] = grants
+            metrics.set_gauge("vault_runs_tracked", len(self._runs))
+        return grants
+
+    def forget(self, run_id: str) -> None:
+        """Stop renewing a run's leases without revoking them, e.g. when another replica takes it over."""
+        with self._lock:
+            self._runs.pop(run_id, None)
+            metrics.set_gauge("vault_runs_tracked", len(self._runs))
+
+    def release(self, run_id: str) -> None:
+        with self._lock:
+            grants = self._runs.pop(run_id, None)
+            metrics.set_gauge("vault_runs_tracked", len(self._runs))
+        if grants is None:
+            return
+
+        # Revoking drops the temporary MySQL users before their roles go away
+        steps = [
+            (self.vault_service.revoke_prefix, grants.lease_prefix),
+            (self.vault_service.delete_kubernetes_auth_role, grants.auth_role),
+            (self.vault_service.delete_policy, grants.policy),
+            (self.vault_service.delete_database_role, grants.database_role),
+        ]
+        for step, name in steps:
+            try:
+                step(name)
+            except Exception as e:
+                log(f"Failed to release Vault grants of run {run_id}: {e}", "ERROR")
+        metrics.inc("vault_runs_revoked")
+        log(f"Revoked Vault leases and roles of run {run_id}")
+
+    def renew(self, now: Optional[datetime.datetime] = None) -> None:
+        now = now or datetime.datetime.now()
+        with self._lock:
+            runs = list(self._runs.items())
+        for run_id, grants in runs:
+            deadline = self.deadlines.get(run_id)
+            if deadline is None:
+                continue
+            # Ask for the time left until rununtil; Vault caps it at the role's max_ttl
+            increment = int((deadline[1] - now).total_seconds())
+            if increment <= 0:
+                continue
+            try:
+                for lease_id in self.vault_service.list_leases(grants.lease_prefix):
+                    granted = self.vault_service.renew_lease(lease_id, increment)
+                    metrics.inc("vault_leases_renewed")
+                    if granted < increment:
+                        log(f"Lease {lease_id} of run {run_id} hit the role's max_ttl {granted}s before rununtil", "WARNING")
+            except Exception as e:
+                metrics.inc("vault_lease_renew_errors")
+                log(f"Failed to renew Vault leases of run {run_id}: {e}", "ERROR")
+
+    def _renew_loop(self) -> None:
+        while not self._stop.wait(self.renew_interval):
+            try:
+                self.renew()
+            except Exception as e:
+                log(f"Error in Vault lease renewal loop: {e}", "ERROR")
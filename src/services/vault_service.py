@@ -1,44 +1,127 @@
-import hvac
+import threading
+import time
+from typing import Dict, Set
 
-from app.src.util.setup import get_settings
+from app.src.util.setup import get_settings, add_reload_listener
 from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.resilience import resilient, timeout
+
+DEFAULT_POOL_SIZE = 16
+# Check a non-expiring token this often in case a reload swaps in one that expires
+TOKEN_CHECK_INTERVAL = 300
+# Renew once less than this share of the token's TTL is left
+TOKEN_RENEW_FRACTION = 1 / 3
 
 
 class VaultService():
     def __init__(self):
-        vault_addr = get_settings()['vault']['address']
-        vault_token = get_settings()['vault']['token']
-        self.client = hvac.Client(url=vault_addr, token=vault_token)
+        self._mounts: Dict[str, Set[str]] = {}
+        self._connections: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.client = self._create_client(get_settings()['vault'])
         if not self.client.is_authenticated():
             raise Exception("Failed to authenticate with Vault")
         self.enable_database_secrets_engine()
         self.enable_kubernetes_auth_method()
+        threading.Thread(target=self._renew_token_loop, name="vault-token-renew", daemon=True).start()
+        add_reload_listener(self._on_settings_reload)
+
+    def _create_client(self, vault_settings):
+        # Imported on first use to keep hvac out of intake startup
+        import hvac
+        import requests
+
+        # One keep-alive pool sized for the stage workers instead of requests' default of 10
+        pool_size = vault_settings.get('poolSize', DEFAULT_POOL_SIZE)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.hooks['response'].append(self._observe)
+        return hvac.Client(url=vault_settings['address'], token=vault_settings['token'], timeout=timeout('vault'), session=session)
+
+    def _observe(self, response, *args, **kwargs):
+        # e.g. /v1/database/roles/role-mysql-1-<run_id> -> vault_request_seconds.database.roles
+        path = response.request.path_url.split("?")[0].split("/")[2:4]
+        metrics.observe(f"vault_request_seconds.{'.'.join(path)}", response.elapsed.total_seconds())
+
+    def _on_settings_reload(self, old, new):
+        if old['vault'] != new['vault']:
+            vault_client = self._create_client(new['vault'])
+            if not vault_client.is_authenticated():
+                log("Reloaded Vault settings failed to authenticate, keeping current client", "ERROR")
+                return
+            self.client = vault_client
+            with self._lock:
+                self._mounts.clear()
+                self._connections.clear()
+            log("Vault client reloaded with new settings")
+
+    def _renew_token_loop(self):
+        while True:
+            try:
+                delay = self._renew_token()
+            except Exception as e:
+                log(f"Failed to renew Vault token: {e}", "ERROR")
+                delay = 30
+            time.sleep(delay)
+
+    def _renew_token(self) -> float:
+        """Renew the token if it is close to expiry; returns seconds until the next check."""
+        data = self.client.auth.token.lookup_self()['data']
+        ttl = data.get('ttl') or 0
+        if not data.get('renewable') or ttl <= 0:
+            return TOKEN_CHECK_INTERVAL
+        if ttl <= (data.get('creation_ttl') or ttl) * TOKEN_RENEW_FRACTION:
+            ttl = self.client.auth.token.renew_self()['auth']['lease_duration']
+            metrics.inc("vault_token_renewals")
+            log(f"Vault token renewed for {ttl}s")
+        return min(TOKEN_CHECK_INTERVAL, max(1, ttl * TOKEN_RENEW_FRACTION))
+
+    def _is_mounted(self, kind: str, path: str) -> bool:
+        # One sys/mounts (or sys/auth) read per client, updated as we enable paths
+        with self._lock:
+            if kind not in self._mounts:
+                if kind == "secrets":
+                    response = self.client.sys.list_mounted_secrets_engines()
+                else:
+                    response = self.client.sys.list_auth_methods()
+                self._mounts[kind] = set(response.get('data') or response)
+            return f"{path.strip('/')}/" in self._mounts[kind]
+
+    def _mark_mounted(self, kind: str, path: str) -> None:
+        with self._lock:
+            self._mounts.setdefault(kind, set()).add(f"{path.strip('/')}/")
 
     def enable_database_secrets_engine(self, path: str = "database") -> None:
+        if self._is_mounted("secrets", path):
+            log(f"Database secrets engine already enabled at {path}")
+            return
         try:
             self.client.sys.enable_secrets_engine(
                 backend_type="database",
                 path=path
             )
         except Exception as e:
-            if "path is already in use" in str(e):
-                print(f"Database secrets engine already enabled at {path}")
-            else:
-                raise Exception(f"Failed to enable database secrets engine: {str(e)}")
+            raise Exception(f"Failed to enable database secrets engine: {str(e)}")
+        self._mark_mounted("secrets", path)
 
     def enable_kubernetes_auth_method(self, path: str = "kubernetes") -> None:
+        if self._is_mounted("auth", path):
+            log(f"Kubernetes auth method already enabled at {path}")
+            return
         try:
             self.client.sys.enable_auth_method(
                 method_type="kubernetes",
                 path=path
             )
         except Exception as e:
-            if "path is already in use" in str(e):
-                print(f"Kubernetes auth method already enabled at {path}")
-            else:
-                raise Exception(f"Failed to enable Kubernetes auth method: {str(e)}")
+            raise Exception(f"Failed to enable Kubernetes auth method: {str(e)}")
+        self._mark_mounted("auth", path)
     
 
+    @resilient('vault', idempotent=True)
     def configure_database_connection(
         self,
         database_name: str,
@@ -49,6 +132,11 @@ class VaultService():
         allowed_roles: list,
         path: str = "database"
     ) -> None:
+        # Every run of a database writes the same connection; skip repeats
+        connection = (db_type, connection_url_template, admin_username, admin_password, tuple(allowed_roles), path)
+        with self._lock:
+            if self._connections.get(database_name) == connection:
+                return
         try:
             self.client.secrets.database.configure(
                 name=database_name,
@@ -61,7 +149,10 @@ class VaultService():
             )
         except Exception as e:
             raise Exception(f"Failed to configure database connection for {database_name}: {str(e)}")
+        with self._lock:
+            self._connections[database_name] = connection
 
+    @resilient('vault', idempotent=True)
     def create_database_role(
         self,
         role_name: str,
@@ -84,6 +175,7 @@ class VaultService():
             raise Exception(f"Failed to create database role {role_name}: {str(e)}")
 
     
+    @resilient('vault', idempotent=True)
     def create_kubernetes_auth_role(
         self,
         role_name: str,
@@ -103,6 +195,7 @@ class VaultService():
         except Exception as e:
             raise Exception(f"Failed to create Kubernetes auth role {role_name}: {str(e)}")
 
+    @resilient('vault', idempotent=True)
     def create_policy(self, policy_name: str, policy_rules: str) -> None:
         try:
             self.client.sys.create_or_update_policy(
@@ -112,8 +205,49 @@ class VaultService():
         except Exception as e:
             raise Exception(f"Failed to create policy {policy_name}: {str(e)}")
 
+    @resilient('vault', idempotent=True)
     def delete_kubernetes_auth_role(self, role_name: str) -> None:
         try:
             self.client.auth.kubernetes.delete_role(name=role_name)
         except Exception as e:
             raise Exception(f"Failed to delete Kubernetes auth role {role_name}: {str(e)}")
+
+    @resilient('vault', idempotent=True)
+    def delete_database_role(self, role_name: str, path: str = "database") -> None:
+        try:
+            self.client.secrets.database.delete_role(name=role_name, mount_point=path)
+        except Exception as e:
+            raise Exception(f"Failed to delete database role {role_name}: {str(e)}")
+
+    @resilient('vault', idempotent=True)
+    def delete_policy(self, policy_name: str) -> None:
+        try:
+            self.client.sys.delete_policy(name=policy_name)
+        except Exception as e:
+            raise Exception(f"Failed to delete policy {policy_name}: {str(e)}")
+
+    @resilient('vault', idempotent=True)
+    def list_leases(self, prefix: str) -> list:
+        try:
+            response = self.client.sys.list_leases(prefix=prefix)
+        except Exception as e:
+            # Vault answers 404 when no lease exists under the prefix
+            if type(e).__name__ == "InvalidPath":
+                return []
+            raise Exception(f"Failed to list leases under {prefix}: {str(e)}")
+        return [f"{prefix.rstrip('/')}/{key}" for key in response['data']['keys']]
+
+    @resilient('vault', idempotent=True)
+    def renew_lease(self, lease_id: str, increment: int) -> int:
+        try:
+            response = self.client.sys.renew_lease(lease_id=lease_id, increment=increment)
+        except Exception as e:
+            raise Exception(f"Failed to renew lease {lease_id}: {str(e)}")
+        return response.get('lease_duration', 0)
+
+    @resilient('vault', idempotent=True)
+    def revoke_prefix(self, prefix: str) -> None:
+        try:
+            self.client.sys.revoke_prefix(prefix=prefix)
+        except Exception as e:
+            raise Exception(f"Failed to revoke leases under {prefix}: {str(e)}")
@@ -0,0 +1,164 @@
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, Optional, Set
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+class WorkspaceService():
+    """Owns the clone workspaces under repoPath/<run_id>.
+
+    Released workspaces are deleted by a background thread at idle I/O
+    priority (ionice -c3) when available. A periodic sweep, started with
+    start_sweep(), deletes workspaces that no run claims and that have not
+    been touched for orphan_age_seconds. active_runs must include every run
+    whose namespace still exists, and raise when that cannot be known. With
+    several replicas sharing root, owns limits the sweep to the workspaces
+    of runs this replica owns. Above high_watermark (fraction of the disk in use)
+    intake is paused and orphans are reclaimed regardless of age until
+    usage drops below low_watermark.
+    """
+    def __init__(
+        self,
+        root: str,
+        active_runs: Callable[[], Set[str]],
+        high_watermark: Optional[float] = None,
+        low_watermark: Optional[float] = None,
+        sweep_interval: float = 600,
+        orphan_age_seconds: float = 6 * 3600,
+        owns: Optional[Callable[[str], bool]] = None,
+    ):
+        self.root = root
+        self.active_runs = active_runs
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark if low_watermark is not None else high_watermark
+        self.sweep_interval = sweep_interval
+        self.orphan_age_seconds = orphan_age_seconds
+        self.owns = owns
+        self.paused = False
+        self._tracked: Dict[str, str] = {}
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._ionice = shutil.which("ionice")
+        self._threads = []
+
+    def start(self) -> None:
+        self._start_thread(self._delete_loop, "workspace-reclaim")
+
+    def start_sweep(self) -> None:
+        self._start_thread(self._sweep_loop, "workspace-sweep")
+
+    def track(self, run_id: str) -> str:
+        path = os.path.join(self.root, run_id)
+        with self._lock:
+            self._tracked[run_id] = path
+            metrics.set_gauge("workspaces_tracked", len(self._tracked))
+        return path
+
+    def release(self, run_id: str) -> None:
+        """Queue a run's workspace for deletion."""
+        with self._lock:
+            path = self._tracked.pop(run_id, os.path.join(self.root, run_id))
+            metrics.set_gauge("workspaces_tracked", len(self._tracked))
+        self._enqueue(path)
+
+    def sweep(self) -> None:
+        if not os.path.isdir(self.root):
+            return
+        pressure = self._check_watermark()
+        keep = self.active_runs()
+        with self._lock:
+            keep |= set(self._tracked)
+        now = time.time()
+        for entry in os.scandir(self.root):
+            # Dot directories belong to other stores (e.g. .objects)
+            if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name in keep or (self.owns and not self.owns(entry.name)):
+                continue
+            if pressure or now - entry.stat(follow_symlinks=False).st_mtime > self.orphan_age_seconds:
+                log(f"Reclaiming orphaned workspace {entry.path}")
+                self._enqueue(entry.path)
+        # One statfs instead of walking every workspace; workspaces are only sized when deleted
+        metrics.set_gauge("workspace_disk_used_bytes", shutil.disk_usage(self.root).used)
+
+    # Helper methods
+    def _start_thread(self, target: Callable[[], None], name: str) -> None:
+        if name not in (thread.name for thread in self._threads):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _enqueue(self, path: str) -> None:
+        with self._lock:
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self._queue.put(path)
+
+    def _delete_loop(self) -> None:
+        while True:
+            path = self._queue.get()
+            try:
+                self._delete(path)
+            except Exception as e:
+                log(f"Failed to delete workspace {path}: {e}", "ERROR")
+            finally:
+                with self._lock:
+                    self._pending.discard(path)
+            if self.paused:
+                self._check_watermark()
+
+    def _delete(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        start = time.perf_counter()
+        size = self._size(path)
+        if self._ionice:
+            subprocess.run([self._ionice, "-c", "3", "rm", "-rf", "--", path], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+        seconds = time.perf_counter() - start
+        metrics.inc("workspace_reclaimed_bytes", size)
+        if seconds > 0:
+            metrics.observe("workspace_reclaim_bytes_per_second", size / seconds)
+        log(f"Workspace {path} deleted: {size} bytes in {seconds:.2f}s")
+
+    def _sweep_loop(self) -> None:
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                log(f"Error in workspace sweep: {e}", "ERROR")
+            # Sweep more often while intake is paused
+            time.sleep(min(self.sweep_interval, 30) if self.paused else self.sweep_interval)
+
+    def _check_watermark(self) -> bool:
+        if self.high_watermark is None or not os.path.isdir(self.root):
+            return False
+        usage = shutil.disk_usage(self.root)
+        used = usage.used / usage.total
+        if not self.paused and used >= self.high_watermark:
+            self.paused = True
+            log(f"Workspace disk {used:.0%} full, pausing intake", "WARNING")
+        elif self.paused and used < self.low_watermark:
+            self.paused = False
+            log(f"Workspace disk down to {used:.0%}, resuming intake")
+        metrics.set_gauge("intake_paused", 1 if self.paused else 0)
+        return self.paused
+
+    def _size(self, path: str) -> int:
+        total = 0
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
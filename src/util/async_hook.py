@@ -0,0 +1,61 @@
+import asyncio
+import falcon
+import gitlab
+from typing import TYPE_CHECKING, Optional
+
+from app.src.services.async_hook_service import AsyncHookService
+from app.src.services.workspace_service import WorkspaceService
+from app.src.util.debouncer import Debouncer
+from app.src.util.delivery_index import DeliveryIndex
+from app.src.util.hook import Hook
+from app.src.util.logger import log
+
+if TYPE_CHECKING:
+    from app.src.util.coordination import Coordinator
+
+class AsyncHook(Hook):
+    """ASGI variant of Hook, served by falcon.asgi.App."""
+    def __init__(
+        self,
+        async_hook_service: AsyncHookService,
+        delivery_index: DeliveryIndex,
+        debounce_window: float = 0,
+        workspaces: Optional[WorkspaceService] = None,
+        coordinator: Optional["Coordinator"] = None
+    ):
+        self.async_hook_service = async_hook_service
+        self.delivery_index = delivery_index
+        self.workspaces = workspaces
+        self.coordinator = coordinator
+        self.debouncer = Debouncer(debounce_window, self.dispatch) if debounce_window else None
+        self.loop = None
+
+    async def on_post(self, req, resp):
+        if self.intake_paused(resp):
+            return
+        try:
+            # Headers first, then a bounded read, then a ref check on the raw bytes
+            self.validate_event_token(req)
+            raw = self.check_body(req.content_length, await req.bounded_stream.read(self.max_body_bytes() + 1))
+            if self.ignore(raw, resp):
+                return
+            body = self.parse_body(raw)
+            self.loop = asyncio.get_running_loop()
+            # Forwarding waits for the owner's reply, so keep it off the event loop
+            if self.coordinator and await self.loop.run_in_executor(None, self.forward, req, raw, body, resp):
+                return
+            self.accept(body, resp)
+
+        except falcon.HTTPError:
+            raise
+        except gitlab.GitlabError as e:
+            self.reject(e, resp)
+        except Exception as e:
+            log(f"gitlab hook error: {str(e)}", "ERROR")
+            resp.status = falcon.HTTP_500
+            resp.media = {"error" : f"Internal server error: {str(e)}"}
+
+    def dispatch(self, body, run_id: str):
+        # Debounced pushes are dispatched from a timer thread
+        self.loop.call_soon_threadsafe(self.async_hook_service.submit, body, run_id)
+
@@ -0,0 +1,124 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+if TYPE_CHECKING:
+    from app.src.util.coordination import Coordinator
+
+DEFAULT_TIMEOUT = 30
+
+class Backend():
+    """One backend client, initialised in the background or on first use.
+
+    A backend that fails to initialise is retried the next time it is used,
+    so a backend that is down at startup no longer stops the server.
+    """
+    def __init__(self, name: str, factory: Callable[[], Any], timeout: float = DEFAULT_TIMEOUT):
+        self.name = name
+        self.factory = factory
+        self.timeout = timeout
+        self.state = "pending"
+        self.instance = None
+        self.error: Optional[str] = None
+        self.seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.state in ("initialising", "ready"):
+                return
+            self.state = "initialising"
+            self._ready.clear()
+        threading.Thread(target=self._init, name=f"init-{self.name}", daemon=True).start()
+
+    def get(self) -> Any:
+        if self.state != "ready":
+            self.start()
+            if not self._ready.wait(self.timeout):
+                raise Exception(f"Backend {self.name} not ready after {self.timeout}s")
+            if self.state != "ready":
+                raise Exception(f"Backend {self.name} unavailable: {self.error}")
+        return self.instance
+
+    def _init(self) -> None:
+        start = time.perf_counter()
+        try:
+            instance = self.factory()
+            self.instance = instance
+            self.error = None
+            self.state = "ready"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.seconds = time.perf_counter() - start
+            metrics.set_gauge(f"backend_init_seconds.{self.name}", self.seconds)
+            if self.state == "ready":
+                log(f"Backend {self.name} ready in {self.seconds:.2f}s")
+            else:
+                log(f"Backend {self.name} failed after {self.seconds:.2f}s: {self.error}", "ERROR")
+            self._ready.set()
+
+class LazyBackend():
+    """Stands in for a backend client and resolves it on first attribute access."""
+    def __init__(self, backend: Backend):
+        object.__setattr__(self, "_backend", backend)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._backend.get(), name)
+
+class BackendRegistry():
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.backends: Dict[str, Backend] = {}
+        self._lazy = set()
+
+    def register(self, name: str, factory: Callable[[], Any], lazy: bool = False) -> LazyBackend:
+        self.backends[name] = Backend(name, factory, self.timeout)
+        if lazy:
+            self._lazy.add(name)
+        return LazyBackend(self.backends[name])
+
+    def start(self) -> None:
+        """Initialise every eager backend concurrently."""
+        for name, backend in self.backends.items():
+            if name not in self._lazy:
+                backend.start()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Wait up to timeout for the eager backends, then log the startup breakdown."""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        for name, backend in self.backends.items():
+            if name not in self._lazy:
+                backend._ready.wait(max(0, deadline - time.monotonic()))
+        for name, status in self.status().items():
+            seconds = f"{status['seconds']:.2f}s" if status['seconds'] is not None else "-"
+            log(f"Startup: {name} {status['state']} ({seconds})")
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {"state": b.state, "seconds": b.seconds, "error": b.error, "lazy": name in self._lazy}
+            for name, b in self.backends.items()
+        }
+
+class Health:
+    def __init__(self, registry: BackendRegistry, coordinator: Optional["Coordinator"] = None):
+        self.registry = registry
+        self.coordinator = coordinator
+
+    def on_get(self, req, resp):
+        status = self.registry.status()
+        resp.media = {"intake": "ready", "backends": status}
+        clusters = self.registry.backends.get('kubernetes')
+        if clusters is not None and clusters.state == "ready":
+            resp.media["clusters"] = clusters.instance.status()
+        if self.coordinator is not None:
+            resp.media["coordination"] = self.coordinator.status()
+
+class AsyncHealth(Health):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
@@ -0,0 +1,381 @@
+import bisect
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from app.src.dto.run import new_run_id
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+LEADER_LEASE = "secd-leader"
+MEMBER_PREFIX = "secd-member-"
+# Set on forwarded requests so the receiving replica handles them itself
+FORWARDED_HEADER = "X-Secd-Forwarded"
+ANNOTATION_PREFIX = "secd/"
+DEFAULT_VNODES = 64
+
+def member_lease(identity: str) -> str:
+    return f"{MEMBER_PREFIX}{identity}"
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing():
+    """Consistent hash ring over replica identities.
+
+    Each member gets vnodes points on the ring; a key belongs to the member
+    with the first point at or after the key's hash. Adding or removing a
+    member only moves the keys on that member's arcs.
+    """
+    def __init__(self, members: List[str], vnodes: int = DEFAULT_VNODES):
+        self.members = sorted(set(members))
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect_left(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+class FileLeaseStore():
+    """Leases as JSON files in one directory, for replicas on a single host.
+
+    An flock on the directory's lock file serialises every read-modify-write,
+    which gives the same compare-and-swap behaviour as a Lease object.
+    """
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock_path = os.path.join(path, ".lock")
+
+    def try_acquire(self, name: str, holder: str, duration: float, data: Optional[Dict[str, str]] = None) -> bool:
+        """Take or renew the lease; False while another holder's lease is live."""
+        now = time.time()
+        with self._locked():
+            lease = self._read(name)
+            if lease and lease['holder'] != holder and not self._expired(lease, now):
+                return False
+            self._write(name, {"holder": holder, "renewTime": now, "duration": duration, "data": data or {}})
+            return True
+
+    def release(self, name: str, holder: str) -> None:
+        with self._locked():
+            lease = self._read(name)
+            if lease and lease['holder'] == holder:
+                os.remove(self._file(name))
+
+    def holders(self, prefix: str) -> Dict[str, Dict[str, str]]:
+        """Holder and data of every live lease whose name starts with prefix."""
+        now = time.time()
+        with self._locked():
+            leases = [self._read(name) for name in self._names(prefix)]
+        return {lease['holder']: lease['data'] for lease in leases if lease and not self._expired(lease, now)}
+
+    def prune(self, prefix: str) -> None:
+        now = time.time()
+        with self._locked():
+            for name in self._names(prefix):
+                lease = self._read(name)
+                if lease and self._expired(lease, now):
+                    os.remove(self._file(name))
+
+    # Helper methods
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _expired(self, lease: Dict[str, Any], now: float) -> bool:
+        return lease['renewTime'] + lease['duration'] <= now
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.json")
+
+    def _names(self, prefix: str) -> List[str]:
+        return [entry[:-5] for entry in os.listdir(self.path) if entry.startswith(prefix) and entry.endswith(".json")]
+
+    def _read(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._file(name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, name: str, lease: Dict[str, Any]) -> None:
+        tmp = f"{self._file(name)}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(lease, f)
+        os.replace(tmp, self._file(name))
+
+class KubernetesLeaseStore():
+    """Leases as coordination.k8s.io/v1 Lease objects in one namespace.
+
+    Updates carry the resourceVersion that was read, so two replicas racing
+    for the same lease get one success and one conflict.
+    """
+    def __init__(self, config, namespace: str):
+        from kubernetes import client
+        from app.src.services.kubernetes_services.labels import MANAGED_SELECTOR, managed_labels
+
+        self.client = client
+        self.api = client.CoordinationV1Api(api_client=client.ApiClient(configuration=config))
+        self.namespace = namespace
+        self.selector = MANAGED_SELECTOR
+        self.labels = managed_labels()
+
+    def try_acquire(self, name: str, holder: str, duration: float, data: Optional[Dict[str, str]] = None) -> bool:
+        """Take or renew the lease; False while another holder's lease is live or on a lost race."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        annotations = {f"{ANNOTATION_PREFIX}{key}": value for key, value in (data or {}).items()}
+        try:
+            lease = self.api.read_namespaced_lease(name, self.namespace)
+        except self.client.ApiException as e:
+            if e.status != 404:
+                raise
+            lease = self.client.V1Lease(
+                metadata=self.client.V1ObjectMeta(name=name, labels=self.labels, annotations=annotations),
+                spec=self.client.V1LeaseSpec(holder_identity=holder, lease_duration_seconds=int(duration), acquire_time=now, renew_time=now, lease_transitions=0)
+            )
+            return self._write(lambda: self.api.create_namespaced_lease(self.namespace, lease))
+
+        spec = lease.spec
+        if spec.holder_identity != holder:
+            if not self._expired(spec, now):
+                return False
+            spec.acquire_time = now
+            spec.lease_transitions = (spec.lease_transitions or 0) + 1
+        spec.holder_identity = holder
+        spec.lease_duration_seconds = int(duration)
+        spec.renew_time = now
+        lease.metadata.annotations = {**(lease.metadata.annotations or {}), **annotations}
+        return self._write(lambda: self.api.replace_namespaced_lease(name, self.namespace, lease))
+
+    def release(self, name: str, holder: str) -> None:
+        try:
+            lease = self.api.read_namespaced_lease(name, self.namespace)
+        except self.client.ApiException as e:
+            if e.status == 404:
+                return
+            raise
+        if lease.spec.holder_identity == holder:
+            self._delete(lease)
+
+    def holders(self, prefix: str) -> Dict[str, Dict[str, str]]:
+        """Holder and data of every live lease whose name starts with prefix."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {
+            lease.spec.holder_identity: self._data(lease)
+            for lease in self._leases(prefix)
+            if lease.spec.holder_identity and not self._expired(lease.spec, now)
+        }
+
+    def prune(self, prefix: str) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for lease in self._leases(prefix):
+            if self._expired(lease.spec, now):
+                self._delete(lease)
+
+    # Helper methods
+    def _leases(self, prefix: str) -> List[Any]:
+        leases = self.api.list_namespaced_lease(self.namespace, label_selector=self.selector).items
+        return [lease for lease in leases if lease.metadata.name.startswith(prefix)]
+
+    def _data(self, lease) -> Dict[str, str]:
+        annotations = lease.metadata.annotations or {}
+        return {key[len(ANNOTATION_PREFIX):]: value for key, value in annotations.items() if key.startswith(ANNOTATION_PREFIX)}
+
+    def _expired(self, spec, now: datetime.datetime) -> bool:
+        renewed = spec.renew_time or spec.acquire_time
+        if renewed is None:
+            return True
+        return renewed + datetime.timedelta(seconds=spec.lease_duration_seconds or 0) <= now
+
+    def _write(self, write: Callable[[], Any]) -> bool:
+        try:
+            write()
+            return True
+        except self.client.ApiException as e:
+            # Another replica wrote the lease since it was read
+            if e.status == 409:
+                return False
+            raise
+
+    def _delete(self, lease) -> None:
+        # Only the version that was read, so a renewal in between survives
+        preconditions = self.client.V1Preconditions(resource_version=lease.metadata.resource_version)
+        try:
+            self.api.delete_namespaced_lease(lease.metadata.name, self.namespace, body=self.client.V1DeleteOptions(preconditions=preconditions))
+        except self.client.ApiException as e:
+            if e.status not in (404, 409):
+                raise
+
+class Coordinator():
+    """Leader election and run ownership across secd replicas.
+
+    Every renew_interval a replica renews its member lease and tries to take
+    or keep the leader lease. The leader runs the cleanup controller. Run
+    ids and project ids map onto the live members through a HashRing, so
+    when a replica stops renewing, its runs pass to the survivors once its
+    lease lapses. A replica only counts itself leader for lease_duration
+    after its last successful renewal.
+    """
+    def __init__(
+        self,
+        store: Any,
+        identity: str,
+        address: str,
+        lease_duration: float = 15,
+        renew_interval: float = 5,
+        vnodes: int = DEFAULT_VNODES,
+        timeout: float = 10
+    ):
+        if renew_interval * 2 > lease_duration:
+            raise Exception(f"Coordination renewInterval {renew_interval}s must be at most half of leaseDuration {lease_duration}s")
+        self.store = store
+        self.identity = identity
+        self.address = address
+        self.lease_duration = lease_duration
+        self.renew_interval = renew_interval
+        self.vnodes = vnodes
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._leader = False
+        self._renewed = 0.0
+        self._members: Dict[str, Dict[str, str]] = {identity: {"address": address}}
+        self._ring = HashRing([identity], vnodes)
+        self._listeners: List[Callable[[bool, bool], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            # Ownership is known before runs are restored
+            self.heartbeat()
+            self._thread = threading.Thread(target=self._heartbeat_loop, name="coordination", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        # The others take over now instead of after the leases lapse
+        for name in (LEADER_LEASE, member_lease(self.identity)):
+            try:
+                self.store.release(name, self.identity)
+            except Exception as e:
+                log(f"Failed to release lease {name}: {e}", "ERROR")
+
+    def add_listener(self, listener: Callable[[bool, bool], None]) -> None:
+        """Call listener(leader, members_changed) after a heartbeat that changed either."""
+        self._listeners.append(listener)
+
+    @property
+    def is_leader(self) -> bool:
+        with self._lock:
+            return self._leader and time.monotonic() - self._renewed < self.lease_duration
+
+    def members(self) -> List[str]:
+        with self._lock:
+            return list(self._ring.members)
+
+    def owner(self, key: str) -> str:
+        with self._lock:
+            return self._ring.owner(key) or self.identity
+
+    def owns(self, key: str) -> bool:
+        return self.owner(key) == self.identity
+
+    def route(self, key: Optional[str]) -> Optional[str]:
+        """Address of the replica that owns key, or None when this replica handles it."""
+        if key is None:
+            return None
+        with self._lock:
+            owner = self._ring.owner(key)
+            if owner is None or owner == self.identity:
+                return None
+            return self._members.get(owner, {}).get("address")
+
+    def new_run_id(self) -> str:
+        # A run minted here hashes to this replica, so its intake replica stays its owner
+        with self._lock:
+            ring = self._ring
+        if self.identity not in ring.members:
+            return new_run_id()
+        while True:
+            run_id = new_run_id()
+            if ring.owner(run_id) == self.identity:
+                return run_id
+
+    def forward(self, address: str, method: str, path: str, body: Optional[bytes], headers: Dict[str, str]) -> requests.Response:
+        metrics.inc("requests_forwarded")
+        return self.session.request(
+            method,
+            f"{address.rstrip('/')}{path}",
+            data=body,
+            headers={**headers, FORWARDED_HEADER: self.identity},
+            timeout=self.timeout
+        )
+
+    def status(self) -> Dict[str, Any]:
+        return {"identity": self.identity, "leader": self.is_leader, "members": self.members()}
+
+    def heartbeat(self) -> None:
+        members = None
+        try:
+            self.store.try_acquire(member_lease(self.identity), self.identity, self.lease_duration, {"address": self.address})
+            leader = self.store.try_acquire(LEADER_LEASE, self.identity, self.lease_duration)
+            members = self.store.holders(MEMBER_PREFIX)
+            if leader:
+                self.store.prune(MEMBER_PREFIX)
+        except Exception as e:
+            log(f"Failed to renew coordination leases: {e}", "ERROR")
+            leader = False
+
+        with self._lock:
+            was_leader = self._leader
+            self._leader = leader
+            if leader:
+                self._renewed = time.monotonic()
+            members_changed = members is not None and set(members) != set(self._members)
+            if members_changed:
+                self._members = members
+                self._ring = HashRing(list(members), self.vnodes)
+            member_count = len(self._members)
+        metrics.set_gauge("coordination_leader", int(leader))
+        metrics.set_gauge("coordination_members", member_count)
+
+        if leader != was_leader:
+            log(f"Replica {self.identity} {'is now' if leader else 'is no longer'} the leader")
+        if members_changed:
+            log(f"Replica {self.identity} sees {member_count} members: {', '.join(sorted(members))}")
+        if leader != was_leader or members_changed:
+            for listener in self._listeners:
+                try:
+                    listener(leader, members_changed)
+                except Exception as e:
+                    log(f"Coordination listener failed: {e}", "ERROR")
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.renew_interval):
+            self.heartbeat()
+
+def relay(response: requests.Response, resp) -> None:
+    """Copy the owner's reply to a forwarded request onto the falcon response."""
+    import falcon
+
+    resp.status = falcon.code_to_http_status(response.status_code)
+    resp.content_type = response.headers.get('Content-Type', falcon.MEDIA_JSON)
+    resp.data = response.content
@@ -1,26 +1,118 @@
 import time
-import urllib3
-from app.src.services.gitlab_service import GitlabService
-from app.src.services.kubernetes_service import KubernetesService
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional
+from app.src.util.deadlines import DeadlineHeap
 from app.src.util.logger import log
+from app.src.util.scheduler import RunScheduler
+from app.src.util.setup import get_settings
+
+if TYPE_CHECKING:
+    from app.src.services.gitlab_service import GitlabService
+    from app.src.services.cluster_registry import ClusterRegistry
+    from app.src.services.output_store import OutputStore
+    from app.src.services.image_gc_service import ImageGcService
+    from app.src.services.workspace_service import WorkspaceService
+    from app.src.services.vault_lease_service import VaultLeaseService
+    from app.src.util.coordination import Coordinator
 
 class Daemon:
     def __init__(
             self,
-            kubernetes_service : KubernetesService,
-            gitlab_service : GitlabService
+            clusters : "ClusterRegistry",
+            gitlab_service : "GitlabService",
+            scheduler : RunScheduler,
+            output_store : Optional["OutputStore"] = None,
+            deadlines : Optional[DeadlineHeap] = None,
+            scan_interval : float = 300,
+            image_gc : Optional["ImageGcService"] = None,
+            workspaces : Optional["WorkspaceService"] = None,
+            vault_leases : Optional["VaultLeaseService"] = None,
+            coordinator : Optional["Coordinator"] = None
         ):
-        self.kubernetes_service = kubernetes_service
+        self.clusters = clusters
         self.gitlab_service = gitlab_service
+        self.scheduler = scheduler
+        self.output_store = output_store
+        self.deadlines = deadlines if deadlines is not None else DeadlineHeap()
+        self.scan_interval = scan_interval
+        self.image_gc = image_gc
+        self.workspaces = workspaces
+        self.vault_leases = vault_leases
+        self.coordinator = coordinator
+        # Hashing multi-GB outputs must not hold up the cleanup loop
+        self.ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output-store")
 
     def start_microk8s_cleanup(self):
+        # Expired runs are cleaned up as soon as their deadline passes. The
+        # full scan only has to catch completed pods, so it runs every few minutes.
+        next_scan = 0.0
+        leading = False
         while True:
             try:
-                cleaned_run_ids = self.kubernetes_service.cleanup_resources()
+                if self.leads() and not leading:
+                    # Catch up on runs that expired while another replica led
+                    next_scan = 0.0
+                leading = self.leads()
+                full_scan = time.monotonic() >= next_scan
+                if full_scan:
+                    next_scan = time.monotonic() + self.scan_interval
+                if leading:
+                    cleaned_run_ids = self.cleanup(full_scan)
+                elif full_scan:
+                    cleaned_run_ids = self.clusters.gone_runs(self.deadlines.run_ids())
+                else:
+                    cleaned_run_ids = []
                 for run_id in cleaned_run_ids:
-                    self.gitlab_service.push_results(run_id)
-                    log(f"Finishing run {run_id} - expired rununtil - Pushing results")
+                    self.finish_run(run_id)
+
+                if leading:
+                    self.deadlines.wait(max(0.0, next_scan - time.monotonic()))
+                else:
+                    # A follower's due runs stay on its heap until the leader removes their namespace
+                    time.sleep(max(0.0, min(next_scan - time.monotonic(), self.coordinator.renew_interval)))
             except Exception as e:
                 log(f"Error in Daemon run loop: {e}", "ERROR")
+                time.sleep(1)
+
+    def leads(self) -> bool:
+        return self.coordinator is None or self.coordinator.is_leader
+
+    def cleanup(self, full_scan: bool) -> List[str]:
+        """Clean up expired runs on every cluster; return the ones this replica finishes."""
+        tracked = self.deadlines.run_ids()
+        if full_scan:
+            cleaned_run_ids = self.clusters.cleanup_resources()
+        else:
+            cleaned_run_ids = self.clusters.expire_runs()
+        if self.coordinator is None:
+            return cleaned_run_ids
+        # Other replicas finish their own runs once they see the namespace gone
+        finished = [run_id for run_id in cleaned_run_ids if run_id in tracked or self.coordinator.owns(run_id)]
+        if full_scan:
+            finished += self.clusters.gone_runs(self.deadlines.run_ids() - set(cleaned_run_ids))
+        return finished
+
+    def finish_run(self, run_id: str):
+        self.deadlines.remove(run_id)
+        self.scheduler.release(run_id)
+        self.clusters.release(run_id)
+        self.clusters.cache_service.close(run_id)
+        self.gitlab_service.push_results(run_id)
+        log(f"Finishing run {run_id} - expired rununtil - Pushing results")
+        if self.output_store:
+            # The workspace goes once its outputs are in the store
+            self.ingest_executor.submit(self.store_outputs, run_id)
+        elif self.workspaces:
+            self.workspaces.release(run_id)
+        if self.image_gc:
+            self.image_gc.finish(run_id)
+        if self.vault_leases:
+            self.vault_leases.release(run_id)
 
-            time.sleep(10)
+    def store_outputs(self, run_id: str):
+        try:
+            self.output_store.ingest(run_id, f"{get_settings()['path']['repoPath']}/{run_id}/outputs")
+        except Exception as e:
+            log(f"Failed to store outputs of run {run_id}: {e}", "ERROR")
+        if self.workspaces:
+            self.workspaces.release(run_id)
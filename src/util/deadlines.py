@@ -0,0 +1,89 @@
+import datetime
+import heapq
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.src.util.metrics import metrics
+
+class DeadlineHeap():
+    """Run deadlines (rununtil) ordered in a min-heap.
+
+    Updating or removing a run leaves its old heap entry in place; stale
+    entries are skipped when they reach the top. wait() sleeps until the
+    earliest deadline and is woken early when an earlier one is added.
+    Deadlines are naive local times; aware ones are converted on set().
+    """
+    def __init__(self):
+        self._heap: List[Tuple[datetime.datetime, int, str]] = []
+        self._runs: Dict[str, Tuple[datetime.datetime, int, str]] = {}
+        self._namespaces: Dict[str, str] = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def set(self, run_id: str, namespace: str, deadline: datetime.datetime) -> None:
+        if deadline.tzinfo is not None:
+            deadline = deadline.astimezone().replace(tzinfo=None)
+        with self._cond:
+            self._seq += 1
+            entry = (deadline, self._seq, run_id)
+            self._runs[run_id] = entry
+            self._namespaces[run_id] = namespace
+            heapq.heappush(self._heap, entry)
+            metrics.set_gauge("run_deadlines", len(self._runs))
+            if self._peek() is entry:
+                self._cond.notify_all()
+
+    def remove(self, run_id: str) -> None:
+        with self._cond:
+            self._runs.pop(run_id, None)
+            self._namespaces.pop(run_id, None)
+            metrics.set_gauge("run_deadlines", len(self._runs))
+
+    def get(self, run_id: str) -> Optional[Tuple[str, datetime.datetime]]:
+        with self._cond:
+            entry = self._runs.get(run_id)
+            return (self._namespaces[run_id], entry[0]) if entry else None
+
+    def pop_due(self, now: Optional[datetime.datetime] = None) -> List[Tuple[str, str]]:
+        """Remove and return (run_id, namespace) of every run past its deadline."""
+        now = now or datetime.datetime.now()
+        due = []
+        with self._cond:
+            while True:
+                entry = self._peek()
+                if entry is None or entry[0] > now:
+                    break
+                heapq.heappop(self._heap)
+                run_id = entry[2]
+                due.append((run_id, self._namespaces.pop(run_id)))
+                del self._runs[run_id]
+            metrics.set_gauge("run_deadlines", len(self._runs))
+        return due
+
+    def run_ids(self) -> Set[str]:
+        with self._cond:
+            return set(self._runs)
+
+    def next_deadline(self) -> Optional[datetime.datetime]:
+        with self._cond:
+            entry = self._peek()
+            return entry[0] if entry else None
+
+    def wait(self, timeout: float) -> None:
+        """Sleep until the next deadline, timeout seconds or an earlier deadline, whichever comes first."""
+        with self._cond:
+            entry = self._peek()
+            if entry is not None:
+                timeout = min(timeout, max(0.0, (entry[0] - datetime.datetime.now()).total_seconds()))
+            if timeout > 0:
+                self._cond.wait(timeout)
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    # Helper methods
+    def _peek(self) -> Optional[Tuple[datetime.datetime, int, str]]:
+        # Drop entries replaced by set() or remove()
+        while self._heap and self._runs.get(self._heap[0][2]) is not self._heap[0]:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
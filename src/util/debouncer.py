@@ -0,0 +1,59 @@
+import threading
+from typing import Any, Callable, Dict
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+class _Pending():
+    def __init__(self, run_id: str, body: Dict[str, Any]):
+        self.run_id = run_id
+        self.body = body
+        self.coalesced = 0
+        self.timer = None
+
+class Debouncer():
+    """Coalesces pushes to the same project that arrive within one window.
+
+    The window opens with the first push and is not extended by later ones.
+    When it closes, one run is dispatched with the newest push body, under
+    the run id handed out for the first push.
+    """
+    def __init__(self, window: float, dispatch: Callable[[Dict[str, Any], str], None]):
+        self.window = window
+        self.dispatch = dispatch
+        self._pending: Dict[Any, _Pending] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, body: Dict[str, Any], run_id: str) -> str:
+        project_id = body.get('project_id')
+        with self._lock:
+            pending = self._pending.get(project_id)
+            if pending is not None:
+                pending.body = body
+                pending.coalesced += 1
+                metrics.inc("runs_coalesced")
+                log(f"Push to project {project_id} coalesced into run {pending.run_id}")
+                return pending.run_id
+
+            pending = _Pending(run_id, body)
+            pending.timer = threading.Timer(self.window, self._fire, args=(project_id,))
+            pending.timer.daemon = True
+            self._pending[project_id] = pending
+            pending.timer.start()
+            return run_id
+
+    def coalesced(self, run_id: str) -> int:
+        with self._lock:
+            for pending in self._pending.values():
+                if pending.run_id == run_id:
+                    return pending.coalesced
+        return 0
+
+    def _fire(self, project_id: Any) -> None:
+        with self._lock:
+            pending = self._pending.pop(project_id, None)
+        if pending is None:
+            return
+        if pending.coalesced:
+            log(f"Starting run {pending.run_id} for project {project_id}, {pending.coalesced} push(es) coalesced")
+        self.dispatch(pending.body, pending.run_id)
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+DEFAULT_TTL = 3600
+DEFAULT_MAX_ENTRIES = 10000
+
+def delivery_key(body: Optional[Dict[str, Any]]) -> Optional[Tuple[Any, str, str]]:
+    if not isinstance(body, dict):
+        return None
+    project_id = body.get('project_id')
+    checkout_sha = body.get('checkout_sha')
+    ref = body.get('ref')
+    if project_id is None or not checkout_sha or not ref:
+        return None
+    return (project_id, checkout_sha, ref)
+
+class DeliveryIndex():
+    """Time-bounded index of webhook deliveries already accepted.
+
+    Entries share one TTL, so insertion order is also expiry order and the
+    oldest entries are dropped from the front. The index never holds more
+    than max_entries keys.
+    """
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key: Any, start: Callable[[], str]) -> Tuple[str, bool]:
+        """Return (run_id, created).
+
+        start is only called for the first delivery of a key, under the index
+        lock, and returns the run id it started. A duplicate gets that id back.
+        """
+        if key is None:
+            return start(), True
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0], False
+            run_id = start()
+            self._entries[key] = (run_id, now + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return run_id, True
+
+    def forget(self, key: Any) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            _, (_, expires) = next(iter(self._entries.items()))
+            if expires > now:
+                return
+            self._entries.popitem(last=False)
@@ -1,39 +1,147 @@
 import falcon
-import json
 import threading
 import gitlab
+import requests
+from typing import TYPE_CHECKING, Any, Optional
 
+from app.src.dto.run import new_run_id
 from app.src.services.hook_service import HookService
+from app.src.services.workspace_service import WorkspaceService
+from app.src.util.debouncer import Debouncer
+from app.src.util.delivery_index import DeliveryIndex, delivery_key
 from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.push_filter import loads, reject_reason
 from app.src.util.setup import get_settings
+from app.src.util.coordination import FORWARDED_HEADER, relay
+
+if TYPE_CHECKING:
+    from app.src.util.coordination import Coordinator
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
 
 class Hook:
-    def __init__(self, hook_service: HookService):
+    def __init__(
+        self,
+        hook_service: HookService,
+        delivery_index: DeliveryIndex,
+        debounce_window: float = 0,
+        workspaces: Optional[WorkspaceService] = None,
+        coordinator: Optional["Coordinator"] = None
+    ):
         self.hook_service = hook_service
+        self.delivery_index = delivery_index
+        self.workspaces = workspaces
+        self.coordinator = coordinator
+        self.debouncer = Debouncer(debounce_window, self.dispatch) if debounce_window else None
 
     def on_post(self, req, resp):
+        if self.intake_paused(resp):
+            return
         try:
+            # Headers first, then a bounded read, then a ref check on the raw bytes
             self.validate_event_token(req)
-            body = self.parse_request_body(req)
-            threading.Thread(target=self.hook_service.create(body)).start()
-            resp.status = falcon.HTTP_200
-            resp.media = {"status":"success"}
-            
+            raw = self.check_body(req.content_length, req.bounded_stream.read(self.max_body_bytes() + 1))
+            if self.ignore(raw, resp):
+                return
+            body = self.parse_body(raw)
+            if self.forward(req, raw, body, resp):
+                return
+            self.accept(body, resp)
+
+        except falcon.HTTPError:
+            raise
+        except gitlab.GitlabError as e:
+            self.reject(e, resp)
         except Exception as e:
             log(f"gitlab hook error: {str(e)}", "ERROR")
             resp.status = falcon.HTTP_500
             resp.media = {"error" : f"Internal server error: {str(e)}"}
 
-    def parse_request_body(self, req):
+    def accept(self, body: Any, resp):
+        run_id, created = self.delivery_index.claim(delivery_key(body), lambda: self.intake(body))
+        if not created:
+            log(f"Duplicate delivery for run {run_id}, skipping")
+        resp.status = falcon.HTTP_200
+        resp.media = {
+            "status": "success",
+            "run_id": run_id,
+            "duplicate": not created,
+            "coalesced": self.debouncer.coalesced(run_id) if self.debouncer else 0,
+        }
+
+    def reject(self, e: gitlab.GitlabError, resp):
+        resp.status = falcon.code_to_http_status(e.response_code or 500)
+        resp.media = {"error": e.error_message}
+
+    def ignore(self, raw: bytes, resp) -> bool:
+        reason = reject_reason(raw)
+        if reason is None:
+            return False
+        log(reason, "INFO")
+        metrics.inc("hooks_ignored")
+        resp.status = falcon.HTTP_200
+        resp.media = {"status": "ignored", "reason": reason}
+        return True
+
+    def forward(self, req, raw: bytes, body: Any, resp) -> bool:
+        # One replica takes every push of a project, so duplicates meet one delivery
+        # index and the debouncer and superseded-run cancellation see every push
+        if self.coordinator is None or req.get_header(FORWARDED_HEADER):
+            return False
+        project_id = body.get('project_id') if isinstance(body, dict) else None
+        address = self.coordinator.route(f"project-{project_id}" if project_id is not None else None)
+        if address is None:
+            return False
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Gitlab-Event': req.get_header('X-Gitlab-Event'),
+            'X-Gitlab-Token': req.get_header('X-Gitlab-Token'),
+        }
         try:
-            body_raw = req.bounded_stream.read()
-            if not body_raw:
-                log("Missing body in request", "ERROR")
-                raise falcon.HTTPBadRequest(title='Bad request', description='Missing body')
-            body = json.loads(body_raw)
-            return body
-        except Exception as e:
+            relay(self.coordinator.forward(address, 'POST', req.path, raw, headers), resp)
+            return True
+        except requests.RequestException as e:
+            log(f"Failed to forward push to {address}, handling it here: {e}", "WARNING")
+            return False
+
+    def intake_paused(self, resp) -> bool:
+        if self.workspaces is None or not self.workspaces.paused:
+            return False
+        resp.status = falcon.HTTP_503
+        resp.set_header('Retry-After', '300')
+        resp.media = {"error": "Intake paused: workspace disk above high watermark"}
+        return True
+
+    def intake(self, body) -> str:
+        run_id = self.coordinator.new_run_id() if self.coordinator else new_run_id()
+        if self.debouncer:
+            return self.debouncer.submit(body, run_id)
+        self.dispatch(body, run_id)
+        return run_id
+
+    def dispatch(self, body, run_id: str):
+        threading.Thread(target=self.hook_service.create, args=(body, run_id)).start()
+
+    def max_body_bytes(self) -> int:
+        return get_settings().get('server', {}).get('maxBodyBytes', MAX_BODY_BYTES)
+
+    def check_body(self, content_length: Optional[int], body_raw: bytes) -> bytes:
+        limit = self.max_body_bytes()
+        if (content_length or 0) > limit or len(body_raw) > limit:
+            log(f"Body larger than {limit} bytes", "ERROR")
+            raise falcon.HTTPPayloadTooLarge(title='Payload too large', description=f'Body exceeds {limit} bytes')
+        if not body_raw:
+            log("Missing body in request", "ERROR")
+            raise falcon.HTTPBadRequest(title='Bad request', description='Missing body')
+        return body_raw
+
+    def parse_body(self, body_raw: bytes) -> Any:
+        try:
+            return loads(body_raw)
+        except ValueError as e:
             log(f"Invalid body: {str(e)}", "ERROR")
+            raise falcon.HTTPBadRequest(title='Bad request', description='Invalid body')
 
     def validate_event_token(self, req):
         event = req.get_header('X-Gitlab-Event')
@@ -0,0 +1,57 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict
+
+class Metrics():
+    """In-process counters, gauges and timings, served as JSON on /v1/metrics."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            timings = {
+                name: {**t, "avg": t["total"] / t["count"] if t["count"] else 0.0}
+                for name, t in self._timings.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": timings,
+            }
+
+metrics = Metrics()
+
+class MetricsResource:
+    def on_get(self, req, resp):
+        resp.media = metrics.snapshot()
+
+class AsyncMetricsResource(MetricsResource):
+    async def on_get(self, req, resp):
+        resp.media = metrics.snapshot()
@@ -0,0 +1,60 @@
+import json
+import re
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+AUTOMATED_REF_PREFIX = "refs/heads/secd-"
+MAIN_REF = "refs/heads/main"
+# GitLab puts the top-level "ref" near the start of a push payload
+REF_WINDOW = 4096
+_REF = re.compile(rb'"ref"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+PUSH_SCHEMA = {
+    'event_name': {'type': 'string'},
+    'ref': {'type': 'string'},
+    'user_id': {'type': 'integer'},
+    'project_id': {'type': 'integer'},
+    'project': {
+        'type': 'dict',
+        'schema': {
+            'http_url': {'type': 'string'},
+        }
+    },
+    'commits': {
+        'type': 'list',
+        'schema': {
+            'type': 'dict',
+            'schema': {
+                'id': {'type': 'string'},
+            }
+        }
+    }
+}
+
+def loads(raw: bytes) -> Any:
+    """Parse JSON with orjson when it is installed."""
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def peek_ref(raw: bytes) -> Optional[str]:
+    match = _REF.search(raw, 0, REF_WINDOW)
+    if match is None:
+        return None
+    try:
+        return json.loads(b'"' + match.group(1) + b'"')
+    except ValueError:
+        return None
+
+def reject_reason(raw: bytes) -> Optional[str]:
+    """Why a push can be dropped without parsing it, or None if it needs a full look."""
+    ref = peek_ref(raw)
+    if ref is None:
+        return None
+    if ref.startswith(AUTOMATED_REF_PREFIX):
+        return f"Automated branch push {ref}"
+    if ref != MAIN_REF:
+        return f"Commit is not from main branch: {ref}"
+    return None
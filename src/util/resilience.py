@@ -0,0 +1,183 @@
+import contextlib
+import contextvars
+import functools
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+from app.src.util.setup import get_settings
+
+DEFAULT_POLICY = {
+    "timeout": 30,
+    "retries": 2,
+    "backoff": 0.5,
+    "maxBackoff": 5,
+    "failureThreshold": 5,
+    "resetTimeout": 30,
+}
+BACKEND_DEFAULTS = {
+    # Pushes of large images stream for minutes
+    "docker": {"timeout": 600},
+}
+STATES = {"closed": 0, "half_open": 1, "open": 2}
+# hvac raises these for 4xx answers and carries no status code
+CLIENT_ERRORS = {"InvalidRequest", "Unauthorized", "Forbidden", "InvalidPath", "UnsupportedOperation", "PreconditionFailed"}
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("secd_deadline", default=None)
+
+class CircuitOpenError(Exception):
+    pass
+
+class DeadlineExceededError(Exception):
+    pass
+
+def policy(backend: str) -> Dict[str, Any]:
+    """Settings for backend: defaults < resilience.default < resilience.<backend>."""
+    resilience_settings = get_settings().get('resilience', {})
+    return {
+        **DEFAULT_POLICY,
+        **BACKEND_DEFAULTS.get(backend, {}),
+        **resilience_settings.get('default', {}),
+        **resilience_settings.get(backend, {}),
+    }
+
+def timeout(backend: str) -> float:
+    return policy(backend)["timeout"]
+
+class CircuitBreaker():
+    """Fails calls fast after failure_threshold consecutive failures.
+
+    After reset_timeout one trial call is let through (half open); its
+    outcome closes or reopens the breaker.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before(self) -> None:
+        reset_timeout = policy(self.name)["resetTimeout"]
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= reset_timeout:
+                self._set("half_open")
+            if self.state == "open" or (self.state == "half_open" and self._trial):
+                metrics.inc(f"breaker_shed.{self.name}")
+                raise CircuitOpenError(f"Circuit for {self.name} is open, failing fast")
+            if self.state == "half_open":
+                self._trial = True
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            if self.state != "closed":
+                self._set("closed")
+
+    def abandon(self) -> None:
+        """The call said nothing about the backend; let another trial through."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == "half_open" or self.failures >= policy(self.name)["failureThreshold"]:
+                self.opened_at = time.monotonic()
+                if self.state != "open":
+                    self._set("open")
+
+    def _set(self, state: str) -> None:
+        log(f"Circuit for {self.name} {self.state} -> {state}", "WARNING" if state == "open" else "INFO")
+        self.state = state
+        metrics.set_gauge(f"breaker_state.{self.name}", STATES[state])
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def breaker(backend: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if backend not in _breakers:
+            _breakers[backend] = CircuitBreaker(backend)
+        return _breakers[backend]
+
+@contextlib.contextmanager
+def deadline_budget(seconds: Optional[float]):
+    """Give every backend call made inside the block a shared time budget."""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def call(backend: str, fn: Callable, *args, idempotent: bool = False, **kwargs) -> Any:
+    settings = policy(backend)
+    circuit = breaker(backend)
+    attempts = 1 + (settings["retries"] if idempotent else 0)
+    for attempt in range(attempts):
+        left = remaining()
+        if left is not None and left <= 0:
+            metrics.inc(f"budget_exhausted.{backend}")
+            raise DeadlineExceededError(f"Run deadline budget exhausted before calling {backend}")
+        circuit.before()
+
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except (CircuitOpenError, DeadlineExceededError):
+            # Raised by a nested call; says nothing about this backend
+            circuit.abandon()
+            raise
+        except Exception as e:
+            metrics.observe(f"backend_seconds.{backend}", time.perf_counter() - start)
+            if not _is_backend_failure(e):
+                circuit.success()
+                raise
+            circuit.failure()
+            metrics.inc(f"backend_errors.{backend}")
+            if attempt == attempts - 1:
+                raise
+            # Full jitter keeps retries from many runs from lining up
+            delay = random.uniform(0, min(settings["maxBackoff"], settings["backoff"] * 2 ** attempt))
+            left = remaining()
+            if left is not None:
+                delay = min(delay, max(0.0, left))
+            log(f"{backend} call failed ({e}), retrying in {delay:.2f}s", "WARNING")
+            time.sleep(delay)
+        else:
+            metrics.observe(f"backend_seconds.{backend}", time.perf_counter() - start)
+            circuit.success()
+            return result
+
+def resilient(backend: str, idempotent: bool = False):
+    """Route a service method through call(): breaker, run budget and, if idempotent, retries."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return call(backend, fn, *args, idempotent=idempotent, **kwargs)
+        return wrapper
+    return decorator
+
+def _is_backend_failure(e: Exception) -> bool:
+    # A 4xx answer means the backend is up and said no: no retry, no breaker trip.
+    # Services often re-raise library errors as Exception, so follow the chain.
+    while e is not None:
+        if type(e).__name__ in CLIENT_ERRORS:
+            return False
+        code = getattr(e, "response_code", None)
+        if code is None:
+            code = getattr(getattr(e, "response", None), "status_code", None)
+        if isinstance(code, int) and 400 <= code < 500:
+            return False
+        e = e.__cause__ or e.__context__
+    return True
@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import falcon
+import json
+import requests
+from typing import TYPE_CHECKING, Optional
+
+from app.src.util.coordination import FORWARDED_HEADER, relay
+from app.src.util.deadlines import DeadlineHeap
+from app.src.util.logger import log
+from app.src.util.scheduler import RunScheduler
+from app.src.util.setup import get_settings
+
+if TYPE_CHECKING:
+    from app.src.services.cluster_registry import ClusterRegistry
+    from app.src.util.coordination import Coordinator
+
+class Runs:
+    def __init__(
+        self,
+        scheduler: RunScheduler,
+        clusters: Optional["ClusterRegistry"] = None,
+        deadlines: Optional[DeadlineHeap] = None,
+        coordinator: Optional["Coordinator"] = None
+    ):
+        self.scheduler = scheduler
+        self.clusters = clusters
+        self.deadlines = deadlines
+        self.coordinator = coordinator
+
+    def on_get(self, req, resp, run_id):
+        if not self.forward(req, resp, run_id):
+            self.show(resp, run_id)
+
+    def on_patch(self, req, resp, run_id):
+        self.patch(req, req.get_media(), resp, run_id)
+
+    def show(self, resp, run_id):
+        status = self.scheduler.status(run_id)
+        deadline = self.deadlines.get(run_id) if self.deadlines is not None else None
+        if deadline:
+            status["run_until"] = deadline[1].isoformat()
+        if status["state"] == "unknown" and not deadline:
+            resp.status = falcon.HTTP_404
+        resp.media = status
+
+    def patch(self, req, body, resp, run_id):
+        if not self.forward(req, resp, run_id, json.dumps(body).encode()):
+            self.extend(req.get_header('X-Gitlab-Token'), body, resp, run_id)
+
+    def forward(self, req, resp, run_id, body: Optional[bytes] = None) -> bool:
+        # Another replica's run is only known to that replica
+        if self.coordinator is None or req.get_header(FORWARDED_HEADER) or self.tracks(run_id):
+            return False
+        address = self.coordinator.route(run_id)
+        if address is None:
+            return False
+        headers = {'Content-Type': 'application/json', 'X-Gitlab-Token': req.get_header('X-Gitlab-Token') or ''}
+        try:
+            relay(self.coordinator.forward(address, req.method, req.path, body, headers), resp)
+            return True
+        except requests.RequestException as e:
+            log(f"Failed to forward request for run {run_id} to {address}: {e}", "WARNING")
+            return False
+
+    def tracks(self, run_id: str) -> bool:
+        if self.deadlines is not None and self.deadlines.get(run_id):
+            return True
+        return self.scheduler.status(run_id)["state"] != "unknown"
+
+    def extend(self, token, body, resp, run_id):
+        # Move a run's deadline: {"run_until": "<iso time>"} or {"extend_hours": n}
+        if token != get_settings()['gitlab']['secret']:
+            log("Unauthorized access: Invalid token", "ERROR")
+            raise falcon.HTTPUnauthorized(description="Invalid token")
+
+        deadline = self.deadlines.get(run_id) if self.deadlines is not None else None
+        if not deadline:
+            raise falcon.HTTPNotFound(description=f"Run {run_id} has no deadline")
+        namespace, run_until = deadline
+
+        try:
+            if not isinstance(body, dict):
+                raise ValueError(body)
+            if "run_until" in body:
+                run_until = datetime.datetime.fromisoformat(body["run_until"])
+                if run_until.tzinfo is not None:
+                    # Deadlines are naive local times
+                    run_until = run_until.astimezone().replace(tzinfo=None)
+            else:
+                run_until = run_until + datetime.timedelta(hours=float(body["extend_hours"]))
+        except (KeyError, TypeError, ValueError):
+            raise falcon.HTTPBadRequest(description="Expected run_until or extend_hours")
+
+        self.clusters.for_run(run_id).set_run_until(namespace, run_until, run_id)
+        log(f"Run {run_id} deadline moved to {run_until.isoformat()}")
+        resp.media = {"run_id": run_id, "run_until": run_until.isoformat()}
+
+class AsyncRuns(Runs):
+    async def on_get(self, req, resp, run_id):
+        # Forwarding waits for the owner's reply, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        if self.coordinator is None or not await loop.run_in_executor(None, self.forward, req, resp, run_id):
+            self.show(resp, run_id)
+
+    async def on_patch(self, req, resp, run_id):
+        # set_run_until calls the Kubernetes API, so keep it off the event loop
+        body = await req.get_media()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.patch, req, body, resp, run_id)
@@ -0,0 +1,132 @@
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from app.src.util.logger import log
+from app.src.util.metrics import metrics
+
+class _Ticket():
+    def __init__(self, run_id: str, user_id: str, database_name: Optional[str], priority: int, seq: int):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.database_name = database_name
+        self.priority = priority
+        self.seq = seq
+
+class RunScheduler():
+    """Admission control in front of run provisioning.
+
+    Runs are admitted while the user, database and global quotas allow.
+    Waiting runs are ordered by priority class, then by weighted fair
+    queuing between users (each admission advances the user's virtual time
+    by 1/weight), then by arrival.
+    """
+    def __init__(
+        self,
+        max_runs: Optional[int] = None,
+        max_runs_per_user: Optional[int] = None,
+        max_runs_per_database: Optional[int] = None,
+        user_weights: Optional[Dict[str, float]] = None,
+        short_run_hours: Optional[float] = None,
+    ):
+        self.max_runs = max_runs
+        self.max_runs_per_user = max_runs_per_user
+        self.max_runs_per_database = max_runs_per_database
+        self.user_weights = user_weights or {}
+        self.short_run_hours = short_run_hours
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._running: Dict[str, _Ticket] = {}
+        self._vtime: Dict[str, float] = {}
+        self._clock = 0.0
+
+    def admit(self, run) -> None:
+        """Block until the run may be provisioned."""
+        ticket = _Ticket(
+            run.run_id, run.keycloak_user_id, run.database_name,
+            self._priority(run.run_for), next(self._seq)
+        )
+        with self._cond:
+            self._waiting.append(ticket)
+            self._update_gauges()
+            if self._next() is not ticket:
+                log(f"Run {run.run_id} queued at position {self._position(ticket)}")
+            while self._next() is not ticket:
+                if ticket not in self._waiting:
+                    raise Exception(f"Run {run.run_id} withdrawn from the queue")
+                self._cond.wait()
+            self._waiting.remove(ticket)
+            self._start(ticket)
+            self._cond.notify_all()
+
+    def release(self, run_id: str) -> None:
+        with self._cond:
+            if self._running.pop(run_id, None) is None:
+                self._waiting = [t for t in self._waiting if t.run_id != run_id]
+            self._update_gauges()
+            self._cond.notify_all()
+
+    def restore(self, run_id: str, user_id: str, database_name: Optional[str]) -> None:
+        """Count a run that was already provisioned before a restart."""
+        with self._cond:
+            self._running[run_id] = _Ticket(run_id, user_id, database_name, 0, next(self._seq))
+            self._update_gauges()
+
+    def status(self, run_id: str) -> Dict[str, Any]:
+        with self._cond:
+            if run_id in self._running:
+                return {"run_id": run_id, "state": "running", "position": 0}
+            for ticket in self._waiting:
+                if ticket.run_id == run_id:
+                    return {"run_id": run_id, "state": "queued", "position": self._position(ticket)}
+            return {"run_id": run_id, "state": "unknown", "position": None}
+
+    def run_ids(self) -> Set[str]:
+        """Runs holding a slot or waiting for one."""
+        with self._cond:
+            return set(self._running) | {ticket.run_id for ticket in self._waiting}
+
+    # Helper methods
+    def _priority(self, run_for: Any) -> int:
+        if self.short_run_hours is None or run_for is None:
+            return 0
+        return 0 if float(run_for) <= self.short_run_hours else 1
+
+    def _sort_key(self, ticket: _Ticket):
+        start_tag = max(self._vtime.get(ticket.user_id, 0.0), self._clock)
+        return (ticket.priority, start_tag, ticket.seq)
+
+    def _position(self, ticket: _Ticket) -> int:
+        return sorted(self._waiting, key=self._sort_key).index(ticket) + 1
+
+    def _next(self) -> Optional[_Ticket]:
+        for ticket in sorted(self._waiting, key=self._sort_key):
+            if self._fits(ticket):
+                return ticket
+        return None
+
+    def _fits(self, ticket: _Ticket) -> bool:
+        running = self._running.values()
+        if self.max_runs is not None and len(self._running) >= self.max_runs:
+            return False
+        if self.max_runs_per_user is not None:
+            if sum(1 for t in running if t.user_id == ticket.user_id) >= self.max_runs_per_user:
+                return False
+        if self.max_runs_per_database is not None and ticket.database_name:
+            if sum(1 for t in running if t.database_name == ticket.database_name) >= self.max_runs_per_database:
+                return False
+        return True
+
+    def _start(self, ticket: _Ticket) -> None:
+        start_tag = max(self._vtime.get(ticket.user_id, 0.0), self._clock)
+        self._clock = start_tag
+        self._vtime[ticket.user_id] = start_tag + 1.0 / float(self.user_weights.get(ticket.user_id, 1.0))
+        self._running[ticket.run_id] = ticket
+        metrics.inc("runs_admitted")
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("runs_queued", len(self._waiting))
+        metrics.set_gauge("runs_running", len(self._running))
@@ -1,81 +1,193 @@
+import datetime
 import falcon
+import falcon.asgi
 import threading
-from kubernetes import client, config
+from typing import TYPE_CHECKING, Optional
 from wsgiref.simple_server import make_server
 
-from app.src.util.setup import load_settings, get_settings
+from app.src.util.setup import load_settings, get_settings, watch_settings
 from app.src.util.logger import log
 from app.src.util.hook import Hook
+from app.src.util.async_hook import AsyncHook
+from app.src.util.backends import BackendRegistry, Health, AsyncHealth
 from app.src.util.daemon import Daemon
+from app.src.util.deadlines import DeadlineHeap
+from app.src.util.delivery_index import DeliveryIndex
+from app.src.util.metrics import MetricsResource, AsyncMetricsResource
+from app.src.util.runs import Runs, AsyncRuns
+from app.src.util.scheduler import RunScheduler
 
-from app.src.services.docker_service import DockerService
-from app.src.services.gitlab_service import GitlabService
-from app.src.services.keycloak_service import KeycloakService
 from app.src.services.hook_service import HookService
-from app.src.services.vault_service import VaultService
-from app.src.services.kubernetes_service import KubernetesService
-from app.src.services.kubernetes_services.helm_service import HelmService
-from app.src.services.kubernetes_services.namespace_service import NamespaceService
-from app.src.services.kubernetes_services.persistent_volume_service import PersistentVolumeService
-from app.src.services.kubernetes_services.pod_service import PodService
-from app.src.services.kubernetes_services.secret_service import SecretService
-from app.src.services.kubernetes_services.service_account_service import ServiceAccountService
+from app.src.services.async_hook_service import AsyncHookService
+from app.src.services.workspace_service import WorkspaceService
+from app.src.services.vault_lease_service import GRANTS_ANNOTATION, VaultLeaseService
 from app.src.util.quiet_handler import QuietHandler
 
+if TYPE_CHECKING:
+    from app.src.services.cluster_registry import ClusterRegistry
+    from app.src.services.kubernetes_service import KubernetesService
+    from app.src.services.output_store import OutputStore
+    from app.src.services.image_gc_service import ImageGcService
+    from app.src.util.coordination import Coordinator
+
+# Seconds between attempts to restore runs while a cluster cannot be listed
+RESTORE_RETRY = 60
 
 class Server:
     def __init__(self):
         log("Starting server....")
         load_settings()
+        watch_settings()
 
         self.apps = []
         self.threads = []
+        self.server_settings = get_settings().get('server', {})
+        self.mode = self.server_settings.get('mode', 'wsgi')
+        self.port = self.server_settings.get('port', 8080)
+        self.deadlines = DeadlineHeap()
+        self.restore_lock = threading.Lock()
+        self.restored = False
+        self.restore_retry = None
+
+        # Instantiate core services concurrently; lazy ones on first use
+        backend_settings = get_settings().get('backends', {})
+        lazy = set(backend_settings.get('lazy', []))
+        self.backends = BackendRegistry(timeout=backend_settings.get('timeout', 30))
+        self.clusters = self.backends.register('kubernetes', self.init_kubernetes, lazy='kubernetes' in lazy)
+        self.keycloak_service = self.backends.register('keycloak', self.init_keycloak, lazy='keycloak' in lazy)
+        self.docker_service = self.backends.register('docker', self.init_docker, lazy='docker' in lazy)
+        self.gitlab_service = self.backends.register('gitlab', self.init_gitlab, lazy='gitlab' in lazy)
+        self.vault_service = self.backends.register('vault', self.init_vault, lazy='vault' in lazy)
+        self.backends.start()
+
+        self.init_scheduler()
+        self.output_store = self.init_output_store()
+        self.image_gc = self.init_image_gc()
 
-        # Instantiate core services
-        self.init_kubernetes()
-        self.keycloak_service = KeycloakService()
-        self.docker_service = DockerService()
-        self.gitlab_service = GitlabService()
-        self.vault_service = VaultService()
+        workspace_settings = get_settings().get('workspace', {})
+        self.workspaces = WorkspaceService(
+            root=get_settings()['path']['repoPath'],
+            active_runs=self.active_runs,
+            high_watermark=workspace_settings.get('highWatermark'),
+            low_watermark=workspace_settings.get('lowWatermark'),
+            sweep_interval=workspace_settings.get('sweepInterval', 600),
+            orphan_age_seconds=workspace_settings.get('orphanAgeHours', 6) * 3600,
+            owns=self.owns
+        )
+
+        self.vault_leases = VaultLeaseService(
+            vault_service=self.vault_service,
+            deadlines=self.deadlines,
+            renew_interval=get_settings().get('vaultLeases', {}).get('renewInterval', 300)
+        )
+        self.coordinator = self.init_coordinator()
 
         # Instantiate resources services
         self.hook_service = HookService(
             keycloak_service=self.keycloak_service,
             gitlab_service=self.gitlab_service,
-            kubernetes_service=self.kubernetes_service,
+            clusters=self.clusters,
             docker_service=self.docker_service,
-            vault_service=self.vault_service
+            vault_service=self.vault_service,
+            scheduler=self.scheduler,
+            workspaces=self.workspaces,
+            vault_leases=self.vault_leases
         )
 
-        self.hook_resource = Hook(hook_service=self.hook_service)
+        dedup_settings = get_settings().get('dedup', {})
+        self.delivery_index = DeliveryIndex(
+            ttl=dedup_settings.get('ttl', 3600),
+            max_entries=dedup_settings.get('maxEntries', 10000)
+        )
+
+        debounce_window = get_settings().get('debounce', {}).get('window', 0)
+
+        if self.mode == 'asgi':
+            self.async_hook_service = AsyncHookService(
+                hook_service=self.hook_service,
+                max_workers=self.server_settings.get('workers', 16),
+                stage_timeouts=self.server_settings.get('stageTimeouts')
+            )
+            self.hook_resource = AsyncHook(
+                async_hook_service=self.async_hook_service,
+                delivery_index=self.delivery_index,
+                debounce_window=debounce_window,
+                workspaces=self.workspaces,
+                coordinator=self.coordinator
+            )
+            self.metrics_resource = AsyncMetricsResource()
+            self.runs_resource = AsyncRuns(scheduler=self.scheduler, clusters=self.clusters, deadlines=self.deadlines, coordinator=self.coordinator)
+            self.health_resource = AsyncHealth(registry=self.backends, coordinator=self.coordinator)
+        else:
+            self.hook_resource = Hook(
+                hook_service=self.hook_service,
+                delivery_index=self.delivery_index,
+                debounce_window=debounce_window,
+                workspaces=self.workspaces,
+                coordinator=self.coordinator
+            )
+            self.metrics_resource = MetricsResource()
+            self.runs_resource = Runs(scheduler=self.scheduler, clusters=self.clusters, deadlines=self.deadlines, coordinator=self.coordinator)
+            self.health_resource = Health(registry=self.backends, coordinator=self.coordinator)
 
-        self.create_app('/v1/hook', self.hook_resource, 8080)
+        self.create_app('/v1/hook', self.hook_resource, self.port)
+        self.create_app('/v1/metrics', self.metrics_resource, self.port)
+        self.create_app('/v1/runs/{run_id}', self.runs_resource, self.port)
+        self.create_app('/v1/health', self.health_resource, self.port)
 
     def create_app(self, path, resource, port):
-        app = falcon.App()
+        # Routes on the same port share one app
+        app = next((app for app, app_port in self.apps if app_port == port), None)
+        if app is None:
+            app = falcon.asgi.App() if self.mode == 'asgi' else falcon.App()
+            self.apps.append((app, port))
         app.add_route(path, resource)
-        self.apps.append((app, port))
 
     def serve_app(self, app, port):
         try:
-            with make_server('', port, app, handler_class=QuietHandler) as httpd:
-                httpd.serve_forever()
+            if self.mode == 'asgi':
+                import uvicorn
+                # One event loop serves intake and drives every in-flight run
+                uvicorn.Server(uvicorn.Config(app, host='0.0.0.0', port=port, log_level='warning')).run()
+            else:
+                with make_server('', port, app, handler_class=QuietHandler) as httpd:
+                    httpd.serve_forever()
         except Exception as e:
             log(f"Error starting server: {e}", "ERROR")
 
     def run(self):
         log("Running server...")
         try:
-            microk8s_cleanup = Daemon(self.kubernetes_service, self.gitlab_service)
-            microk8s_cleanup_thread = threading.Thread(target=microk8s_cleanup.start_microk8s_cleanup)
-            microk8s_cleanup_thread.start()
-
-            # Serve each app on different ports in separate threads
+            # Intake only needs settings, so serve before the backends are ready
             for app, port in self.apps:
                 thread = threading.Thread(target=self.serve_app, args=(app, port))
                 self.threads.append(thread)
                 thread.start()
 
+            threading.Thread(target=self.backends.wait, daemon=True).start()
+            if self.coordinator:
+                # Runs change owner when replicas join or leave
+                self.coordinator.start()
+                self.coordinator.add_listener(self.on_coordination_change)
+            threading.Thread(target=self.restore_runs, daemon=True).start()
+            self.workspaces.start()
+            self.vault_leases.start()
+
+            microk8s_cleanup = Daemon(
+                self.clusters,
+                self.gitlab_service,
+                self.scheduler,
+                self.output_store,
+                deadlines=self.deadlines,
+                image_gc=self.image_gc,
+                workspaces=self.workspaces,
+                vault_leases=self.vault_leases,
+                coordinator=self.coordinator,
+                scan_interval=get_settings().get('daemon', {}).get('scanInterval', 300)
+            )
+            microk8s_cleanup_thread = threading.Thread(target=microk8s_cleanup.start_microk8s_cleanup)
+            microk8s_cleanup_thread.start()
+
             # Join threads to keep the main thread running
             for thread in self.threads:
                 thread.join()
@@ -83,24 +195,228 @@ class Server:
         except Exception as e:
             log(f"Error starting Daemon thread: {e}", "ERROR")
     
-    def init_kubernetes(self):
-        self.config_path = get_settings()['k8s']['configPath']
-        self.config = client.Configuration()
-        config.load_kube_config(config_file=self.config_path, client_configuration=self.config)
-        self.config.ssl_ca_cert = '/var/snap/microk8s/current/certs/ca.crt' 
-
-        namespace_service = NamespaceService(config=self.config)    
-        pv_service = PersistentVolumeService(config=self.config)
-        pod_service = PodService(config=self.config)
-        secret_service = SecretService(config=self.config)
-        helm_service = HelmService(config=self.config)
-        service_account_service = ServiceAccountService(config=self.config)
-
-        self.kubernetes_service = KubernetesService(
+    def init_scheduler(self):
+        scheduler_settings = get_settings().get('scheduler', {})
+        self.scheduler = RunScheduler(
+            max_runs=scheduler_settings.get('maxRuns'),
+            max_runs_per_user=scheduler_settings.get('maxRunsPerUser'),
+            max_runs_per_database=scheduler_settings.get('maxRunsPerDatabase'),
+            user_weights=scheduler_settings.get('userWeights'),
+            short_run_hours=scheduler_settings.get('shortRunHours'),
+        )
+
+    def init_output_store(self) -> Optional["OutputStore"]:
+        store_settings = get_settings().get('outputStore', {})
+        if not store_settings.get('enabled', False):
+            return None
+        from app.src.services.output_store import OutputStore
+        root = store_settings.get('path') or f"{get_settings()['path']['repoPath']}/.objects"
+        return OutputStore(
+            root,
+            reflink=store_settings.get('reflink', False),
+            retention_seconds=store_settings.get('retentionHours', 24) * 3600
+        )
+
+    def init_image_gc(self) -> Optional["ImageGcService"]:
+        gc_settings = get_settings().get('imageGc', {})
+        if not gc_settings.get('enabled', False):
+            return None
+        from app.src.services.image_gc_service import ImageGcService, RegistryClient
+        reg_settings = get_settings()['registry']
+        registry = None
+        if gc_settings.get('deleteFromRegistry', True):
+            registry = RegistryClient(
+                api_url=gc_settings.get('registryApiUrl') or f"https://{reg_settings['url']}",
+                username=reg_settings.get('username'),
+                password=reg_settings.get('password'),
+                ca_path=reg_settings.get('ca_path')
+            )
+        return ImageGcService(
+            docker_service=self.docker_service,
+            registry=registry,
+            registry_project=reg_settings['project'],
+            active_runs=self.active_runs,
+            max_age_hours=gc_settings.get('maxAgeHours'),
+            keep_per_project=gc_settings.get('keepPerProject'),
+            disk_watermark=gc_settings.get('diskWatermark'),
+            disk_path=gc_settings.get('diskPath', '/var/lib/docker'),
+            grace_seconds=gc_settings.get('graceSeconds', 3600),
+            interval=gc_settings.get('interval', 600),
+            owns=self.owns
+        )
+
+    def init_coordinator(self) -> Optional["Coordinator"]:
+        coordination_settings = get_settings().get('coordination', {})
+        if not coordination_settings.get('enabled', False):
+            return None
+        import os
+        import socket
+        from app.src.util.coordination import Coordinator, FileLeaseStore, KubernetesLeaseStore
+        if coordination_settings.get('backend', 'file') == 'kubernetes':
+            from app.src.services.cluster_registry import build_configuration, cluster_settings
+            # The leases live on the first configured cluster
+            store = KubernetesLeaseStore(build_configuration(cluster_settings()[0]), coordination_settings.get('namespace', 'default'))
+        else:
+            store = FileLeaseStore(coordination_settings.get('path') or f"{get_settings()['path']['repoPath']}/.coordination")
+        hostname = socket.gethostname()
+        return Coordinator(
+            store=store,
+            identity=coordination_settings.get('identity') or f"{hostname}-{os.getpid()}".lower(),
+            address=coordination_settings.get('address') or f"http://{hostname}:{self.port}",
+            lease_duration=coordination_settings.get('leaseDuration', 15),
+            renew_interval=coordination_settings.get('renewInterval', 5),
+            vnodes=coordination_settings.get('vnodes', 64)
+        )
+
+    def on_coordination_change(self, leader: bool, members_changed: bool):
+        if members_changed:
+            threading.Thread(target=self.restore_runs, daemon=True).start()
+
+    def active_runs(self):
+        # A run's namespace may outlive its deadline, and other replicas' runs only show up as namespaces
+        return self.scheduler.run_ids() | self.deadlines.run_ids() | self.clusters.run_ids()
+
+    def owns(self, run_id: str) -> bool:
+        return self.coordinator is None or self.coordinator.owns(run_id)
+
+    def hand_off(self, run_id: str):
+        # The new owner restores the run from its namespace
+        self.deadlines.remove(run_id)
+        self.scheduler.release(run_id)
+        self.vault_leases.forget(run_id)
+        self.clusters.release(run_id)
+        self.clusters.cache_service.forget(run_id)
+        log(f"Run {run_id} handed off to replica {self.coordinator.owner(run_id)}")
+
+    def restore_runs(self):
+        with self.restore_lock:
+            restored = self._restore_runs()
+            if restored and not self.restored:
+                self.restored = True
+                self.start_reclaimers()
+            retry = self.restore_retry
+            if not self.restored and (retry is None or retry is threading.current_thread() or not retry.is_alive()):
+                # Reclaimers wait for a complete restore, so keep trying
+                self.restore_retry = threading.Timer(RESTORE_RETRY, self.restore_runs)
+                self.restore_retry.daemon = True
+                self.restore_retry.start()
+
+    def start_reclaimers(self):
+        # Started only once every existing run is known, or they would reclaim its data
+        self.clusters.cache_service.start()
+        self.workspaces.start_sweep()
+        if self.output_store:
+            self.output_store.start()
+        if self.image_gc:
+            self.image_gc.start()
+
+    def _restore_runs(self) -> bool:
+        from app.src.services.kubernetes_services.namespace_service import run_id_of
+        # Count runs that were provisioned before this process started, and
+        # with several replicas, the runs this one owns after members changed
+        try:
+            namespaces, unlisted = self.clusters.secd_namespaces()
+            for cluster, namespace in namespaces:
+                annotations = namespace.metadata.annotations or {}
+                labels = namespace.metadata.labels or {}
+                if 'rununtil' in annotations:
+                    run_id = run_id_of(namespace)
+                    if self.coordinator and not self.coordinator.owns(run_id):
+                        if self.deadlines.get(run_id):
+                            self.hand_off(run_id)
+                        continue
+                    if self.deadlines.get(run_id):
+                        continue
+                    self.clusters.assign(run_id, cluster)
+                    self.scheduler.restore(run_id, annotations.get('userid'), labels.get('name'))
+                    self.deadlines.set(run_id, namespace.metadata.name, datetime.datetime.fromisoformat(annotations['rununtil']))
+                    # File database runs never got Vault grants
+                    if labels.get('name') and annotations.get(GRANTS_ANNOTATION):
+                        self.vault_leases.track(run_id, labels['name'], namespace.metadata.name)
+                    if 'cachedir' in annotations:
+                        self.clusters.cache_service.restore(run_id, annotations.get('userid'), annotations['cachedir'])
+            return not unlisted
+        except Exception as e:
+            log(f"Failed to restore existing runs: {e}", "ERROR")
+            return False
+
+    # Backend factories import their client stacks on first use
+    def init_keycloak(self):
+        from app.src.services.keycloak_service import KeycloakService
+        return KeycloakService()
+
+    def init_docker(self):
+        from app.src.services.docker_service import DockerService
+        return DockerService()
+
+    def init_gitlab(self):
+        from app.src.services.gitlab_service import GitlabService
+        return GitlabService()
+
+    def init_vault(self):
+        from app.src.services.vault_service import VaultService
+        return VaultService()
+
+    def init_kubernetes(self) -> "ClusterRegistry":
+        from app.src.services.cluster_registry import ClusterRegistry, build_configuration, cluster_settings
+        from app.src.services.cache_service import CacheService
+
+        # The cache lives on this host, so every cluster shares one
+        cache_settings = get_settings().get('cache', {})
+        user_quota_gb = cache_settings.get('userQuotaGB')
+        global_quota_gb = cache_settings.get('globalQuotaGB')
+        cache_service = CacheService(
+            cache_root=get_settings()['path']['cachePath'],
+            index_path=cache_settings.get('indexPath'),
+            user_quota_bytes=int(user_quota_gb * 1024 ** 3) if user_quota_gb is not None else None,
+            global_quota_bytes=int(global_quota_gb * 1024 ** 3) if global_quota_gb is not None else None,
+            evict_interval=cache_settings.get('evictInterval', 300),
+            # Other replicas' runs use caches on this host too
+            in_use=lambda: self.clusters.caches_in_use() if self.coordinator else set()
+        )
+
+        clusters = {}
+        max_runs = {}
+        for cluster in cluster_settings():
+            clusters[cluster['name']] = self.init_cluster(build_configuration(cluster), cache_service)
+            max_runs[cluster['name']] = cluster.get('maxRuns')
+            log(f"Kubernetes cluster {cluster['name']} registered")
+        return ClusterRegistry(clusters, self.deadlines, cache_service, max_runs)
+
+    def init_cluster(self, config, cache_service) -> "KubernetesService":
+        from app.src.services.kubernetes_service import KubernetesService
+        from app.src.services.kubernetes_services.helm_service import HelmService
+        from app.src.services.kubernetes_services.namespace_service import NamespaceService
+        from app.src.services.kubernetes_services.persistent_volume_service import PersistentVolumeService
+        from app.src.services.kubernetes_services.pod_service import PodService
+        from app.src.services.kubernetes_services.secret_service import SecretService
+        from app.src.services.kubernetes_services.service_account_service import ServiceAccountService
+        from app.src.services.kubernetes_services.gpu_capacity_service import GpuCapacityService
+        from app.src.services.kubernetes_services.warm_pool_service import WarmPoolService
+
+        namespace_service = NamespaceService(config=config)
+        pv_service = PersistentVolumeService(config=config)
+        pod_service = PodService(config=config)
+        secret_service = SecretService(config=config)
+        helm_service = HelmService(config=config)
+        service_account_service = ServiceAccountService(config=config)
+        gpu_service = GpuCapacityService(config=config)
+
+        warm_pool = None
+        pool_size = get_settings().get('warmPool', {}).get('size', 0)
+        if pool_size > 0:
+            warm_pool = WarmPoolService(config=config, size=pool_size)
+            warm_pool.start()
+
+        return KubernetesService(
             namespace_service=namespace_service,
             pod_service=pod_service,
             pv_service=pv_service,
             secret_service=secret_service,
             helm_service=helm_service,
-            service_account_service=service_account_service
-        )
\ No newline at end of file
+            service_account_service=service_account_service,
+            gpu_service=gpu_service,
+            cache_service=cache_service,
+            warm_pool=warm_pool,
+            deadlines=self.deadlines
+        )
@@ -1,21 +1,37 @@
 import yaml
 import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Optional
 from cerberus import Validator
 from dotenv import load_dotenv
 from app.src.util.logger import log
 
 load_dotenv()
-settings = {}
 
-def get_settings():
-    global settings
-    if settings == {}:
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'config', 'settings-schema.yml')
+RELOAD_INTERVAL = 5
+
+# Replaced wholesale on reload, never mutated, so readers need no lock
+settings: Optional[Mapping[str, Any]] = None
+
+_validator: Optional[Validator] = None
+_config_path: Optional[str] = None
+_config_mtime: Optional[float] = None
+_listeners: List[Callable[[Mapping[str, Any], Mapping[str, Any]], None]] = []
+_watcher: Optional[threading.Thread] = None
+
+def get_settings() -> Mapping[str, Any]:
+    if settings is None:
         load_settings()
     return settings
 
 def load_settings(config_path=None):
+    global settings, _config_path, _config_mtime
+
     if config_path is None:
-        config_path = os.getenv("CONFIG_FILE")
+        config_path = _config_path or os.getenv("CONFIG_FILE")
         if not config_path:
             raise Exception("CONFIG_FILE environment variable is not set and no config_path provided")
 
@@ -23,22 +39,65 @@ def load_settings(config_path=None):
         log(f'Config file not found: {config_path}', "ERROR")
         raise Exception(f'Config file not found: {config_path}')
 
+    mtime = os.stat(config_path).st_mtime
     with open(config_path, 'r') as yaml_file:
         loaded_yaml = yaml.load(yaml_file, Loader=yaml.FullLoader)
 
-    schema_path = "/home/cloud/secd/app/config/settings-schema.yml"
-    if not os.path.exists(schema_path):
-        log(f'Schema file not found: {schema_path}', "ERROR")
-        raise Exception(f'Schema file not found: {schema_path}')
+    v = _get_validator()
+    if not v.validate(loaded_yaml or {}):
+        log(f'Invalid config file: {v.errors}', "ERROR")
+        raise Exception(f'Invalid config file: {v.errors}')
 
-    with open(schema_path, 'r') as schema_file:
-        schema = yaml.load(schema_file, Loader=yaml.FullLoader)
+    previous = settings
+    settings = _freeze(loaded_yaml)
+    _config_path = config_path
+    _config_mtime = mtime
 
-    """
-    v = Validator(schema) # type: ignore
-    if not v.validate(loaded_yaml): # type: ignore
-        log(f'Invalid config file: {v.errors}', "ERROR")
-        raise Exception(f'Invalid config file: {v.errors}') # type: ignore
-    """
-    global settings
-    settings = loaded_yaml
+    if previous is not None:
+        for listener in list(_listeners):
+            try:
+                listener(previous, settings)
+            except Exception as e:
+                log(f'Error in settings reload listener: {e}', "ERROR")
+
+def add_reload_listener(listener: Callable[[Mapping[str, Any], Mapping[str, Any]], None]):
+    """Register listener(old, new), called after the settings are swapped."""
+    _listeners.append(listener)
+
+def watch_settings(interval: float = RELOAD_INTERVAL):
+    """Poll the config file and reload it when it changes."""
+    global _watcher
+    if _watcher is not None:
+        return
+    _watcher = threading.Thread(target=_watch, args=(interval,), daemon=True)
+    _watcher.start()
+
+def _watch(interval: float):
+    while True:
+        time.sleep(interval)
+        try:
+            if _config_path and os.stat(_config_path).st_mtime != _config_mtime:
+                load_settings(_config_path)
+                log(f'Reloaded settings from {_config_path}')
+        except Exception as e:
+            # Keep serving the last valid settings
+            log(f'Failed to reload settings: {e}', "ERROR")
+
+def _get_validator() -> Validator:
+    global _validator
+    if _validator is None:
+        if not os.path.exists(SCHEMA_PATH):
+            log(f'Schema file not found: {SCHEMA_PATH}', "ERROR")
+            raise Exception(f'Schema file not found: {SCHEMA_PATH}')
+
+        with open(SCHEMA_PATH, 'r') as schema_file:
+            schema = yaml.load(schema_file, Loader=yaml.FullLoader)
+        _validator = Validator(schema) # type: ignore
+    return _validator
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value